@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""Benchmark the analytics ETL steps and exports on synthetic data."""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from config import (
+    configure_logging, validate_config, BASE_DIR, DATABASE_URL, BENCHMARK_DIR, BENCHMARK_REPEAT,
+    BENCHMARK_SEED, BENCHMARK_REGRESSION_THRESHOLD,
+)
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the results file changes
+RESULTS_VERSION = 1
+
+EXPORT_FORMATS = ('csv', 'json', 'parquet')
+
+# Metrics compared against a baseline (--compare); higher is worse
+REGRESSION_METRICS = ('latency_median', 'peak_rss_bytes')
+
+
+@dataclass
+class Benchmark:
+    """Measurements of one ETL step or export over all its runs."""
+    kind: str  # 'etl' or 'export'
+    name: str
+    output_format: Optional[str] = None
+    runs: List[Dict[str, Any]] = field(default_factory=list)
+    
+    @property
+    def key(self) -> str:
+        return '.'.join(part for part in (self.kind, self.name, self.output_format) if part)
+    
+    def summary(self, orders: int) -> Dict[str, Any]:
+        """Aggregate the runs: latency spread, throughput and peak memory."""
+        succeeded = [run for run in self.runs if run['success']]
+        latencies = [run['latency'] for run in succeeded]
+        summary = {
+            'key': self.key,
+            'kind': self.kind,
+            'name': self.name,
+            'format': self.output_format,
+            'success': bool(self.runs) and len(succeeded) == len(self.runs),
+            'errors': [run['error'] for run in self.runs if run['error']],
+            'runs': self.runs,
+        }
+        if not latencies:
+            return summary
+        
+        median = statistics.median(latencies)
+        rows = max(run['rows_written'] or run['rows_read'] for run in succeeded)
+        summary.update({
+            'latency_median': round(median, 4),
+            'latency_min': round(min(latencies), 4),
+            'latency_max': round(max(latencies), 4),
+            'latency_stdev': round(statistics.stdev(latencies), 4) if len(latencies) > 1 else 0.0,
+            'orders_per_second': round(orders / median, 1) if median else None,
+            'rows': rows,
+            'rows_per_second': round(rows / median, 1) if median else None,
+            'queries': succeeded[-1]['queries'],
+            'db_time_median': round(statistics.median(run['db_time'] for run in succeeded), 4),
+            'peak_rss_bytes': max(run['peak_rss_bytes'] for run in self.runs),
+        })
+        return summary
+
+
+def is_local_database(dsn: Optional[str]) -> bool:
+    """True if every host of the DSN is this machine (or a Unix socket)."""
+    from psycopg2.extensions import parse_dsn
+    
+    hosts = parse_dsn(dsn or '').get('host', '')
+    return all(
+        host in ('', 'localhost', '127.0.0.1', '::1') or host.startswith('/')
+        for host in hosts.split(',')
+    )
+
+
+def _preload(kind: str, name: str):
+    """Import what a step needs up front, so import time is not measured."""
+    import pandas  # noqa: F401  (used by every ETL module and export)
+    
+    if kind == 'export':
+        import export_data  # noqa: F401
+    elif importlib.util.find_spec(f'etl_{name}'):
+        importlib.import_module(f'etl_{name}')
+
+
+def run_worker(kind: str, name: str, output_format: str, result_file: str) -> bool:
+    """
+    Run one ETL step or export in this (child) process and save its timing.
+    
+    ETL steps run with full_refresh, so every repetition does the same work;
+    exports write to a temporary directory that is removed afterwards.
+    """
+    from query_metrics import StepAggregator, add_collector, remove_collector
+    
+    _preload(kind, name)
+    aggregator = add_collector(StepAggregator())
+    result = {'success': False, 'error': None, 'rows_written': None, 'bytes_written': None}
+    start = time.perf_counter()
+    try:
+        if kind == 'etl':
+            from etl_aggregate import ETL_STEPS, run_step
+            
+            step = run_step(ETL_STEPS[name], full_refresh=True)
+            result['success'], result['error'] = step.success, step.error
+            counted = [output['rows'] for output in step.outputs if output['rows'] is not None]
+            result['rows_written'] = sum(counted) if counted else None
+        else:
+            from export_data import run_export
+            
+            with tempfile.TemporaryDirectory() as output_dir:
+                path = run_export(name, output_format, Path(output_dir))
+                result['success'] = True
+                result['bytes_written'] = path.stat().st_size if path else 0
+    except Exception as e:
+        logger.error(f"{kind} {name} failed: {e}", exc_info=True)
+        result['error'] = str(e)
+    result['latency'] = time.perf_counter() - start
+    remove_collector(aggregator)
+    
+    steps = aggregator.steps.values()
+    result['queries'] = sum(stats['queries'] for stats in steps)
+    result['rows_read'] = sum(stats['rows'] for stats in steps)
+    result['db_time'] = sum(stats['wall_time'] for stats in steps)
+    with open(result_file, 'w') as f:
+        json.dump(result, f)
+    return result['success']
+
+
+def measure(kind: str, name: str, output_format: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Run one step or export in a fresh Python process and measure it.
+    
+    A separate process per run keeps runs independent (no warm caches or
+    leftover allocations) and gives each its own peak resident memory.
+    """
+    fd, result_file = tempfile.mkstemp(prefix='benchmark-', suffix='.json')
+    os.close(fd)
+    command = [
+        sys.executable, str(Path(__file__).resolve()), '--worker', kind, name,
+        '--result-file', result_file, '--format', output_format or 'csv',
+    ]
+    try:
+        process = subprocess.Popen(command, cwd=BASE_DIR)
+        # wait4() returns the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        with open(result_file) as f:
+            content = f.read()
+    finally:
+        os.unlink(result_file)
+    
+    result = json.loads(content) if content else {
+        'success': False, 'error': f'worker exited with {process.returncode}', 'latency': 0.0,
+        'rows_written': None, 'bytes_written': None, 'queries': 0, 'rows_read': 0, 'db_time': 0.0,
+    }
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    result['peak_rss_bytes'] = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    result['latency'] = round(result['latency'], 4)
+    result['db_time'] = round(result['db_time'], 4)
+    return result
+
+
+def run_benchmarks(
+    steps: List[str],
+    exports: List[str],
+    formats: List[str],
+    repeat: int = BENCHMARK_REPEAT
+) -> List[Benchmark]:
+    """Measure every ETL step, then every export in every format, ``repeat`` times."""
+    benchmarks = [Benchmark('etl', name) for name in steps]
+    benchmarks += [
+        Benchmark('export', name, output_format)
+        for name in exports for output_format in formats
+    ]
+    for benchmark in benchmarks:
+        for attempt in range(1, repeat + 1):
+            logger.info(f"Benchmarking {benchmark.key} ({attempt}/{repeat})")
+            run = measure(benchmark.kind, benchmark.name, benchmark.output_format)
+            benchmark.runs.append(run)
+            if not run['success']:
+                logger.error(f"{benchmark.key} failed: {run['error']}")
+                break
+    return benchmarks
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _server_version() -> Optional[str]:
+    from db_utils import execute_query
+    
+    result = execute_query("SHOW server_version;")
+    return result[0]['server_version'] if result else None
+
+
+def environment() -> Dict[str, Any]:
+    """Where the benchmark ran, so results are only compared like for like."""
+    return {
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'postgres': _server_version(),
+        'platform': platform.platform(),
+        'host': platform.node(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def log_results(results: List[Dict[str, Any]]):
+    logger.info("=" * 80)
+    logger.info("Benchmark Results (median of runs)")
+    logger.info("=" * 80)
+    logger.info(
+        f"{'benchmark':<28} {'latency':>9} {'min':>9} {'max':>9} {'orders/s':>12} "
+        f"{'rows/s':>12} {'peak RSS':>10}"
+    )
+    for result in results:
+        if 'latency_median' not in result:
+            logger.info(f"{result['key']:<28} FAILED: {'; '.join(result['errors'])}")
+            continue
+        logger.info(
+            f"{result['key']:<28} {result['latency_median']:>8.3f}s {result['latency_min']:>8.3f}s "
+            f"{result['latency_max']:>8.3f}s {result['orders_per_second'] or 0:>12,.0f} "
+            f"{result['rows_per_second'] or 0:>12,.0f} {result['peak_rss_bytes'] / 2**20:>6.0f} MiB"
+        )
+
+
+def compare_results(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float = BENCHMARK_REGRESSION_THRESHOLD
+) -> List[str]:
+    """
+    Compare results with a baseline results file.
+    
+    Args:
+        current: Results document of this run
+        baseline: Results document of an earlier run
+        threshold: Relative increase of a metric that counts as a regression
+    
+    Returns:
+        Descriptions of the regressions found (empty if none)
+    """
+    if current['dataset']['orders'] != baseline['dataset']['orders']:
+        logger.warning(
+            f"Baseline has {baseline['dataset']['orders']:,} orders, this run "
+            f"{current['dataset']['orders']:,}: results are not comparable"
+        )
+    
+    previous = {result['key']: result for result in baseline['results']}
+    regressions = []
+    logger.info(f"Compared with baseline {baseline.get('started_at')} ({baseline['environment'].get('git_commit')}):")
+    for result in current['results']:
+        base = previous.get(result['key'])
+        if base is None or 'latency_median' not in base:
+            continue
+        if 'latency_median' not in result:
+            regressions.append(f"{result['key']}: failed, baseline succeeded")
+            continue
+        changes = []
+        for metric in REGRESSION_METRICS:
+            if not base[metric]:
+                continue
+            change = result[metric] / base[metric] - 1
+            changes.append(f"{metric} {change:+.1%}")
+            if change > threshold:
+                regressions.append(f"{result['key']}: {metric} {base[metric]} -> {result[metric]} ({change:+.1%})")
+        logger.info(f"  {result['key']}: {', '.join(changes)}")
+    return regressions
+
+
+def write_results(document: Dict[str, Any], path: Optional[Path] = None) -> Path:
+    """Write a results document (default: BENCHMARK_DIR/<time>-<scale>.json)."""
+    if path is None:
+        path = BENCHMARK_DIR / f"{document['started_at'].replace(':', '')}-{document['dataset']['scale']}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, default=str)
+    return path
+
+
+def main():
+    """Main entry point with command-line argument parsing."""
+    from synthetic_data import SCALES
+    
+    parser = argparse.ArgumentParser(
+        description='Benchmark analytics ETL steps and exports on synthetic data in a local database'
+    )
+    parser.add_argument(
+        '--scale',
+        choices=list(SCALES),
+        default='10k',
+        help='Dataset size in orders (default: 10k)'
+    )
+    parser.add_argument(
+        '--random-seed',
+        type=int,
+        default=BENCHMARK_SEED,
+        help=f'Random seed of the synthetic data (default: {BENCHMARK_SEED})'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=BENCHMARK_REPEAT,
+        help=f'Runs per step or export; the median is reported (default: {BENCHMARK_REPEAT})'
+    )
+    parser.add_argument(
+        '--steps',
+        help='Comma-separated ETL steps to benchmark (default: all, "none" to skip)'
+    )
+    parser.add_argument(
+        '--exports',
+        help='Comma-separated exports to benchmark (default: all, "none" to skip)'
+    )
+    parser.add_argument(
+        '--formats',
+        default='csv',
+        help=f'Comma-separated export formats out of {", ".join(EXPORT_FORMATS)} (default: csv)'
+    )
+    parser.add_argument(
+        '--no-seed',
+        action='store_true',
+        help='Reuse the synthetic data already in the database'
+    )
+    parser.add_argument(
+        '--seed-only',
+        action='store_true',
+        help='Load the synthetic data and exit'
+    )
+    parser.add_argument(
+        '--clear',
+        action='store_true',
+        help='Delete the synthetic data from the database and exit'
+    )
+    parser.add_argument(
+        '--output',
+        type=Path,
+        help='Results file (default: BENCHMARK_DIR/<time>-<scale>.json)'
+    )
+    parser.add_argument(
+        '--compare',
+        type=Path,
+        metavar='BASELINE',
+        help='Compare with an earlier results file; exit 1 on regressions over BENCHMARK_REGRESSION_THRESHOLD'
+    )
+    parser.add_argument(
+        '--allow-remote',
+        action='store_true',
+        help='Allow a DATABASE_URL that is not on this machine (synthetic data is written to it)'
+    )
+    # Internal: run one measurement in a child process
+    parser.add_argument('--worker', nargs=2, metavar=('KIND', 'NAME'), help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('--format', default='csv', choices=EXPORT_FORMATS, help=argparse.SUPPRESS)
+    
+    args = parser.parse_args()
+    configure_logging('benchmark.log')
+    
+    if args.worker:
+        kind, name = args.worker
+        sys.exit(0 if run_worker(kind, name, args.format, args.result_file) else 1)
+    
+    validate_config()
+    if not (args.allow_remote or is_local_database(DATABASE_URL)):
+        logger.error("DATABASE_URL is not a local database; pass --allow-remote to seed it anyway")
+        sys.exit(1)
+    
+    from etl_aggregate import ETL_STEPS
+    from export_data import EXPORTS
+    import synthetic_data
+    
+    def selection(value: Optional[str], available) -> List[str]:
+        if value is None:
+            return list(available)
+        names = [name.strip() for name in value.split(',') if name.strip() and name.strip() != 'none']
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            parser.error(f"unknown: {', '.join(unknown)} (choose from {', '.join(available)})")
+        return names
+    
+    steps = selection(args.steps, ETL_STEPS)
+    exports = selection(args.exports, EXPORTS)
+    formats = selection(args.formats, EXPORT_FORMATS)
+    
+    if args.clear:
+        synthetic_data.clear_synthetic_data()
+        sys.exit(0)
+    
+    started_at = datetime.now().isoformat(timespec='seconds')
+    if args.no_seed:
+        dataset = synthetic_data.describe_dataset(args.scale, args.random_seed)
+        if not dataset.orders:
+            logger.error("No synthetic data in the database; run without --no-seed first")
+            sys.exit(1)
+    else:
+        dataset = synthetic_data.seed_dataset(args.scale, args.random_seed)
+    if args.seed_only:
+        sys.exit(0)
+    
+    other_orders = synthetic_data.count_other_orders()
+    if other_orders:
+        logger.warning(f"The database has {other_orders:,} non-synthetic orders; results include them")
+    
+    benchmarks = run_benchmarks(steps, exports, formats, max(1, args.repeat))
+    results = [benchmark.summary(dataset.orders) for benchmark in benchmarks]
+    document = {
+        'version': RESULTS_VERSION,
+        'started_at': started_at,
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'dataset': asdict(dataset),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    log_results(results)
+    path = write_results(document, args.output)
+    logger.info(f"Results written to {path}")
+    
+    success = all(result['success'] for result in results)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(document, json.load(f))
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        success = success and not regressions
+    
+    sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,19 @@
-"""Configuration for analytics ETL scripts."""
+"""
+Configuration for analytics ETL scripts.
 
+Importing this module only reads settings from the environment (and .env).
+Checking required variables, creating directories and installing log
+handlers are left to the entry point: see validate_config() and
+configure_logging().
+"""
+
+import logging
 import os
+import sys
 from dotenv import load_dotenv
 from pathlib import Path
 
-# Load environment variables
+# Load environment variables (never overrides variables that are already set)
 load_dotenv()
 
 # Supabase configuration
@@ -12,24 +21,18 @@ SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_KEY')
 DATABASE_URL = os.getenv('DATABASE_URL')
 
-# Validate required environment variables
-if not all([SUPABASE_URL, SUPABASE_SERVICE_KEY, DATABASE_URL]):
-    raise ValueError(
-        "Missing required environment variables. Please set:\n"
-        "  - SUPABASE_URL\n"
-        "  - SUPABASE_SERVICE_KEY\n"
-        "  - DATABASE_URL"
-    )
+# Optional read replicas (comma-separated) for read-only analytics queries
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+]
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', '30'))  # seconds
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', '30'))  # seconds
 
 # Directories
 BASE_DIR = Path(__file__).parent
 LOGS_DIR = BASE_DIR / 'logs'
 EXPORTS_DIR = BASE_DIR / 'exports'
 
-# Create directories if they don't exist
-LOGS_DIR.mkdir(exist_ok=True)
-EXPORTS_DIR.mkdir(exist_ok=True)
-
 # Logging configuration
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
@@ -37,8 +40,198 @@ LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 # ETL configuration
 BATCH_SIZE = int(os.getenv('BATCH_SIZE', '1000'))
 MAX_RETRIES = int(os.getenv('MAX_RETRIES', '3'))
-RETRY_DELAY = int(os.getenv('RETRY_DELAY', '5'))  # seconds
+RETRY_DELAY = float(os.getenv('RETRY_DELAY', '5'))  # seconds, base of exponential backoff
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '60'))  # seconds
+RETRY_TIME_BUDGET = float(os.getenv('RETRY_TIME_BUDGET', '120'))  # seconds per ETL step
+
+# Number of independent ETL steps run at once (see pipeline_pool_size())
+ETL_CONCURRENCY = int(os.getenv('ETL_CONCURRENCY', '3'))
+
+# Sharding: churn and RFM split customers into ETL_SHARDS slices by a hash of
+# customer_phone; slices are claimed through analytics_shard_leases, so extra
+# workers (etl_aggregate.py --shard-worker, on any machine) share the work.
+# 1 disables sharding; at most 1024
+ETL_SHARDS = int(os.getenv('ETL_SHARDS', '1'))
+# Shards processed at once per process (each holds a pooled connection)
+ETL_SHARD_WORKERS = int(os.getenv('ETL_SHARD_WORKERS', '2'))
+SHARD_LEASE_SECONDS = int(os.getenv('SHARD_LEASE_SECONDS', '300'))  # renewed while a shard runs
+SHARD_MAX_ATTEMPTS = int(os.getenv('SHARD_MAX_ATTEMPTS', '3'))  # per shard, including expired leases
+SHARD_POLL_INTERVAL = float(os.getenv('SHARD_POLL_INTERVAL', '5'))  # seconds between lease checks
+
+# Incremental ETL: orders changed up to this long before the stored watermark
+# are reprocessed, to catch transactions that committed late
+WATERMARK_OVERLAP = float(os.getenv('WATERMARK_OVERLAP', '300'))  # seconds
+
+# Maintenance: only analytics tables whose statistics show they need it are
+# vacuumed/analyzed after ETL runs
+ANALYTICS_TABLES = [
+    table.strip() for table in os.getenv(
+        'ANALYTICS_TABLES',
+        'cohort_analytics,user_churn_risk,analytics_customer_stats,funnel_results,'
+        'funnel_events,analytics_etl_state,customer_rfm_segments,analytics_shard_leases'
+    ).split(',') if table.strip()
+]
+MAINTENANCE_DEAD_RATIO = float(os.getenv('MAINTENANCE_DEAD_RATIO', '0.1'))  # dead / all tuples
+MAINTENANCE_ANALYZE_RATIO = float(os.getenv('MAINTENANCE_ANALYZE_RATIO', '0.1'))  # modified / live rows
+MAINTENANCE_MIN_ROWS = int(os.getenv('MAINTENANCE_MIN_ROWS', '50'))
+MAINTENANCE_RECENT_WINDOW = float(os.getenv('MAINTENANCE_RECENT_WINDOW', '3600'))  # seconds, skip if autovacuum ran
+MAINTENANCE_TIME_BUDGET = float(os.getenv('MAINTENANCE_TIME_BUDGET', '600'))  # seconds per maintenance pass
+
+# Daemon mode (etl_aggregate.py --daemon): cron expressions per step,
+# "step=minute hour day month weekday" separated by ';'. A scheduled step
+# pulls in its dependencies, except "maintenance=...", which runs only the
+# maintenance pass (the default schedules it after the day's analyses)
+ETL_SCHEDULES = {
+    name.strip(): expression.strip()
+    for name, expression in (
+        item.split('=', 1) for item in os.getenv(
+            'ETL_SCHEDULES',
+            'cohort=0 2 * * *;churn=0 3 * * *;funnel=30 3 * * *;'
+            'ltv=0 4 * * *;rfm=30 4 * * *;maintenance=0 5 * * *'
+        ).split(';') if '=' in item
+    )
+}
+SCHEDULER_JITTER = float(os.getenv('SCHEDULER_JITTER', '60'))  # max random delay per start, seconds
+
+# Time budgets: statements past these limits are cancelled on the server
+# (statement_timeout) and, as a fallback, from the client (0 disables)
+STATEMENT_TIMEOUT = float(os.getenv('STATEMENT_TIMEOUT', '300'))  # seconds per query
+LOCK_TIMEOUT = float(os.getenv('LOCK_TIMEOUT', '10'))  # seconds waiting for a lock
+STEP_TIMEOUT = float(os.getenv('STEP_TIMEOUT', '1800'))  # seconds per ETL step or export
+# Per-step overrides, e.g. "rfm=900,maintenance=3600,export_ltv=600"
+STEP_TIMEOUTS = {
+    name.strip(): float(value)
+    for name, value in (
+        item.split('=', 1) for item in os.getenv('STEP_TIMEOUTS', '').split(',') if '=' in item
+    )
+}
+CANCEL_GRACE_PERIOD = float(os.getenv('CANCEL_GRACE_PERIOD', '5'))  # seconds before client-side cancel
+
+# Pre-flight cost estimation (--plan). Costs are PostgreSQL planner units
+# from EXPLAIN; budgets apply per ETL step or export ("export_<name>")
+PLAN_COST_BUDGET = float(os.getenv('PLAN_COST_BUDGET', '0'))  # 0 disables
+# Per-step overrides, e.g. "churn=5000000,export_ltv=1000000"
+PLAN_COST_BUDGETS = {
+    name.strip(): float(value)
+    for name, value in (
+        item.split('=', 1) for item in os.getenv('PLAN_COST_BUDGETS', '').split(',') if '=' in item
+    )
+}
+# What runs do with steps over budget: '' (run them), 'refuse' or 'defer'
+PLAN_OVER_BUDGET = os.getenv('PLAN_OVER_BUDGET', '')
+PLAN_SEQ_SCAN_COST = float(os.getenv('PLAN_SEQ_SCAN_COST', '10000'))  # flag costlier seq scans
+PLAN_READ_COST_LIMIT = float(os.getenv('PLAN_READ_COST_LIMIT', '1000'))  # cheaper reads still run when planning
+
+# Circuit breaker: fail fast once the database is clearly unreachable
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv('CIRCUIT_BREAKER_THRESHOLD', '5'))
+CIRCUIT_BREAKER_COOLDOWN = float(os.getenv('CIRCUIT_BREAKER_COOLDOWN', '60'))  # seconds
+
+# Run manifests (one JSON file per pipeline run, used by etl_aggregate.py --resume)
+RUN_MANIFEST_DIR = Path(os.getenv('RUN_MANIFEST_DIR') or LOGS_DIR / 'runs')
+RUN_MANIFEST_KEEP = int(os.getenv('RUN_MANIFEST_KEEP', '200'))  # newest manifests kept, 0 keeps all
+
+# Query instrumentation
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', '5'))  # seconds, 0 disables
+QUERY_LOG_FILE = os.getenv('QUERY_LOG_FILE', '')  # JSON-lines query log, relative to logs/
+
+# Pipeline metrics for Prometheus, rewritten after every etl_aggregate run in
+# the format read by node_exporter's textfile collector ('' disables), e.g.
+# /var/lib/node_exporter/textfile_collector/analytics_etl.prom
+METRICS_TEXTFILE = os.getenv('METRICS_TEXTFILE', '')
+# Upper bounds of the step duration histogram buckets, seconds
+METRICS_DURATION_BUCKETS = [
+    float(value) for value in
+    os.getenv('METRICS_DURATION_BUCKETS', '1,5,15,30,60,120,300,600,1800,3600').split(',') if value.strip()
+]
+
+# Benchmarks (benchmark.py): results are written to BENCHMARK_DIR as JSON
+BENCHMARK_DIR = Path(os.getenv('BENCHMARK_DIR') or BASE_DIR / 'benchmarks')
+BENCHMARK_REPEAT = int(os.getenv('BENCHMARK_REPEAT', '3'))  # runs per step, the median is reported
+BENCHMARK_SEED = int(os.getenv('BENCHMARK_SEED', '42'))  # synthetic data random seed
+BENCHMARK_REGRESSION_THRESHOLD = float(os.getenv('BENCHMARK_REGRESSION_THRESHOLD', '0.2'))  # vs --compare baseline
 
 # Analytics configuration
 COHORT_MONTHS_BACK = int(os.getenv('COHORT_MONTHS_BACK', '12'))
 CHURN_THRESHOLD_DAYS = int(os.getenv('CHURN_THRESHOLD_DAYS', '30'))
+FUNNEL_WINDOW_DAYS = int(os.getenv('FUNNEL_WINDOW_DAYS', '30'))
+
+# RFM engine: 'sql' scores customers in calculate_rfm_segments() on the
+# database, 'numpy' streams them (from a replica when configured) and scores
+# them in this process, see rfm_engine.py
+RFM_ENGINE = os.getenv('RFM_ENGINE', 'sql')
+# 'fixed' (the thresholds of calculate_rfm_segments()) or 'quantile'
+# (quintiles of the current customers, needs RFM_ENGINE=numpy)
+RFM_SCORING = os.getenv('RFM_SCORING', 'fixed')
+RFM_BATCH_SIZE = int(os.getenv('RFM_BATCH_SIZE', '50000'))  # rows per fetch for the numpy engine
+
+# Connection pool configuration
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '5'))
+DB_POOL_MAX_LIFETIME = int(os.getenv('DB_POOL_MAX_LIFETIME', '1800'))  # seconds
+DB_POOL_HEALTH_CHECK = os.getenv('DB_POOL_HEALTH_CHECK', 'true').lower() == 'true'
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))  # seconds to wait for a free connection
+# Server-side prepared statements kept per connection (0 disables; use 0 behind a
+# transaction-mode pooler such as pgbouncer, which does not support them)
+PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv('PREPARED_STATEMENT_CACHE_SIZE', '64'))
+
+
+def pipeline_pool_size() -> int:
+    """
+    Pooled connections a pipeline run may hold at once.
+    
+    The run's advisory lock holds one connection, and each of the
+    ETL_CONCURRENCY steps pins a session connection. With sharding on, a
+    sharded step also runs ETL_SHARD_WORKERS threads with a connection
+    each, and its lease keeper needs one more for renewals.
+    """
+    if ETL_SHARDS > 1:
+        return 1 + ETL_CONCURRENCY * (1 + ETL_SHARD_WORKERS) + 1
+    return 1 + ETL_CONCURRENCY
+
+
+def validate_config():
+    """Raise ValueError if a required setting is missing or inconsistent."""
+    if not all([SUPABASE_URL, SUPABASE_SERVICE_KEY, DATABASE_URL]):
+        raise ValueError(
+            "Missing required environment variables. Please set:\n"
+            "  - SUPABASE_URL\n"
+            "  - SUPABASE_SERVICE_KEY\n"
+            "  - DATABASE_URL"
+        )
+    # Otherwise shard threads wait DB_POOL_TIMEOUT for a connection and fail
+    if DB_POOL_MAX_SIZE < pipeline_pool_size():
+        raise ValueError(
+            f"DB_POOL_MAX_SIZE={DB_POOL_MAX_SIZE} is too small for ETL_CONCURRENCY={ETL_CONCURRENCY}"
+            + (f" with ETL_SHARD_WORKERS={ETL_SHARD_WORKERS}" if ETL_SHARDS > 1 else "")
+            + f"; a pipeline run can hold {pipeline_pool_size()} connections"
+        )
+
+
+_logging_configured = False
+
+
+def configure_logging(log_file: str):
+    """
+    Send log records to logs/<log_file> and stdout.
+    
+    Called once by the script being run; library modules only create
+    loggers. Later calls are no-ops, so a script that runs other ETL
+    modules in-process keeps a single log file.
+    
+    Args:
+        log_file: File name inside LOGS_DIR, e.g. 'etl.log'
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    
+    LOGS_DIR.mkdir(exist_ok=True)
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format=LOG_FORMAT,
+        handlers=[
+            logging.FileHandler(LOGS_DIR / log_file),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
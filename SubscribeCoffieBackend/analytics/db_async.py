@@ -0,0 +1,111 @@
+"""Asyncio counterpart of db_utils for running analytics queries concurrently."""
+
+import asyncio
+import logging
+import weakref
+from typing import Any, Callable, Dict, Optional
+import db_utils
+from config import DB_POOL_MAX_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPool:
+    """
+    Run blocking db_utils calls from coroutines without blocking the loop.
+    
+    psycopg2 releases the GIL while it waits on the server, so each call is
+    handed to a worker thread that checks out its own connection from the
+    shared db_utils pool. A per-loop semaphore keeps the number of calls in
+    flight at or below the pool size, so coroutines queue here instead of
+    timing out on pool checkout.
+    """
+    
+    def __init__(self, max_concurrency: int = DB_POOL_MAX_SIZE):
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphores = weakref.WeakKeyDictionary()
+    
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+    
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking function on a worker thread under the concurrency limit."""
+        async with self._semaphore():
+            return await asyncio.to_thread(func, *args, **kwargs)
+    
+    async def close(self):
+        """Close the underlying db_utils connection pool."""
+        await asyncio.to_thread(db_utils.close_pool)
+
+
+_async_pool: Optional[AsyncPool] = None
+
+
+def get_async_pool() -> AsyncPool:
+    """Return the process-wide async pool, creating it on first use."""
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = AsyncPool()
+    return _async_pool
+
+
+async def execute_query(
+    query: str,
+    params: Optional[tuple] = None,
+    fetch: bool = True,
+    retry: bool = True,
+    result_format: str = 'dicts'
+) -> Optional[Any]:
+    """
+    Async version of db_utils.execute_query().
+    
+    Args:
+        query: SQL query to execute
+        params: Query parameters
+        fetch: Whether to fetch results
+        retry: Whether to retry on failure
+        result_format: Result format, see db_utils.execute_query()
+    
+    Returns:
+        Query results in the requested format, or None if fetch=False
+    """
+    return await get_async_pool().run(
+        db_utils.execute_query, query, params,
+        fetch=fetch, retry=retry, result_format=result_format
+    )
+
+
+async def call_rpc_function(
+    function_name: str,
+    params: Optional[Dict[str, Any]] = None,
+    result_format: str = 'dicts'
+) -> Optional[Any]:
+    """
+    Async version of db_utils.call_rpc_function().
+    
+    Args:
+        function_name: Name of the RPC function
+        params: Function parameters as dict
+        result_format: Result format, see db_utils.execute_query()
+    
+    Returns:
+        Function result
+    """
+    return await get_async_pool().run(
+        db_utils.call_rpc_function, function_name, params, result_format=result_format
+    )
+
+
+async def run_sync(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run any blocking ETL or export function under the async pool.
+    
+    Lets existing synchronous entry points (which issue their own queries
+    through db_utils) be awaited side by side with asyncio.gather().
+    """
+    return await get_async_pool().run(func, *args, **kwargs)
@@ -1,89 +1,1292 @@
 """Database utility functions for analytics ETL."""
 
+import atexit
+import contextvars
+import io
+import itertools
+import json
 import logging
+import random
+import re
+import threading
 import time
+import uuid
 import psycopg2
+import psycopg2.pool
+from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import List, Dict, Any, Optional
-from config import DATABASE_URL, MAX_RETRIES, RETRY_DELAY
+from dataclasses import dataclass
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Sequence, Set, Tuple, Union
+from config import (
+    DATABASE_URL, DATABASE_REPLICA_URLS, REPLICA_MAX_LAG, REPLICA_LAG_CHECK_INTERVAL,
+    BATCH_SIZE, MAX_RETRIES, RETRY_DELAY, RETRY_MAX_DELAY, RETRY_TIME_BUDGET,
+    CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_LIFETIME, DB_POOL_HEALTH_CHECK, DB_POOL_TIMEOUT,
+    PREPARED_STATEMENT_CACHE_SIZE,
+    STATEMENT_TIMEOUT, LOCK_TIMEOUT, STEP_TIMEOUT, STEP_TIMEOUTS, CANCEL_GRACE_PERIOD,
+    ANALYTICS_TABLES, MAINTENANCE_DEAD_RATIO, MAINTENANCE_ANALYZE_RATIO, MAINTENANCE_MIN_ROWS,
+    MAINTENANCE_RECENT_WINDOW, MAINTENANCE_TIME_BUDGET, PLAN_READ_COST_LIMIT, validate_config,
+)
+from query_metrics import QueryTimer, query_step
+from profiling import profile_section
+from query_plan import PlanEstimate, RPC_COST_PROBES, parse_explain
 
 logger = logging.getLogger(__name__)
 
 
+class EtlConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that carries its own prepared-statement LRU."""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements: "OrderedDict[tuple, str]" = OrderedDict()
+        self.statement_counter = itertools.count(1)
+        # Statements that failed to prepare or execute prepared; run plainly
+        self.unpreparable: Set[tuple] = set()
+        self.prepared_generation = 0
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool with checkout health checks.
+    
+    Connections older than ``max_lifetime`` seconds are closed and replaced
+    on checkout, and (optionally) every checkout is validated with a
+    ``SELECT 1`` so callers never receive a connection the server dropped.
+    When all ``max_size`` connections are checked out, getconn() waits up
+    to ``timeout`` seconds for one to be returned.
+    """
+    
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        max_lifetime: int = DB_POOL_MAX_LIFETIME,
+        health_check: bool = DB_POOL_HEALTH_CHECK,
+        timeout: float = DB_POOL_TIMEOUT
+    ):
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+        self.timeout = timeout
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            min_size, max_size, dsn, connection_factory=EtlConnection
+        )
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._created_at: Dict[int, float] = {}
+        self._lock = threading.Lock()
+    
+    def _is_usable(self, conn) -> bool:
+        """Check that a pooled connection is alive and not past its lifetime."""
+        if conn.closed:
+            return False
+        
+        with self._lock:
+            created_at = self._created_at.setdefault(id(conn), time.monotonic())
+        if self.max_lifetime and time.monotonic() - created_at > self.max_lifetime:
+            return False
+        
+        if self.health_check:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+    
+    def getconn(self):
+        """Check out a healthy connection, replacing stale or broken ones."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(
+                f"No database connection available within {self.timeout}s"
+            )
+        
+        try:
+            # Bounded by max_size: every discarded connection frees a slot
+            for _ in range(self._pool.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_usable(conn):
+                    return conn
+                logger.info("Discarding stale pooled connection")
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+        
+        self._slots.release()
+        raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+    
+    def _discard(self, conn):
+        """Close a connection and drop it from the underlying pool."""
+        with self._lock:
+            self._created_at.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+    
+    def putconn(self, conn, close: bool = False):
+        """Return a connection to the pool, closing it if requested or broken."""
+        try:
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+    
+    def closeall(self):
+        """Close every connection owned by the pool."""
+        with self._lock:
+            self._created_at.clear()
+        self._pool.closeall()
+    
+    @property
+    def closed(self) -> bool:
+        return self._pool.closed
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pool_lock = threading.Lock()
+_session = threading.local()
+
+
+def get_pool(dsn: Optional[str] = None) -> ConnectionPool:
+    """
+    Return the process-wide connection pool for a DSN, creating it on first use.
+    
+    Args:
+        dsn: Connection string (defaults to the primary DATABASE_URL)
+    """
+    dsn = dsn or DATABASE_URL
+    pool = _pools.get(dsn)
+    if pool is None or pool.closed:
+        with _pool_lock:
+            pool = _pools.get(dsn)
+            if pool is None or pool.closed:
+                validate_config()
+                role = 'primary' if dsn == DATABASE_URL else 'replica'
+                logger.info(
+                    f"Opening {role} connection pool "
+                    f"(min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})"
+                )
+                pool = _pools[dsn] = ConnectionPool(dsn)
+    return pool
+
+
+def close_pool():
+    """Close every process-wide connection pool (safe to call more than once)."""
+    with _pool_lock:
+        for pool in _pools.values():
+            if not pool.closed:
+                pool.closeall()
+        if _pools:
+            logger.info("Closing connection pool")
+        _pools.clear()
+
+
+atexit.register(close_pool)
+
+
+# SQLSTATE classes and codes that indicate a transient failure worth retrying
+RETRIABLE_SQLSTATE_CLASSES = (
+    '08',  # connection exception
+    '53',  # insufficient resources (too many connections, out of memory)
+)
+RETRIABLE_SQLSTATES = (
+    '40001',  # serialization_failure
+    '40P01',  # deadlock_detected
+    '55P03',  # lock_not_available
+    '57P01',  # admin_shutdown
+    '57P02',  # crash_shutdown
+    '57P03',  # cannot_connect_now
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised without touching the database while the circuit breaker is open."""
+
+
+def is_retriable_error(error: BaseException) -> bool:
+    """
+    Classify an exception as transient (retriable) or permanent.
+    
+    Errors with a SQLSTATE are classified by code; driver-level connection
+    failures without one (refused, reset, server closed the connection) are
+    retriable. Everything else, including syntax errors, undefined functions
+    and data errors, is permanent.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    
+    pgcode = getattr(error, 'pgcode', None)
+    if pgcode:
+        return pgcode in RETRIABLE_SQLSTATES or pgcode[:2] in RETRIABLE_SQLSTATE_CLASSES
+    
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+def _is_connection_error(error: BaseException) -> bool:
+    """Whether an error means the database itself is unreachable."""
+    pgcode = getattr(error, 'pgcode', None)
+    if pgcode:
+        return pgcode[:2] == '08' or pgcode in ('57P01', '57P02', '57P03')
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+class CircuitBreaker:
+    """
+    Process-wide circuit breaker for database connectivity.
+    
+    After ``threshold`` consecutive connection failures the circuit opens
+    and every call fails fast with CircuitOpenError for ``cooldown``
+    seconds. The first call after the cooldown is let through as a probe;
+    its success closes the circuit again.
+    """
+    
+    def __init__(
+        self,
+        threshold: int = CIRCUIT_BREAKER_THRESHOLD,
+        cooldown: float = CIRCUIT_BREAKER_COOLDOWN
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    def before_call(self):
+        """Raise CircuitOpenError if the circuit is open and still cooling down."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(
+                    f"Database circuit open after {self._failures} consecutive "
+                    f"connection failures; retry in {remaining:.0f}s"
+                )
+            # Half-open: allow this call through as a probe
+            self._opened_at = None
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+    
+    def record_failure(self, error: BaseException):
+        if not _is_connection_error(error):
+            return
+        with self._lock:
+            self._failures += 1
+            if self.threshold and self._failures >= self.threshold and self._opened_at is None:
+                logger.error(
+                    f"Opening database circuit breaker after {self._failures} "
+                    f"consecutive connection failures"
+                )
+                self._opened_at = time.monotonic()
+    
+    def reset(self):
+        self.record_success()
+
+
+circuit_breaker = CircuitBreaker()
+_retry_deadline = contextvars.ContextVar('retry_deadline', default=None)
+
+
 @contextmanager
-def get_db_connection():
-    """Get database connection with automatic cleanup."""
-    conn = None
+def retry_budget(seconds: float = RETRY_TIME_BUDGET):
+    """
+    Cap the total time spent retrying queries issued inside the block.
+    
+    ETL steps wrap their work in ``with retry_budget():`` so one flaky step
+    cannot spend more than its budget sleeping between retries. Nested
+    blocks keep the tighter of the two deadlines. Like time_budget(), the
+    deadline is a context variable, so shard threads started with
+    contextvars.copy_context() keep their step's deadline.
+    """
+    previous = _retry_deadline.get()
+    deadline = time.monotonic() + seconds
+    if previous is not None:
+        deadline = min(deadline, previous)
+    token = _retry_deadline.set(deadline)
     try:
-        conn = psycopg2.connect(DATABASE_URL)
+        yield
+    finally:
+        _retry_deadline.reset(token)
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given (0-based) attempt."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_DELAY * (2 ** attempt)))
+
+
+
+class TimeBudgetExceeded(Exception):
+    """Raised when a query would start after its step's time budget ran out."""
+
+
+_step_deadline = contextvars.ContextVar('step_deadline', default=None)
+
+
+def step_timeout(step: str) -> float:
+    """Return the configured time budget in seconds for an ETL step or export."""
+    return STEP_TIMEOUTS.get(step, STEP_TIMEOUT)
+
+
+@contextmanager
+def time_budget(seconds: float):
+    """
+    Cap the wall time of every query issued inside the block.
+    
+    Each statement gets a server-side statement_timeout of whatever is
+    left of the budget (or STATEMENT_TIMEOUT if that is tighter), and no
+    new statement is started once the budget is spent. Nested blocks keep
+    the tighter deadline; a budget of 0 adds no limit.
+    """
+    previous = _step_deadline.get()
+    deadline = time.monotonic() + seconds if seconds else None
+    if previous is not None:
+        deadline = previous if deadline is None else min(deadline, previous)
+    token = _step_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _step_deadline.reset(token)
+
+
+@contextmanager
+def etl_step(name: str):
+    """
+    Run one ETL step or export under its retry and time budgets.
+    
+    Queries inside the block are attributed to the step in the query
+    metrics, retried within RETRY_TIME_BUDGET and cancelled once the
+    step's time budget (see step_timeout()) runs out.
+    """
+    with retry_budget(), time_budget(step_timeout(name)), query_step(name):
+        yield
+
+
+def _statement_timeout() -> Optional[float]:
+    """Seconds the next statement may run, or None when unlimited."""
+    timeout = STATEMENT_TIMEOUT or None
+    deadline = _step_deadline.get()
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeBudgetExceeded("Time budget exhausted before the query could start")
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return timeout
+
+
+def _apply_timeouts(conn, local: bool = True) -> Optional[float]:
+    """
+    Set statement_timeout and lock_timeout for the work about to run on conn.
+    
+    With local=True the settings only last until the end of the current
+    transaction, so pooled connections go back clean. Returns the statement
+    timeout in seconds (None when unlimited).
+    """
+    timeout = _statement_timeout()
+    if timeout is None and not LOCK_TIMEOUT:
+        return None
+    
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT set_config('statement_timeout', %s, %s), set_config('lock_timeout', %s, %s)",
+            (
+                f"{int(timeout * 1000) if timeout else 0}ms", local,
+                f"{int(LOCK_TIMEOUT * 1000)}ms", local,
+            )
+        )
+    return timeout
+
+
+def _cancel_query(conn, timeout: float):
+    if conn.closed:
+        return
+    logger.warning(
+        f"Query still running {timeout + CANCEL_GRACE_PERIOD:.0f}s after its "
+        f"{timeout:.0f}s timeout; cancelling from the client"
+    )
+    try:
+        conn.cancel()
+    except psycopg2.Error as e:
+        logger.warning(f"Failed to cancel query: {e}")
+
+
+@contextmanager
+def _cancel_after(conn, timeout: Optional[float]):
+    """
+    Cancel the statement running on conn if it outlives its timeout.
+    
+    Backstop for the server-side statement_timeout (e.g. a backend stuck
+    on the network or a timeout reset inside a function): after the
+    timeout plus CANCEL_GRACE_PERIOD a watchdog thread sends a cancel
+    request, which surfaces as QueryCanceledError in the calling thread.
+    
+    Every server round-trip runs inside this block, so it is also where
+    --profile measures database wait.
+    """
+    with profile_section('db'):
+        if timeout is None:
+            yield
+            return
+        
+        timer = threading.Timer(timeout + CANCEL_GRACE_PERIOD, _cancel_query, args=(conn, timeout))
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+
+# Statements that start like a read but modify data, so must stay on the primary
+_WRITE_PATTERN = re.compile(
+    r"\b(refresh_\w*\s*\(|insert\s+into|update\s+\w+\s+set|delete\s+from|"
+    r"for\s+update|for\s+share|nextval\s*\(|setval\s*\(|pg_advisory)",
+    re.IGNORECASE
+)
+_READ_KEYWORDS = ('SELECT', 'WITH', 'VALUES', 'SHOW', 'EXPLAIN', 'TABLE')
+
+_last_write_lsn = contextvars.ContextVar('last_write_lsn', default=None)
+
+
+def is_read_only_query(query: str) -> bool:
+    """
+    Heuristically decide whether a statement only reads data.
+    
+    Writing RPCs (``refresh_*``), data-modifying CTEs and locking reads are
+    treated as writes; anything that isn't a plain read is routed to the
+    primary.
+    """
+    stripped = query.lstrip()
+    if not stripped or stripped.split(None, 1)[0].upper() not in _READ_KEYWORDS:
+        return False
+    return _WRITE_PATTERN.search(query) is None
+
+
+class ReplicaRouter:
+    """
+    Choose a sufficiently fresh read replica for read-only queries.
+    
+    Replicas are tried round-robin. Each replica's replication lag is
+    measured at most every ``check_interval`` seconds; a replica lagging
+    more than ``max_lag`` seconds, or one that can't be reached, is skipped
+    until its next check, and reads fall back to the primary when none
+    qualifies.
+    """
+    
+    LAG_QUERY = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+    """
+    
+    def __init__(
+        self,
+        urls: Sequence[str],
+        max_lag: float = REPLICA_MAX_LAG,
+        check_interval: float = REPLICA_LAG_CHECK_INTERVAL
+    ):
+        self.urls = list(urls)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._checked: Dict[str, Tuple[float, bool]] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    def candidates(self) -> List[str]:
+        """Replicas in round-robin order, skipping ones known to be unhealthy."""
+        now = time.monotonic()
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.urls)
+            ordered = self.urls[start:] + self.urls[:start]
+            return [
+                url for url in ordered
+                if self._checked.get(url, (0.0, True))[1]
+                or now - self._checked[url][0] >= self.check_interval
+            ]
+    
+    def mark(self, url: str, healthy: bool):
+        with self._lock:
+            self._checked[url] = (time.monotonic(), healthy)
+    
+    def is_fresh(self, url: str, conn) -> bool:
+        """Whether a replica's lag is within max_lag (re-measured when due)."""
+        with self._lock:
+            checked_at, healthy = self._checked.get(url, (0.0, True))
+        if time.monotonic() - checked_at < self.check_interval:
+            return healthy
+        
+        try:
+            with conn.cursor() as cur:
+                cur.execute(self.LAG_QUERY)
+                lag = cur.fetchone()[0]
+            conn.rollback()
+        except psycopg2.Error as e:
+            logger.warning(f"Replica lag check failed: {e}")
+            lag = None
+        
+        healthy = lag is not None and float(lag) <= self.max_lag
+        if not healthy and lag is not None:
+            logger.warning(
+                f"Replica lag {float(lag):.1f}s exceeds {self.max_lag:.0f}s; "
+                f"reading from primary"
+            )
+        self.mark(url, healthy)
+        return healthy
+
+
+replica_router = ReplicaRouter(DATABASE_REPLICA_URLS) if DATABASE_REPLICA_URLS else None
+
+
+def _replica_caught_up(conn) -> bool:
+    """Whether a replica has replayed this context's most recent write."""
+    lsn = _last_write_lsn.get()
+    if lsn is None:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn", (lsn,))
+            caught_up = bool(cur.fetchone()[0])
+        conn.rollback()
+        return caught_up
+    except psycopg2.Error:
+        return False
+
+
+def _remember_write_lsn(conn):
+    """Record the primary's WAL position so later reads can wait for replicas."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_current_wal_lsn()::text")
+            _last_write_lsn.set(cur.fetchone()[0])
+        conn.rollback()
+    except psycopg2.Error as e:
+        logger.debug(f"Could not read primary WAL position: {e}")
+
+
+def _checkout(read_only: bool) -> Tuple[str, Any]:
+    """Check out a connection, preferring a fresh replica for reads."""
+    if read_only and replica_router is not None:
+        for url in replica_router.candidates():
+            pool = get_pool(url)
+            try:
+                conn = pool.getconn()
+            except psycopg2.Error as e:
+                logger.warning(f"Replica unavailable: {e}")
+                replica_router.mark(url, False)
+                continue
+            if replica_router.is_fresh(url, conn) and _replica_caught_up(conn):
+                return url, conn
+            pool.putconn(conn)
+        logger.debug("No fresh replica available; reading from primary")
+    return DATABASE_URL, get_pool().getconn()
+
+
+@contextmanager
+def get_db_connection(read_only: bool = False):
+    """
+    Get a pooled database connection with automatic cleanup.
+    
+    Read-only work is routed to a read replica when DATABASE_REPLICA_URLS
+    is configured and a replica is fresh enough; everything else uses the
+    primary. Inside a ``db_session()`` block one connection per server is
+    pinned and reused; otherwise a connection is checked out of the pool
+    and returned when the block exits.
+    
+    Args:
+        read_only: Whether the work only reads data and may use a replica
+    """
+    circuit_breaker.before_call()
+    
+    pinned_conns = getattr(_session, 'conns', None)
+    dsn, conn = None, None
+    broken = False
+    try:
+        if pinned_conns is not None:
+            dsn, conn = _pinned_connection(pinned_conns, read_only)
+        else:
+            dsn, conn = _checkout(read_only)
         yield conn
         conn.commit()
+        circuit_breaker.record_success()
+        if dsn == DATABASE_URL and not read_only and replica_router is not None:
+            _remember_write_lsn(conn)
     except Exception as e:
-        if conn:
-            conn.rollback()
+        circuit_breaker.record_failure(e)
+        if conn is not None and not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            # A failed transaction may have left our view of the server's
+            # prepared statements stale; start over with fresh names
+            _reset_prepared_statements(conn)
+        if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+            broken = True
         logger.error(f"Database error: {e}")
         raise
     finally:
-        if conn:
+        if conn is not None and pinned_conns is None:
+            get_pool(dsn).putconn(conn, close=broken)
+
+
+def _pinned_connection(pinned_conns: Dict[str, Any], read_only: bool) -> Tuple[str, Any]:
+    """Return (and lazily pin) the session connection for a read or a write."""
+    if read_only and replica_router is not None:
+        for dsn, conn in pinned_conns.items():
+            if dsn != DATABASE_URL and not conn.closed and _replica_caught_up(conn):
+                return dsn, conn
+        dsn, conn = _checkout(read_only)
+        if dsn in pinned_conns:
+            # Already pinned a connection to this server; don't hold two
+            get_pool(dsn).putconn(conn)
+            return _repin_if_dead(pinned_conns, dsn)
+        pinned_conns[dsn] = conn
+        return dsn, conn
+    
+    if DATABASE_URL not in pinned_conns:
+        pinned_conns[DATABASE_URL] = get_pool().getconn()
+    return _repin_if_dead(pinned_conns, DATABASE_URL)
+
+
+def _repin_if_dead(pinned_conns: Dict[str, Any], dsn: str) -> Tuple[str, Any]:
+    conn = pinned_conns[dsn]
+    if conn.closed:
+        # The session's connection died; re-pin a fresh one so retries can succeed
+        get_pool(dsn).putconn(conn, close=True)
+        conn = pinned_conns[dsn] = get_pool(dsn).getconn()
+    return dsn, conn
+
+
+@contextmanager
+def db_session():
+    """
+    Pin pooled connections for every query issued inside the block.
+    
+    ETL steps that run several queries back to back can wrap them in
+    ``with db_session():`` to share a single session on the primary (plus
+    one per read replica that serves their reads); nested blocks reuse the
+    outer session. Yields the primary connection.
+    """
+    if getattr(_session, 'conns', None) is not None:
+        yield _pinned_connection(_session.conns, read_only=False)[1]
+        return
+    
+    _session.conns = {DATABASE_URL: get_pool().getconn()}
+    try:
+        yield _session.conns[DATABASE_URL]
+    finally:
+        conns = _session.conns
+        _session.conns = None
+        for dsn, conn in conns.items():
+            get_pool(dsn).putconn(conn, close=conn.closed)
+
+
+@contextmanager
+def advisory_lock(name: str):
+    """
+    Hold a session-level PostgreSQL advisory lock for the duration of the block.
+    
+    The lock is taken with pg_try_advisory_lock on a dedicated pooled
+    connection in autocommit mode, so no transaction stays open while the
+    block runs. Yields True if the lock was acquired and False if another
+    session already holds it; the caller decides whether to skip or fail.
+    
+    Args:
+        name: Lock name, hashed to the advisory lock key
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    acquired = False
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(hashtext(%s));", (name,))
+            acquired = bool(cur.fetchone()[0])
+        yield acquired
+    finally:
+        try:
+            if acquired and not conn.closed:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(hashtext(%s));", (name,))
+            if not conn.closed:
+                conn.autocommit = False
+        except psycopg2.Error as e:
+            # Closing the connection below ends the session and releases the lock
+            logger.warning(f"Error releasing advisory lock {name}: {e}")
             conn.close()
+        pool.putconn(conn, close=conn.closed)
+
+
+# Arrow types for common PostgreSQL type OIDs; numeric is fetched as
+# Decimal and cast to float64, anything unlisted is rendered as text.
+_PG_OID_INT2 = 21
+_PG_OID_INT4 = 23
+_PG_OID_INT8 = 20
+_PG_OID_NUMERIC = 1700
+_PG_OID_JSON = (114, 3802)
+
+RESULT_FORMATS = ('dicts', 'dataframe', 'numpy', 'arrow')
+
+
+def _arrow_type(type_code: int):
+    """Map a PostgreSQL type OID to the Arrow type used for its column."""
+    import pyarrow as pa
+    
+    return {
+        16: pa.bool_(),
+        _PG_OID_INT8: pa.int64(),
+        _PG_OID_INT2: pa.int16(),
+        _PG_OID_INT4: pa.int32(),
+        26: pa.int64(),
+        700: pa.float32(),
+        701: pa.float64(),
+        _PG_OID_NUMERIC: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp('us'),
+        1184: pa.timestamp('us', tz='UTC'),
+        1186: pa.duration('us'),
+    }.get(type_code, pa.string())
+
+
+def _column_to_arrow(values: tuple, type_code: int, arrow_type):
+    """Build one Arrow column from a tuple of driver values."""
+    import pyarrow as pa
+    
+    if type_code == _PG_OID_NUMERIC:
+        # Decimal values cannot be converted to double directly
+        return pa.array(values).cast(arrow_type)
+    if type_code in _PG_OID_JSON:
+        values = [None if v is None else json.dumps(v, default=str) for v in values]
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # Types without a native mapping (uuid, inet, arrays, ...) become text
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def _arrow_schema(description):
+    """Build the Arrow schema for a cursor description."""
+    import pyarrow as pa
+    
+    return pa.schema([(col.name, _arrow_type(col.type_code)) for col in description])
+
+
+def _rows_to_record_batch(rows: list, description, schema):
+    """Transpose a batch of row tuples into an Arrow record batch."""
+    import pyarrow as pa
+    
+    columns = zip(*rows)
+    return pa.RecordBatch.from_arrays(
+        [
+            _column_to_arrow(values, col.type_code, field.type)
+            for values, col, field in zip(columns, description, schema)
+        ],
+        schema=schema
+    )
+
+
+def _rows_to_result(rows: list, description, result_format: str):
+    """Convert one batch of row tuples into the requested columnar format."""
+    import pyarrow as pa
+    
+    with profile_section('dataframe'):
+        schema = _arrow_schema(description)
+        batch = _rows_to_record_batch(rows, description, schema)
+        return _arrow_to_result(pa.Table.from_batches([batch], schema=schema), result_format)
+
+
+def _fetch_columnar(cur, result_format: str, batch_size: int = BATCH_SIZE):
+    """
+    Fetch a tuple cursor's result straight into column arrays.
+    
+    Rows are pulled ``batch_size`` at a time and transposed into Arrow
+    record batches, so no per-row dict is ever built and only one batch of
+    Python row tuples is alive at once.
+    """
+    import pyarrow as pa
+    
+    schema = _arrow_schema(cur.description)
+    record_batches = []
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        with profile_section('dataframe'):
+            record_batches.append(_rows_to_record_batch(rows, cur.description, schema))
+    
+    with profile_section('dataframe'):
+        table = pa.Table.from_batches(record_batches, schema=schema)
+        return _arrow_to_result(table, result_format)
+
+
+def _arrow_to_result(table, result_format: str):
+    """Convert an Arrow table into the requested result format."""
+    if result_format == 'arrow':
+        return table
+    if result_format == 'numpy':
+        return {
+            name: column.to_numpy()
+            for name, column in zip(table.column_names, table.columns)
+        }
+    if result_format == 'dataframe':
+        return table.to_pandas(date_as_object=False)
+    raise ValueError(f"Unsupported result format: {result_format}")
+
+
+_PREPARABLE_KEYWORDS = ('SELECT', 'WITH', 'VALUES', 'INSERT', 'UPDATE', 'DELETE')
+_prepared_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'fallbacks': 0}
+_prepared_stats_lock = threading.Lock()
+# Bumped by invalidate_prepared_statements(); connections that prepared
+# under an older generation DEALLOCATE ALL before their next statement
+_prepared_generation = 0
+
+# Errors of PREPARE/EXECUTE that a plain execute may not hit: the server
+# infers $n types from context where psycopg2 inlines typed literals (data
+# and type errors), or a cached plan's result type changed under a
+# migration ("cached plan must not change result type")
+_PREPARED_FALLBACK_ERRORS = (psycopg2.DataError, psycopg2.ProgrammingError, psycopg2.NotSupportedError)
+
+
+def _count_prepared(event: str):
+    with _prepared_stats_lock:
+        _prepared_stats[event] += 1
+
+
+def get_prepared_statement_stats() -> Dict[str, int]:
+    """Return process-wide prepared-statement cache hit/miss/eviction counters."""
+    with _prepared_stats_lock:
+        return dict(_prepared_stats)
+
+
+def _reset_prepared_statements(conn):
+    """Forget a connection's prepared statements (names are never reused)."""
+    cache = getattr(conn, 'prepared_statements', None)
+    if cache:
+        cache.clear()
+
+
+def invalidate_prepared_statements():
+    """
+    Make every pooled connection drop its prepared statements.
+    
+    Each connection runs DEALLOCATE ALL before its next statement, so plans
+    prepared before a migration or maintenance pass are never reused.
+    """
+    global _prepared_generation
+    with _prepared_stats_lock:
+        _prepared_generation += 1
+
+
+def _run_prepared(conn, cur, statement: str, params: Optional[tuple] = None):
+    # Inside a transaction a failed PREPARE/EXECUTE would abort it; the
+    # savepoint lets _execute() roll back just that statement and fall back
+    if conn.autocommit:
+        cur.execute(statement, params)
+    else:
+        cur.execute(f"SAVEPOINT etl_prepared; {statement}", params)
+
+
+def _to_server_placeholders(query: str, params: Optional[tuple]) -> Optional[str]:
+    """
+    Rewrite psycopg2 ``%s`` placeholders as ``$1, $2, ...`` for PREPARE.
+    
+    Returns None if the query uses placeholders we can't translate
+    (named ``%(key)s`` parameters) or the count doesn't match the params.
+    """
+    body = query.strip().rstrip(';').strip()
+    if params is None:
+        return body
+    
+    parts = []
+    index = 0
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char == '%':
+            following = body[i + 1:i + 2]
+            if following == '%':
+                parts.append('%')
+            elif following == 's':
+                index += 1
+                parts.append(f"${index}")
+            else:
+                return None
+            i += 2
+            continue
+        parts.append(char)
+        i += 1
+    
+    return ''.join(parts) if index == len(params) else None
+
+
+def _execute(conn, cur, query: str, params: Optional[tuple] = None):
+    """
+    Execute a query through the connection's prepared-statement cache.
+    
+    Recurring statements are PREPAREd once per connection, keyed by query
+    text and parameter types, and then run with EXECUTE so the server skips
+    parsing and planning. The least recently used statement is DEALLOCATEd
+    once the cache holds PREPARED_STATEMENT_CACHE_SIZE entries. Queries that
+    can't be prepared fall back to a plain execute, and so do statements
+    whose PREPARE or EXECUTE fails with a data, type or plan error: the
+    server types ``$n`` parameters from their context, which can differ
+    from psycopg2's inlined literals. Such statements are never prepared
+    again on that connection.
+    """
+    cache = getattr(conn, 'prepared_statements', None)
+    if (
+        cache is None
+        or PREPARED_STATEMENT_CACHE_SIZE <= 0
+        or query.lstrip().split(None, 1)[0].upper() not in _PREPARABLE_KEYWORDS
+    ):
+        cur.execute(query, params)
+        return
+    
+    if conn.prepared_generation != _prepared_generation:
+        if cache:
+            cur.execute("DEALLOCATE ALL")
+        cache.clear()
+        conn.unpreparable.clear()
+        conn.prepared_generation = _prepared_generation
+    
+    signature = tuple(type(value).__name__ for value in params) if params else ()
+    key = (query, signature)
+    if key in conn.unpreparable:
+        cur.execute(query, params)
+        return
+    name = cache.get(key)
+    
+    try:
+        if name is not None:
+            cache.move_to_end(key)
+            _count_prepared('hits')
+        else:
+            body = _to_server_placeholders(query, params)
+            if body is None:
+                cur.execute(query, params)
+                return
+            
+            name = f"etl_stmt_{next(conn.statement_counter)}"
+            _run_prepared(conn, cur, f"PREPARE {name} AS {body}")
+            cache[key] = name
+            _count_prepared('misses')
+            
+            if len(cache) > PREPARED_STATEMENT_CACHE_SIZE:
+                _, evicted = cache.popitem(last=False)
+                cur.execute(f"DEALLOCATE {evicted}")
+                _count_prepared('evictions')
+        
+        if params:
+            placeholders = ", ".join(["%s"] * len(params))
+            _run_prepared(conn, cur, f"EXECUTE {name} ({placeholders})", params)
+        else:
+            _run_prepared(conn, cur, f"EXECUTE {name}")
+    except _PREPARED_FALLBACK_ERRORS as e:
+        if not conn.autocommit:
+            cur.execute("ROLLBACK TO SAVEPOINT etl_prepared")
+        if cache.pop(key, None) is not None:
+            cur.execute(f"DEALLOCATE {name}")
+        conn.unpreparable.add(key)
+        _count_prepared('fallbacks')
+        logger.warning(f"Prepared statement failed ({e}); running it unprepared: {_describe(query)}")
+        cur.execute(query, params)
+
+
+# Estimates collected while planning (--plan); None when statements run normally
+_plan_estimates: contextvars.ContextVar[Optional[List[PlanEstimate]]] = contextvars.ContextVar(
+    'plan_estimates', default=None
+)
+
+
+@contextmanager
+def plan_mode():
+    """
+    Explain the statements issued inside the block instead of running them.
+    
+    Every query, RPC call, bulk load and utility statement is recorded as
+    a PlanEstimate and returns an empty result. Read-only queries cheaper
+    than PLAN_READ_COST_LIMIT (state lookups, small report queries) are
+    also run, so the code being planned follows its real path. Nothing is
+    written. Yields the list of estimates.
+    """
+    estimates: List[PlanEstimate] = []
+    token = _plan_estimates.set(estimates)
+    try:
+        yield estimates
+    finally:
+        _plan_estimates.reset(token)
+
+
+def is_planning() -> bool:
+    """Return True inside plan_mode(), where statements are explained instead of run."""
+    return _plan_estimates.get() is not None
+
+
+def _describe(query: str, limit: int = 80) -> str:
+    text = ' '.join(query.split())
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+
+def explain_query(
+    query: str,
+    params: Optional[Union[tuple, Dict[str, Any]]] = None,
+    description: Optional[str] = None,
+    read_only: Optional[bool] = None
+) -> PlanEstimate:
+    """
+    Estimate a statement with EXPLAIN (FORMAT JSON) without running it.
+    
+    Args:
+        query: SQL statement
+        params: Statement parameters
+        description: Label for reports (defaults to the shortened query)
+        read_only: Whether the EXPLAIN may run on a read replica
+    """
+    if read_only is None:
+        read_only = is_read_only_query(query)
+    with get_db_connection(read_only=read_only) as conn:
+        _apply_timeouts(conn)
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return parse_explain(plan, description or _describe(query))
+
+
+def explain_rpc(function_name: str, params: Optional[Dict[str, Any]] = None) -> PlanEstimate:
+    """
+    Estimate an RPC call, through its RPC_COST_PROBES query when it has one.
+    
+    Without a probe the call itself is explained, which only reflects the
+    function's declared cost.
+    """
+    probe = RPC_COST_PROBES.get(function_name)
+    if probe is None:
+        query, values = _build_rpc_query(function_name, params)
+        estimate = explain_query(query, values, f"rpc {function_name}", read_only=True)
+        estimate.note = (
+            f"cost {estimate.total_cost:,.0f} (declared function cost only, no probe)"
+        )
+        return estimate
+    return explain_query(
+        probe.sql, {**probe.defaults, **(params or {})}, f"rpc {function_name} (probe)",
+        read_only=True
+    )
+
+
+def _empty_result(result_format: str):
+    """An empty result in the given format, returned for planned statements."""
+    if result_format == 'dataframe':
+        import pandas as pd
+        return pd.DataFrame()
+    if result_format == 'numpy':
+        return {}
+    if result_format == 'arrow':
+        import pyarrow as pa
+        return pa.table({})
+    return []
+
+
+def _plan_statement(query: str, params, fetch: bool = True) -> bool:
+    """
+    Record the estimate of a statement issued in plan_mode().
+    
+    Returns:
+        True if the statement should also run (a cheap read)
+    """
+    estimate = explain_query(query, params)
+    _plan_estimates.get().append(estimate)
+    return fetch and is_read_only_query(query) and estimate.total_cost < PLAN_READ_COST_LIMIT
 
 
 def execute_query(
     query: str, 
     params: Optional[tuple] = None,
     fetch: bool = True,
-    retry: bool = True
-) -> Optional[List[Dict[str, Any]]]:
+    retry: bool = True,
+    result_format: str = 'dicts',
+    read_only: Optional[bool] = None
+) -> Optional[Any]:
     """
     Execute a database query with optional retry logic.
     
+    Only transient failures (connection loss, serialization failures,
+    deadlocks, ...) are retried, with exponential backoff and jitter, until
+    MAX_RETRIES or the current retry_budget() is exhausted. Permanent errors
+    such as syntax errors or missing functions are raised immediately.
+    Each attempt runs under STATEMENT_TIMEOUT and the current time_budget();
+    a cancelled statement is not retried.
+    
     Args:
         query: SQL query to execute
         params: Query parameters
         fetch: Whether to fetch results
         retry: Whether to retry on failure
+        result_format: 'dicts' (list of dicts), or a columnar format:
+            'dataframe' (pandas DataFrame), 'numpy' (dict of NumPy arrays)
+            or 'arrow' (pyarrow Table)
+        read_only: Whether the query may run on a read replica (detected
+            from the statement when None)
         
     Returns:
-        Query results as list of dicts, or None if fetch=False
+        Query results in the requested format, or None if fetch=False
     """
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f"Unsupported result format: {result_format}")
+    if read_only is None:
+        read_only = is_read_only_query(query)
+    if _plan_estimates.get() is not None and not _plan_statement(query, params, fetch):
+        return _empty_result(result_format) if fetch else None
+    
     retries = MAX_RETRIES if retry else 1
-    last_error = None
+    started = time.monotonic()
+    deadline = _retry_deadline.get() or started + RETRY_TIME_BUDGET
+    timer = QueryTimer(query)
     
     for attempt in range(retries):
+        timer.retries = attempt
         try:
-            with get_db_connection() as conn:
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    cur.execute(query, params)
-                    if fetch:
-                        results = cur.fetchall()
-                        return [dict(row) for row in results]
-                    return None
+            with get_db_connection(read_only=read_only) as conn:
+                timeout = _apply_timeouts(conn)
+                if fetch and result_format != 'dicts':
+                    with conn.cursor() as cur, _cancel_after(conn, timeout):
+                        _execute(conn, cur, query, params)
+                        timer.first_row()
+                        result = _fetch_columnar(cur, result_format)
+                else:
+                    with conn.cursor(cursor_factory=RealDictCursor) as cur, _cancel_after(conn, timeout):
+                        _execute(conn, cur, query, params)
+                        timer.first_row()
+                        result = [dict(row) for row in cur.fetchall()] if fetch else None
+            
+            timer.add_result(result)
+            timer.finish()
+            return result
         except Exception as e:
-            last_error = e
-            logger.warning(f"Query attempt {attempt + 1}/{retries} failed: {e}")
-            if attempt < retries - 1:
-                time.sleep(RETRY_DELAY)
-            continue
-    
-    logger.error(f"Query failed after {retries} attempts: {last_error}")
-    raise last_error
+            if not is_retriable_error(e):
+                logger.error(f"Query failed with non-retriable error: {e}")
+                timer.finish(error=e)
+                raise
+            
+            if attempt == retries - 1:
+                logger.error(f"Query failed after {retries} attempts: {e}")
+                timer.finish(error=e)
+                raise
+            
+            delay = _backoff_delay(attempt)
+            if time.monotonic() + delay > deadline:
+                elapsed = time.monotonic() - started
+                logger.error(
+                    f"Query failed after {attempt + 1} attempts; retry budget "
+                    f"exhausted ({elapsed:.1f}s elapsed): {e}"
+                )
+                timer.finish(error=e)
+                raise
+            
+            logger.warning(
+                f"Query attempt {attempt + 1}/{retries} failed ({e}); "
+                f"retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
 
 
-def call_rpc_function(
-    function_name: str,
-    params: Optional[Dict[str, Any]] = None
-) -> Optional[Any]:
+def execute_query_iter(
+    query: str,
+    params: Optional[tuple] = None,
+    batch_size: int = BATCH_SIZE,
+    batched: bool = False,
+    result_format: str = 'dicts',
+    read_only: Optional[bool] = None
+) -> Iterator[Any]:
     """
-    Call a Supabase RPC function.
+    Stream query results through a named server-side cursor.
+    
+    Only ``batch_size`` rows are held in memory at a time, so peak memory
+    stays flat regardless of the result size. The connection stays checked
+    out until the iterator is exhausted or closed. Unlike execute_query()
+    there is no retry: a failure mid-stream is raised to the caller.
     
     Args:
-        function_name: Name of the RPC function
-        params: Function parameters as dict
+        query: SQL query to execute
+        params: Query parameters
+        batch_size: Rows fetched per round-trip (defaults to BATCH_SIZE)
+        batched: Yield lists of rows instead of individual rows
+        result_format: 'dicts', or a columnar format ('dataframe', 'numpy',
+            'arrow') in which case each batch is yielded in that format
+        read_only: Whether the query may run on a read replica (detected
+            from the statement when None)
         
-    Returns:
-        Function result
+    Yields:
+        Rows as dicts, lists of rows if batched=True, or one columnar
+        result per batch
     """
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f"Unsupported result format: {result_format}")
+    if read_only is None:
+        read_only = is_read_only_query(query)
+    if _plan_estimates.get() is not None and not _plan_statement(query, params):
+        return
+    
+    cursor_name = f"etl_cursor_{uuid.uuid4().hex[:12]}"
+    timer = QueryTimer(query)
+    
+    try:
+        with get_db_connection(read_only=read_only) as conn:
+            # statement_timeout applies to each FETCH separately, so the
+            # client-side cancel is armed per round-trip rather than across
+            # the consumer's processing time
+            timeout = _apply_timeouts(conn)
+            if result_format != 'dicts':
+                with conn.cursor(name=cursor_name) as cur:
+                    cur.itersize = batch_size
+                    with _cancel_after(conn, timeout):
+                        cur.execute(query, params)
+                        # Named cursors only expose a description after the first fetch
+                        rows = cur.fetchmany(batch_size)
+                    timer.first_row()
+                    while rows:
+                        result = _rows_to_result(rows, cur.description, result_format)
+                        timer.add_result(result)
+                        yield result
+                        with _cancel_after(conn, _statement_timeout()):
+                            rows = cur.fetchmany(batch_size)
+            else:
+                with conn.cursor(name=cursor_name, cursor_factory=RealDictCursor) as cur:
+                    cur.itersize = batch_size
+                    with _cancel_after(conn, timeout):
+                        cur.execute(query, params)
+                    while True:
+                        with _cancel_after(conn, _statement_timeout()):
+                            rows = cur.fetchmany(batch_size)
+                        timer.first_row()
+                        if not rows:
+                            break
+                        timer.add_result(rows)
+                        if batched:
+                            yield rows
+                        else:
+                            yield from rows
+    except Exception as e:
+        timer.finish(error=e)
+        raise
+    finally:
+        timer.finish()
+
+
+def _build_rpc_query(
+    function_name: str,
+    params: Optional[Dict[str, Any]] = None
+) -> Tuple[str, Optional[tuple]]:
+    """Build the ``SELECT * FROM fn(key => %s, ...)`` query for an RPC call."""
     param_placeholders = []
     param_values = []
     
@@ -94,9 +1297,253 @@ def call_rpc_function(
     
     param_string = ", ".join(param_placeholders) if param_placeholders else ""
     query = f"SELECT * FROM {function_name}({param_string})"
+    return query, tuple(param_values) if param_values else None
+
+
+def call_rpc_function(
+    function_name: str,
+    params: Optional[Dict[str, Any]] = None,
+    result_format: str = 'dicts',
+    read_only: Optional[bool] = None
+) -> Optional[Any]:
+    """
+    Call a Supabase RPC function.
+    
+    Args:
+        function_name: Name of the RPC function
+        params: Function parameters as dict
+        result_format: Result format, see execute_query()
+        read_only: Whether the function may run on a read replica
+            (``refresh_*`` functions are treated as writes when None)
+        
+    Returns:
+        Function result
+    """
+    estimates = _plan_estimates.get()
+    if estimates is not None:
+        estimates.append(explain_rpc(function_name, params))
+        return _empty_result(result_format)
+    
+    query, values = _build_rpc_query(function_name, params)
     
     logger.info(f"Calling RPC function: {function_name}")
-    return execute_query(query, tuple(param_values) if param_values else None)
+    return execute_query(query, values, result_format=result_format, read_only=read_only)
+
+
+def call_rpc_iter(
+    function_name: str,
+    params: Optional[Dict[str, Any]] = None,
+    batch_size: int = BATCH_SIZE,
+    batched: bool = False,
+    result_format: str = 'dicts',
+    read_only: Optional[bool] = None
+) -> Iterator[Any]:
+    """
+    Stream the rows returned by a set-returning RPC function.
+    
+    Args:
+        function_name: Name of the RPC function
+        params: Function parameters as dict
+        batch_size: Rows fetched per round-trip (defaults to BATCH_SIZE)
+        batched: Yield lists of rows instead of individual rows
+        result_format: Result format, see execute_query_iter()
+        read_only: Whether the function may run on a read replica
+        
+    Yields:
+        Rows as dicts, lists of rows if batched=True, or one columnar
+        result per batch
+    """
+    estimates = _plan_estimates.get()
+    if estimates is not None:
+        estimates.append(explain_rpc(function_name, params))
+        return iter(())
+    
+    query, values = _build_rpc_query(function_name, params)
+    
+    logger.info(f"Streaming RPC function: {function_name}")
+    return execute_query_iter(
+        query, values, batch_size=batch_size, batched=batched,
+        result_format=result_format, read_only=read_only
+    )
+
+
+BULK_LOAD_MODES = ('merge', 'replace', 'append')
+
+
+def _table_identifier(table_name: str) -> sql.Identifier:
+    """Quote a possibly schema-qualified table name."""
+    return sql.Identifier(*table_name.split('.'))
+
+
+def _frame_to_copy_csv(df) -> str:
+    """
+    Serialize a DataFrame chunk as CSV text for COPY FROM STDIN.
+    
+    NULLs are written as \\N, integral float columns (ints with missing
+    values) are written without a fractional part, and dicts/lists are
+    encoded as JSON so they load into json/jsonb columns.
+    """
+    import pandas as pd
+    
+    with profile_section('serialization'):
+        df = df.copy(deep=False)
+        for column in df.columns:
+            series = df[column]
+            if pd.api.types.is_float_dtype(series):
+                values = series.dropna()
+                if len(values) and (values == values.round()).all():
+                    df[column] = series.astype('Int64')
+            elif series.dtype == object:
+                df[column] = series.map(
+                    lambda v: json.dumps(v, default=str) if isinstance(v, (dict, list)) else v
+                )
+        
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+        return buffer.getvalue()
+
+
+def _iter_frames(data, columns: Optional[Sequence[str]], batch_size: int):
+    """Yield DataFrame chunks of at most batch_size rows from rows or a DataFrame."""
+    import pandas as pd
+    
+    if isinstance(data, pd.DataFrame):
+        frame = data if columns is None else data[list(columns)]
+        for start in range(0, len(frame), batch_size):
+            yield frame.iloc[start:start + batch_size]
+        return
+    
+    chunk = []
+    for row in data:
+        chunk.append(row)
+        if len(chunk) >= batch_size:
+            yield pd.DataFrame(chunk, columns=columns)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=columns)
+
+
+def bulk_load(
+    table_name: str,
+    data: Union[Iterable[Dict[str, Any]], Any],
+    on_conflict: Optional[Sequence[str]] = None,
+    mode: str = 'merge',
+    update_columns: Optional[Sequence[str]] = None,
+    columns: Optional[Sequence[str]] = None,
+    batch_size: int = BATCH_SIZE * 10
+) -> int:
+    """
+    Bulk-load rows into a table through COPY and a staging table.
+    
+    Rows are streamed with COPY FROM STDIN into a temporary staging table
+    shaped like the target, then moved into the target in one statement,
+    all inside a single transaction: readers see either the old or the new
+    data, never a partial load.
+    
+    Args:
+        table_name: Target table (optionally schema-qualified)
+        data: pandas DataFrame, or an iterable of dicts (may be a generator)
+        on_conflict: Conflict target columns for merge mode (the table's
+            primary key or a unique constraint)
+        mode: 'merge' upserts on the on_conflict columns, 'replace' deletes
+            every existing row before inserting, 'append' only inserts
+        update_columns: Columns updated on conflict (defaults to every
+            loaded column that is not part of on_conflict)
+        columns: Columns to load (defaults to the DataFrame's columns or the
+            first row's keys)
+        batch_size: Rows serialized per COPY chunk
+        
+    Returns:
+        Number of rows loaded into the staging table
+    """
+    if mode not in BULK_LOAD_MODES:
+        raise ValueError(f"Unsupported bulk load mode: {mode}")
+    if mode == 'merge' and not on_conflict:
+        raise ValueError("bulk_load mode='merge' requires on_conflict columns")
+    
+    estimates = _plan_estimates.get()
+    if estimates is not None:
+        estimates.append(PlanEstimate(
+            f"bulk_load {table_name} mode={mode}", note='COPY load, not estimated'
+        ))
+        return 0
+    
+    frames = _iter_frames(data, columns, batch_size)
+    first = next(frames, None)
+    if first is None or first.empty:
+        logger.info(f"Bulk load into {table_name}: no rows")
+        if mode == 'replace':
+            with get_db_connection() as conn:
+                timeout = _apply_timeouts(conn)
+                with conn.cursor() as cur, _cancel_after(conn, timeout):
+                    cur.execute(sql.SQL("DELETE FROM {}").format(_table_identifier(table_name)))
+        return 0
+    
+    load_columns = list(columns) if columns else list(first.columns)
+    staging = f"bulk_stage_{uuid.uuid4().hex[:12]}"
+    target = _table_identifier(table_name)
+    column_list = sql.SQL(', ').join(map(sql.Identifier, load_columns))
+    
+    logger.info(f"Bulk loading into {table_name} (mode={mode})")
+    timer = QueryTimer(f"bulk_load {table_name} mode={mode}")
+    rows_loaded = 0
+    
+    try:
+        with get_db_connection() as conn:
+            _apply_timeouts(conn)
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL(
+                    "CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP"
+                ).format(sql.Identifier(staging), target))
+                
+                copy_sql = sql.SQL(
+                    "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+                ).format(sql.Identifier(staging), column_list).as_string(conn)
+                
+                frame = first
+                while frame is not None:
+                    if not frame.empty:
+                        with _cancel_after(conn, _statement_timeout()):
+                            cur.copy_expert(copy_sql, io.StringIO(_frame_to_copy_csv(frame)))
+                        rows_loaded += len(frame)
+                    frame = next(frames, None)
+                timer.first_row()
+                
+                if mode == 'replace':
+                    with _cancel_after(conn, _statement_timeout()):
+                        cur.execute(sql.SQL("DELETE FROM {}").format(target))
+                
+                insert = sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}").format(
+                    target, column_list, column_list, sql.Identifier(staging)
+                )
+                if mode == 'merge':
+                    updates = [
+                        column for column in (update_columns or load_columns)
+                        if column not in on_conflict
+                    ]
+                    conflict_target = sql.SQL(', ').join(map(sql.Identifier, on_conflict))
+                    if updates:
+                        insert += sql.SQL(" ON CONFLICT ({}) DO UPDATE SET {}").format(
+                            conflict_target,
+                            sql.SQL(', ').join(
+                                sql.SQL("{} = EXCLUDED.{}").format(
+                                    sql.Identifier(column), sql.Identifier(column)
+                                )
+                                for column in updates
+                            )
+                        )
+                    else:
+                        insert += sql.SQL(" ON CONFLICT ({}) DO NOTHING").format(conflict_target)
+                with _cancel_after(conn, _statement_timeout()):
+                    cur.execute(insert)
+    except Exception as e:
+        timer.finish(error=e)
+        raise
+    
+    timer.rows = rows_loaded
+    timer.finish()
+    logger.info(f"Bulk loaded {rows_loaded} rows into {table_name}")
+    return rows_loaded
 
 
 def table_exists(table_name: str) -> bool:
@@ -126,8 +1573,44 @@ def truncate_table(table_name: str):
     execute_query(query, fetch=False)
 
 
+def _run_utility_statement(query: Union[str, sql.Composable], description: Optional[str] = None):
+    """Run a statement that cannot run inside a transaction block (VACUUM)."""
+    estimates = _plan_estimates.get()
+    if estimates is not None:
+        estimates.append(PlanEstimate(
+            description or _describe(str(query)), note='utility statement, not estimated'
+        ))
+        return
+    
+    timer = QueryTimer(description or query)
+    try:
+        with get_db_connection() as conn:
+            conn.autocommit = True
+            try:
+                # Outside a transaction SET LOCAL has no effect, so set the
+                # timeouts for the session and reset them afterwards
+                timeout = _apply_timeouts(conn, local=False)
+                with conn.cursor() as cur:
+                    try:
+                        with _cancel_after(conn, timeout):
+                            cur.execute(query)
+                    finally:
+                        cur.execute("RESET statement_timeout; RESET lock_timeout;")
+            finally:
+                conn.autocommit = False
+    except Exception as e:
+        timer.finish(error=e)
+        raise
+    timer.finish()
+
+
 def vacuum_analyze(table_name: Optional[str] = None):
-    """Run VACUUM ANALYZE on a table or entire database."""
+    """
+    Run VACUUM ANALYZE on a table or entire database.
+    
+    Prefer run_maintenance(), which only touches analytics tables whose
+    statistics show they need it.
+    """
     if table_name:
         logger.info(f"Running VACUUM ANALYZE on {table_name}")
         query = f"VACUUM ANALYZE {table_name};"
@@ -135,11 +1618,166 @@ def vacuum_analyze(table_name: Optional[str] = None):
         logger.info("Running VACUUM ANALYZE on database")
         query = "VACUUM ANALYZE;"
     
-    # VACUUM cannot run inside a transaction
-    conn = psycopg2.connect(DATABASE_URL)
-    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-    try:
-        with conn.cursor() as cur:
-            cur.execute(query)
-    finally:
-        conn.close()
+    _run_utility_statement(query)
+
+
+@dataclass
+class MaintenanceAction:
+    """Planned maintenance for one table; operation is None when skipped."""
+    table: str
+    operation: Optional[str]
+    reason: str
+    priority: int = 0
+
+
+def get_table_stats(tables: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Read activity statistics for tables from pg_stat_user_tables.
+    
+    Args:
+        tables: Table names in the public schema
+        
+    Returns:
+        Table name -> live/dead tuples, rows modified since the last
+        analyze, and seconds since the last (auto)vacuum and (auto)analyze
+    """
+    query = """
+        SELECT
+            relname AS table_name,
+            n_live_tup,
+            n_dead_tup,
+            n_mod_since_analyze,
+            EXTRACT(EPOCH FROM now() - GREATEST(last_vacuum, last_autovacuum)) AS vacuum_age,
+            EXTRACT(EPOCH FROM now() - GREATEST(last_analyze, last_autoanalyze)) AS analyze_age
+        FROM pg_stat_user_tables
+        WHERE schemaname = 'public' AND relname = ANY(%s);
+    """
+    # Statistics are per server, so they must come from the primary
+    result = execute_query(query, (list(tables),), read_only=False)
+    return {row['table_name']: row for row in result or []}
+
+
+def plan_maintenance(tables: Optional[Sequence[str]] = None) -> List[MaintenanceAction]:
+    """
+    Decide which tables need VACUUM and/or ANALYZE.
+    
+    A table is vacuumed when its dead tuples reach MAINTENANCE_DEAD_RATIO
+    of all tuples, and analyzed when the rows modified since the last
+    analyze reach MAINTENANCE_ANALYZE_RATIO of live rows (or it was never
+    analyzed). Changes below MAINTENANCE_MIN_ROWS are ignored, as is work
+    autovacuum already did within MAINTENANCE_RECENT_WINDOW.
+    
+    Args:
+        tables: Tables to consider (defaults to ANALYTICS_TABLES)
+        
+    Returns:
+        One action per table, those needing work first (worst first)
+    """
+    tables = list(tables or ANALYTICS_TABLES)
+    stats = get_table_stats(tables)
+    actions = []
+    
+    for table in tables:
+        row = stats.get(table)
+        if row is None:
+            actions.append(MaintenanceAction(table, None, "not found in pg_stat_user_tables"))
+            continue
+        
+        live, dead, modified = row['n_live_tup'], row['n_dead_tup'], row['n_mod_since_analyze']
+        dead_ratio = dead / max(live + dead, 1)
+        modified_ratio = modified / max(live, 1)
+        vacuum_age, analyze_age = row['vacuum_age'], row['analyze_age']
+        reasons = []
+        
+        needs_vacuum = dead >= MAINTENANCE_MIN_ROWS and dead_ratio >= MAINTENANCE_DEAD_RATIO
+        if needs_vacuum and vacuum_age is not None and vacuum_age < MAINTENANCE_RECENT_WINDOW:
+            needs_vacuum = False
+            reasons.append(f"vacuumed {vacuum_age / 60:.0f} min ago")
+        elif needs_vacuum:
+            reasons.append(f"{dead} dead tuples ({dead_ratio:.0%})")
+        else:
+            reasons.append(f"dead tuples {dead} ({dead_ratio:.0%})")
+        
+        never_analyzed = analyze_age is None and live > 0
+        needs_analyze = never_analyzed or (
+            modified >= MAINTENANCE_MIN_ROWS and modified_ratio >= MAINTENANCE_ANALYZE_RATIO
+        )
+        if needs_analyze and analyze_age is not None and analyze_age < MAINTENANCE_RECENT_WINDOW:
+            needs_analyze = False
+            reasons.append(f"analyzed {analyze_age / 60:.0f} min ago")
+        elif never_analyzed:
+            reasons.append("never analyzed")
+        else:
+            reasons.append(f"{modified} rows modified since analyze ({modified_ratio:.0%})")
+        
+        if needs_vacuum and needs_analyze:
+            operation = 'VACUUM ANALYZE'
+        elif needs_vacuum:
+            operation = 'VACUUM'
+        elif needs_analyze:
+            operation = 'ANALYZE'
+        else:
+            operation = None
+        
+        priority = (dead if needs_vacuum else 0) + (modified if needs_analyze else 0)
+        actions.append(MaintenanceAction(table, operation, ', '.join(reasons), priority))
+    
+    actions.sort(key=lambda action: (action.operation is None, -action.priority))
+    return actions
+
+
+def run_maintenance(
+    tables: Optional[Sequence[str]] = None,
+    budget: float = MAINTENANCE_TIME_BUDGET
+) -> Dict[str, List[MaintenanceAction]]:
+    """
+    VACUUM/ANALYZE the analytics tables that need it, within a time budget.
+    
+    Tables are processed worst first; each statement is capped by what is
+    left of the budget, and tables that no longer fit are skipped. Every
+    skipped table is logged with the reason.
+    
+    Args:
+        tables: Tables to consider (defaults to ANALYTICS_TABLES)
+        budget: Seconds available for the whole maintenance pass
+        
+    Returns:
+        Dict with 'done', 'failed' and 'skipped' actions
+    """
+    deadline = time.monotonic() + budget
+    outcome = {'done': [], 'failed': [], 'skipped': []}
+    
+    for action in plan_maintenance(tables):
+        if action.operation is None:
+            logger.info(f"Skipping maintenance of {action.table}: {action.reason}")
+            outcome['skipped'].append(action)
+            continue
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(
+                f"Skipping {action.operation} of {action.table}: maintenance "
+                f"time budget ({budget:.0f}s) exhausted ({action.reason})"
+            )
+            outcome['skipped'].append(action)
+            continue
+        
+        logger.info(f"Running {action.operation} on {action.table}: {action.reason}")
+        try:
+            query = sql.SQL("{} {}").format(
+                sql.SQL(action.operation), _table_identifier(action.table)
+            )
+            with time_budget(remaining):
+                _run_utility_statement(query, f"{action.operation} {action.table}")
+            outcome['done'].append(action)
+        except Exception as e:
+            logger.warning(f"{action.operation} of {action.table} failed: {e}")
+            outcome['failed'].append(action)
+    
+    logger.info(
+        f"Maintenance: {len(outcome['done'])} done, {len(outcome['failed'])} failed, "
+        f"{len(outcome['skipped'])} skipped"
+    )
+    if outcome['done']:
+        invalidate_prepared_statements()
+    return outcome
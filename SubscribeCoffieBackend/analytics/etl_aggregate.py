@@ -3,133 +3,547 @@
 
 import logging
 import sys
+import time
 import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from datetime import datetime
-from db_utils import vacuum_analyze
-from config import LOGS_DIR, LOG_FORMAT, LOG_LEVEL
-
-# Import individual ETL modules
-import etl_cohort
-import etl_churn
-import etl_funnel
-import etl_ltv
-import etl_rfm
-
-# Setup logging
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.FileHandler(LOGS_DIR / 'etl.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from db_utils import (
+    run_maintenance, db_session, etl_step, get_prepared_statement_stats, advisory_lock,
+    execute_query, close_pool, plan_mode, invalidate_prepared_statements,
 )
+from query_plan import StepPlan, log_plan_report
+from profiling import profile_step, profiled_run
+from pipeline_metrics import newest_order_time, record_pipeline_run
+from query_metrics import StepAggregator, add_collector, remove_collector
+from run_manifest import (
+    RunManifest, collect_outputs, STEP_SUCCESS, STEP_FAILED, STEP_SKIPPED, STEP_DEFERRED,
+)
+from scheduler import Scheduler
+from sharding import ShardWorker
+from config import (
+    configure_logging, ETL_CONCURRENCY, ETL_SCHEDULES, SCHEDULER_JITTER, PLAN_OVER_BUDGET,
+    ETL_SHARD_WORKERS,
+)
+
 logger = logging.getLogger(__name__)
 
 
-def run_all_etl_processes():
-    """Run all ETL processes in sequence."""
-    logger.info("=" * 80)
-    logger.info("Starting Full Analytics ETL Pipeline")
-    logger.info("=" * 80)
+@dataclass
+class EtlStep:
+    """
+    One node of the ETL dependency graph.
     
-    start_time = datetime.now()
-    results = {
-        'cohort': False,
-        'churn': False,
-        'funnel': False,
-        'ltv': False,
-        'rfm': False,
-    }
+    ``run`` is called with ``full_refresh``; steps that have no
+    incremental mode ignore it.
+    """
+    name: str
+    title: str
+    run: Callable[[bool], bool]
+    depends_on: Tuple[str, ...] = ()
+    always_run: bool = False  # run even if a dependency failed
+    required: bool = True  # a failure fails the whole run
+
+
+@dataclass
+class StepResult:
+    """Outcome and timing of one ETL step."""
+    name: str
+    success: bool = False
+    skipped: bool = False
+    duration: float = 0.0
+    error: Optional[str] = None
+    resumed: bool = False  # completed by an earlier attempt of the run
+    deferred: bool = False  # held back because its estimated cost is over budget
+    outputs: List[Dict[str, Any]] = field(default_factory=list)
+
+
+# Each step imports its ETL module when it runs, so short runs such as
+# --churn do not pay for importing pandas and the modules they skip.
+# The LTV and RFM modules keep their snapshots between the daemon's runs
+# and recompute them only when the data version changes
+def run_customer_stats_step(full_refresh: bool = False) -> bool:
+    import etl_customer_stats
     
-    # Run cohort analysis
-    logger.info("\n" + "=" * 80)
-    logger.info("Step 1/5: Cohort Analysis")
-    logger.info("=" * 80)
-    try:
-        results['cohort'] = etl_cohort.refresh_cohort_analytics()
-        if results['cohort']:
-            etl_cohort.get_cohort_summary()
-    except Exception as e:
-        logger.error(f"Cohort analysis failed: {e}", exc_info=True)
+    return etl_customer_stats.refresh_customer_stats(full_refresh=full_refresh)
+
+
+def run_cohort_step(full_refresh: bool = False) -> bool:
+    import etl_cohort
     
-    # Run churn risk analysis
-    logger.info("\n" + "=" * 80)
-    logger.info("Step 2/5: Churn Risk Analysis")
-    logger.info("=" * 80)
-    try:
-        results['churn'] = etl_churn.refresh_churn_risk()
-        if results['churn']:
-            etl_churn.get_high_risk_users(limit=10)
-            etl_churn.get_churn_trends()
-    except Exception as e:
-        logger.error(f"Churn risk analysis failed: {e}", exc_info=True)
+    success = etl_cohort.refresh_cohort_analytics()
+    if success:
+        etl_cohort.get_cohort_summary()
+    return success
+
+
+def run_churn_step(full_refresh: bool = False) -> bool:
+    import etl_churn
     
-    # Run funnel analysis
-    logger.info("\n" + "=" * 80)
-    logger.info("Step 3/5: Conversion Funnel Analysis")
-    logger.info("=" * 80)
-    try:
-        results['funnel'] = etl_funnel.refresh_funnel_analytics()
-        if results['funnel']:
-            etl_funnel.get_funnel_summary()
-            etl_funnel.get_funnel_bottlenecks()
-    except Exception as e:
-        logger.error(f"Funnel analysis failed: {e}", exc_info=True)
+    success = etl_churn.refresh_churn_risk(from_stats=True)
+    if success:
+        etl_churn.get_high_risk_users(limit=10)
+        etl_churn.get_churn_trends()
+    return success
+
+
+def run_funnel_step(full_refresh: bool = False) -> bool:
+    import etl_funnel
     
-    # Run LTV analysis
-    logger.info("\n" + "=" * 80)
-    logger.info("Step 4/5: Customer Lifetime Value Analysis")
-    logger.info("=" * 80)
+    success = etl_funnel.refresh_funnel_analytics()
+    if success:
+        etl_funnel.get_funnel_summary()
+        etl_funnel.get_funnel_bottlenecks()
+    return success
+
+
+def run_ltv_step(full_refresh: bool = False) -> bool:
+    import etl_ltv
+    
+    success = etl_ltv.refresh_ltv_analytics(reuse=not full_refresh)
+    if success:
+        etl_ltv.get_ltv_summary()
+        etl_ltv.get_ltv_distribution()
+    return success
+
+
+def run_rfm_step(full_refresh: bool = False) -> bool:
+    import etl_rfm
+    
+    success = etl_rfm.refresh_rfm_analytics(from_stats=True, reuse=not full_refresh)
+    if success:
+        etl_rfm.get_rfm_summary()
+        etl_rfm.identify_high_priority_segments()
+    return success
+
+
+def run_maintenance_step(full_refresh: bool = False) -> bool:
+    logger.info("Running targeted maintenance on analytics tables...")
+    outcome = run_maintenance()
+    return not outcome['failed']
+
+
+# Advisory lock held for the duration of every pipeline run
+PIPELINE_LOCK = 'analytics_etl'
+
+# What a run does with steps whose estimated cost is over budget
+OVER_BUDGET_POLICIES = ('', 'refuse', 'defer')
+
+# Churn and RFM score customers from the incrementally maintained customer
+# stats; the other analyses read orders independently and run side by side.
+# Maintenance waits for everything so it sees the freshly written tables
+ANALYSIS_STEPS = ('cohort', 'churn', 'funnel', 'ltv', 'rfm')
+ETL_STEPS: Dict[str, EtlStep] = {
+    step.name: step for step in (
+        EtlStep('customer_stats', 'Customer Stats', run_customer_stats_step),
+        EtlStep('cohort', 'Cohort Analysis', run_cohort_step),
+        EtlStep('churn', 'Churn Risk Analysis', run_churn_step, depends_on=('customer_stats',)),
+        EtlStep('funnel', 'Funnel Analysis', run_funnel_step),
+        EtlStep('ltv', 'LTV Analysis', run_ltv_step),
+        EtlStep('rfm', 'RFM Segmentation', run_rfm_step, depends_on=('customer_stats',)),
+        EtlStep(
+            'maintenance', 'Maintenance', run_maintenance_step,
+            depends_on=ANALYSIS_STEPS, always_run=True, required=False
+        ),
+    )
+}
+
+
+def with_dependencies(step_names: Iterable[str]) -> List[str]:
+    """Return the selected steps plus everything they depend on, in graph order."""
+    selected = set()
+    
+    def visit(name: str):
+        if name in selected:
+            return
+        if name not in ETL_STEPS:
+            raise ValueError(f"Unknown ETL step: {name}")
+        selected.add(name)
+        for dependency in ETL_STEPS[name].depends_on:
+            visit(dependency)
+    
+    for name in step_names:
+        visit(name)
+    return [name for name in ETL_STEPS if name in selected]
+
+
+def run_step(step: EtlStep, full_refresh: bool = False, run_id: Optional[str] = None) -> StepResult:
+    """Run one step on the calling thread, never raising."""
+    logger.info(f"Starting {step.title}")
+    result = StepResult(step.name)
+    start = time.perf_counter()
     try:
-        results['ltv'] = etl_ltv.refresh_ltv_analytics()
-        if results['ltv']:
-            etl_ltv.get_ltv_summary()
-            etl_ltv.get_ltv_distribution()
+        # Each worker pins its own pooled connection for the step's queries
+        with db_session(), etl_step(step.name), collect_outputs(run_id) as outputs:
+            result.outputs = outputs
+            with profile_step(step.name):
+                result.success = bool(step.run(full_refresh))
     except Exception as e:
-        logger.error(f"LTV analysis failed: {e}", exc_info=True)
+        result.error = str(e)
+        logger.error(f"{step.title} failed: {e}", exc_info=True)
+    result.duration = time.perf_counter() - start
     
-    # Run RFM segmentation
-    logger.info("\n" + "=" * 80)
-    logger.info("Step 5/5: RFM Segmentation")
+    status = '✓ Success' if result.success else '✗ Failed'
+    logger.info(f"Finished {step.title} in {result.duration:.2f}s: {status}")
+    return result
+
+
+def run_pipeline(
+    step_names: Iterable[str],
+    concurrency: int = ETL_CONCURRENCY,
+    full_refresh: bool = False,
+    manifest: Optional[RunManifest] = None,
+    completed: Iterable[str] = (),
+    deferred: Iterable[str] = ()
+) -> Dict[str, StepResult]:
+    """
+    Run ETL steps and their dependencies as a dependency graph.
+    
+    A step starts as soon as every step it depends on has finished, with at
+    most ``concurrency`` steps in flight on a thread pool (psycopg2 releases
+    the GIL while waiting on the server, and workers share the db_utils
+    pool). Failures are contained: a failed step only skips the steps that
+    depend on it, unless they are marked always_run.
+    
+    Args:
+        step_names: Steps to run (dependencies are added automatically)
+        concurrency: Maximum number of steps running at once
+        full_refresh: Make incremental steps ignore their watermarks
+        manifest: Run manifest updated as each step starts and finishes
+        completed: Steps already completed by an earlier attempt; they
+            count as successful and are not run again
+        deferred: Steps not to run now (over their cost budget); steps
+            that depend on them are deferred too
+        
+    Returns:
+        Step name -> StepResult, in graph order
+    """
+    names = with_dependencies(step_names)
+    results: Dict[str, StepResult] = {
+        name: StepResult(name, success=True, resumed=True) for name in names if name in set(completed)
+    }
+    pending = [ETL_STEPS[name] for name in names if name not in results]
+    running: Dict[Future, str] = {}
+    deferred = set(deferred)
+    
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='etl') as executor:
+        while pending or running:
+            waiting = len(pending)
+            for step in list(pending):
+                if any(dependency not in results for dependency in step.depends_on):
+                    continue
+                pending.remove(step)
+                
+                failed = [d for d in step.depends_on if not results[d].success]
+                if step.name in deferred or (
+                    failed and not step.always_run and all(results[d].deferred for d in failed)
+                ):
+                    reason = 'over its cost budget' if step.name in deferred else (
+                        f"{', '.join(failed)} deferred"
+                    )
+                    logger.warning(f"Deferring {step.title}: {reason}")
+                    results[step.name] = StepResult(step.name, skipped=True, deferred=True)
+                    if manifest:
+                        manifest.step_finished(step.name, STEP_DEFERRED)
+                    continue
+                if failed and not step.always_run:
+                    logger.warning(f"Skipping {step.title}: {', '.join(failed)} failed")
+                    results[step.name] = StepResult(step.name, skipped=True)
+                    if manifest:
+                        manifest.step_finished(step.name, STEP_SKIPPED, error=f"{', '.join(failed)} failed")
+                    continue
+                if manifest:
+                    manifest.step_started(step.name)
+                run_id = manifest.run_id if manifest else None
+                running[executor.submit(run_step, step, full_refresh, run_id)] = step.name
+            
+            if not running:
+                if len(pending) == waiting:
+                    raise ValueError(f"Dependency cycle between ETL steps: {[s.name for s in pending]}")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = results[running.pop(future)] = future.result()
+                if manifest:
+                    manifest.step_finished(
+                        result.name, STEP_SUCCESS if result.success else STEP_FAILED,
+                        result.duration, result.outputs, result.error
+                    )
+    
+    return {name: results[name] for name in names}
+
+
+def plan_pipeline(step_names: Iterable[str], full_refresh: bool = False) -> Dict[str, StepPlan]:
+    """
+    Estimate the cost of ETL steps without running them.
+    
+    Each step is run once under db_utils.plan_mode(), which explains every
+    statement and RPC it issues instead of executing it.
+    
+    Args:
+        step_names: Steps to estimate (dependencies are added automatically)
+        full_refresh: Estimate the full-refresh variant of incremental steps
+    
+    Returns:
+        Step name -> StepPlan, in graph order
+    """
+    plans: Dict[str, StepPlan] = {}
+    for name in with_dependencies(step_names):
+        plan = plans[name] = StepPlan(name)
+        logger.info(f"Planning {ETL_STEPS[name].title}")
+        try:
+            with plan_mode() as estimates:
+                plan.estimates = estimates
+                ETL_STEPS[name].run(full_refresh)
+        except Exception as e:
+            plan.error = str(e)
+            logger.error(f"Planning {ETL_STEPS[name].title} failed: {e}")
+    return plans
+
+
+def run_all_etl_processes(
+    step_names: Iterable[str] = tuple(ETL_STEPS),
+    concurrency: int = ETL_CONCURRENCY,
+    full_refresh: bool = False,
+    resume: Optional[str] = None,
+    over_budget: str = PLAN_OVER_BUDGET
+) -> bool:
+    """
+    Run the selected ETL steps (all by default) and log a summary.
+    
+    Every run writes a manifest (see run_manifest) with per-step status,
+    timings, row counts and outputs. Passing ``resume`` re-opens the
+    manifest of an earlier run and re-executes only the steps that did not
+    complete, with that run's step selection and full_refresh setting.
+    
+    With ``over_budget`` set, the steps about to run are first estimated
+    with plan_pipeline(). Steps over their PLAN_COST_BUDGET either stop the
+    run before anything executes ('refuse') or are deferred ('defer'):
+    they and their dependents are left for a later ``--resume`` (or the
+    daemon's next scheduled run) while the rest of the run proceeds.
+    
+    Args:
+        step_names: Steps to run (ignored when resuming)
+        concurrency: Maximum number of steps running at once
+        full_refresh: Make incremental steps ignore their watermarks
+            (ignored when resuming)
+        resume: Run id of an earlier run to resume
+        over_budget: '', 'refuse' or 'defer'
+    
+    Returns:
+        True if every required step has completed
+    """
+    if resume:
+        try:
+            manifest = RunManifest.load(resume)
+        except FileNotFoundError as e:
+            logger.error(str(e))
+            return False
+        step_names = manifest.options['steps']
+        full_refresh = manifest.options['full_refresh']
+        completed = manifest.completed_steps()
+        remaining = [name for name in with_dependencies(step_names) if name not in completed]
+        if not remaining:
+            logger.info(f"Run {resume} has already completed every step; nothing to resume")
+            return True
+    else:
+        manifest = None
+        completed = []
+    if over_budget not in OVER_BUDGET_POLICIES:
+        raise ValueError(f"Unsupported over-budget policy: {over_budget!r}")
+    
+    mode = 'full refresh' if full_refresh else 'incremental'
+    logger.info("=" * 80)
+    logger.info(f"Starting Analytics ETL Pipeline ({mode}, concurrency={concurrency})")
     logger.info("=" * 80)
-    try:
-        results['rfm'] = etl_rfm.refresh_rfm_analytics()
-        if results['rfm']:
-            etl_rfm.get_rfm_summary()
-            etl_rfm.identify_high_priority_segments()
-    except Exception as e:
-        logger.error(f"RFM segmentation failed: {e}", exc_info=True)
+    
+    start_time = datetime.now()
+    
+    # Cron runs, manual runs and the daemon must not overlap
+    with advisory_lock(PIPELINE_LOCK) as acquired:
+        if not acquired:
+            logger.warning("Another analytics ETL run is in progress; skipping this run")
+            return False
+        
+        deferred = []
+        if over_budget:
+            plans = plan_pipeline(
+                [name for name in with_dependencies(step_names) if name not in completed],
+                full_refresh
+            )
+            log_plan_report(plans, verbose=False)
+            deferred = [name for name, plan in plans.items() if plan.over_budget]
+            if deferred and over_budget == 'refuse':
+                logger.error(f"Refusing to run: {', '.join(deferred)} over cost budget")
+                return False
+        
+        if manifest:
+            manifest.start_attempt()
+            logger.info(
+                f"Resuming run {manifest.run_id} (attempt {manifest.data['attempts']}): "
+                f"re-running {', '.join(remaining)}"
+            )
+        else:
+            manifest = RunManifest.create(step_names, full_refresh)
+            logger.info(f"Run id: {manifest.run_id}")
+        
+        # Every order up to this point is included by the steps below
+        newest_order = newest_order_time()
+        query_stats = add_collector(StepAggregator())
+        results = run_pipeline(
+            step_names, concurrency, full_refresh, manifest, completed, deferred
+        )
     
     # Summary
     duration = (datetime.now() - start_time).total_seconds()
     logger.info("\n" + "=" * 80)
     logger.info("ETL Pipeline Summary")
     logger.info("=" * 80)
-    logger.info(f"Cohort Analysis: {'✓ Success' if results['cohort'] else '✗ Failed'}")
-    logger.info(f"Churn Risk Analysis: {'✓ Success' if results['churn'] else '✗ Failed'}")
-    logger.info(f"Funnel Analysis: {'✓ Success' if results['funnel'] else '✗ Failed'}")
-    logger.info(f"LTV Analysis: {'✓ Success' if results['ltv'] else '✗ Failed'}")
-    logger.info(f"RFM Segmentation: {'✓ Success' if results['rfm'] else '✗ Failed'}")
-    logger.info(f"Total duration: {duration:.2f} seconds")
-    
-    # Run VACUUM ANALYZE on entire database
-    try:
-        logger.info("Running VACUUM ANALYZE on database...")
-        vacuum_analyze()
-    except Exception as e:
-        logger.warning(f"VACUUM ANALYZE failed: {e}")
+    for name, result in results.items():
+        if result.resumed:
+            status = '✓ Completed earlier'
+        elif result.deferred:
+            status = '- Deferred (over cost budget)'
+        elif result.skipped:
+            status = '- Skipped'
+        else:
+            status = '✓ Success' if result.success else '✗ Failed'
+        logger.info(f"{ETL_STEPS[name].title}: {status} ({result.duration:.2f}s)")
+    step_time = sum(result.duration for result in results.values())
+    logger.info(f"Total duration: {duration:.2f} seconds ({step_time:.2f}s of step time)")
+    
+    stmt_stats = get_prepared_statement_stats()
+    logger.info(
+        f"Prepared statements: {stmt_stats['hits']} hits, "
+        f"{stmt_stats['misses']} misses, {stmt_stats['evictions']} evictions, "
+        f"{stmt_stats['fallbacks']} fallbacks"
+    )
     
-    # Return success if all processes completed
-    all_success = all(results.values())
+    remove_collector(query_stats)
+    step_stats = query_stats.report()
+    
+    # Return success if all required processes completed (or were deferred)
+    all_success = all(
+        result.success or result.deferred
+        for name, result in results.items() if ETL_STEPS[name].required
+    )
+    manifest.finish(all_success)
+    logger.info(f"Run manifest: {manifest.path}")
+    metrics_path = record_pipeline_run(
+        results, duration, all_success,
+        {name: stats['rows'] for name, stats in step_stats.items()}, newest_order
+    )
+    if metrics_path:
+        logger.info(f"Metrics written to {metrics_path}")
     if all_success:
         logger.info("\n✓ All ETL processes completed successfully")
     else:
         logger.error("\n✗ Some ETL processes failed")
+        logger.error(f"Re-run only the unfinished steps with: etl_aggregate.py --resume {manifest.run_id}")
+    deferred_steps = [name for name, result in results.items() if result.deferred]
+    if deferred_steps and all_success:
+        logger.warning(
+            f"Deferred {', '.join(deferred_steps)}; run them later with: "
+            f"etl_aggregate.py --resume {manifest.run_id}"
+        )
     
     return all_success
 
 
+def run_maintenance_only() -> bool:
+    """Run just the maintenance step, under the pipeline lock."""
+    with advisory_lock(PIPELINE_LOCK) as acquired:
+        if not acquired:
+            logger.warning("Another analytics ETL run is in progress; skipping maintenance")
+            return False
+        return run_step(ETL_STEPS['maintenance']).success
+
+
+def run_daemon(concurrency: int = ETL_CONCURRENCY) -> bool:
+    """
+    Run the pipeline on ETL_SCHEDULES until SIGTERM or SIGINT.
+    
+    The process keeps its connection pool open between runs, and the LTV
+    and RFM snapshots stay in memory until their data version changes (see
+    etl_state.get_data_version()). Steps due at the same time share one
+    pipeline run, with their dependencies pulled in as usual; a scheduled
+    maintenance runs only the maintenance step, after any analyses due with
+    it. A shutdown signal lets the current run finish before the pool is
+    closed.
+    """
+    unknown = set(ETL_SCHEDULES) - set(ETL_STEPS)
+    if unknown:
+        logger.error(f"ETL_SCHEDULES names unknown steps: {', '.join(sorted(unknown))}")
+        return False
+    
+    logger.info("=" * 80)
+    logger.info(f"Starting Analytics ETL daemon (concurrency={concurrency})")
+    logger.info("=" * 80)
+    
+    # Open the pool up front so a bad DATABASE_URL fails at startup
+    execute_query("SELECT 1;", read_only=False)
+    
+    def run_scheduled(step_names: List[str]) -> bool:
+        # Pooled connections outlive migrations applied between runs; drop
+        # their prepared statements rather than reuse stale plans
+        invalidate_prepared_statements()
+        analyses = [name for name in step_names if name != 'maintenance']
+        success = run_all_etl_processes(analyses, concurrency) if analyses else True
+        if 'maintenance' in step_names:
+            success = run_maintenance_only() and success
+        return success
+    
+    scheduler = Scheduler(ETL_SCHEDULES, run_scheduled, jitter=SCHEDULER_JITTER)
+    scheduler.install_signal_handlers()
+    try:
+        scheduler.run_forever()
+    finally:
+        close_pool()
+    
+    logger.info("Analytics ETL daemon stopped")
+    return True
+
+
+def run_shard_worker(workers: int = ETL_SHARD_WORKERS) -> bool:
+    """
+    Process churn/RFM shards of runs started anywhere until SIGTERM or SIGINT.
+    
+    Start one per extra machine (or process) to spread sharded steps
+    (ETL_SHARDS > 1) over more workers; the pipeline run that created the
+    shards merges the results.
+    """
+    logger.info("=" * 80)
+    logger.info(f"Starting Analytics shard worker ({workers} threads)")
+    logger.info("=" * 80)
+    
+    # Open the pool up front so a bad DATABASE_URL fails at startup
+    execute_query("SELECT 1;", read_only=False)
+    
+    worker = ShardWorker(workers)
+    worker.install_signal_handlers()
+    try:
+        worker.run_forever()
+    finally:
+        close_pool()
+    return True
+
+
+def run_selected(args) -> bool:
+    """Run the ETL processes selected on the command line."""
+    if args.all:
+        step_names = list(ETL_STEPS)
+    else:
+        step_names = [name for name in ANALYSIS_STEPS if getattr(args, name)]
+    if args.plan:
+        plans = plan_pipeline(step_names, args.full_refresh)
+        log_plan_report(plans)
+        return not any(plan.over_budget for plan in plans.values())
+    return run_all_etl_processes(
+        step_names, args.concurrency, args.full_refresh, args.resume, args.over_budget
+    )
+
+
 def main():
     """Main entry point with command-line argument parsing."""
     parser = argparse.ArgumentParser(
@@ -165,37 +579,68 @@ def main():
         action='store_true',
         help='Run all ETL processes (default)'
     )
+    parser.add_argument(
+        '--full-refresh',
+        action='store_true',
+        help='Ignore stored watermarks and recompute from all orders'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=ETL_CONCURRENCY,
+        help=f'Maximum number of steps run at once (default: {ETL_CONCURRENCY})'
+    )
+    parser.add_argument(
+        '--resume',
+        metavar='RUN_ID',
+        help='Resume an earlier run, re-running only the steps that did not complete'
+    )
+    parser.add_argument(
+        '--plan',
+        action='store_true',
+        help='Estimate the cost of the selected steps with EXPLAIN instead of running them'
+    )
+    parser.add_argument(
+        '--over-budget',
+        choices=['refuse', 'defer'],
+        default=PLAN_OVER_BUDGET,
+        help='Estimate costs first and refuse the run, or defer steps, over PLAN_COST_BUDGET'
+    )
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Keep running and execute steps on ETL_SCHEDULES until SIGTERM'
+    )
+    parser.add_argument(
+        '--shard-worker',
+        action='store_true',
+        help='Keep running and process churn/RFM shards of any run until SIGTERM'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write a CPU/memory/DB-wait profile report of each step to logs/ (runs steps one at a time)'
+    )
     
     args = parser.parse_args()
+    configure_logging('etl.log')
+    
+    if args.daemon:
+        sys.exit(0 if run_daemon(args.concurrency) else 1)
+    if args.shard_worker:
+        sys.exit(0 if run_shard_worker() else 1)
     
     # Default to --all if no specific flag is provided
     if not (args.cohort or args.churn or args.funnel or args.ltv or args.rfm):
         args.all = True
     
-    success = True
+    if args.profile and args.concurrency != 1:
+        # Memory peaks are process-wide, so profiled steps run one at a time
+        logger.info("Profiling: running steps sequentially")
+        args.concurrency = 1
     
-    if args.all:
-        success = run_all_etl_processes()
-    else:
-        if args.cohort:
-            logger.info("Running cohort analysis only")
-            success = etl_cohort.refresh_cohort_analytics() and success
-            
-        if args.churn:
-            logger.info("Running churn risk analysis only")
-            success = etl_churn.refresh_churn_risk() and success
-            
-        if args.funnel:
-            logger.info("Running funnel analysis only")
-            success = etl_funnel.refresh_funnel_analytics() and success
-            
-        if args.ltv:
-            logger.info("Running LTV analysis only")
-            success = etl_ltv.refresh_ltv_analytics() and success
-            
-        if args.rfm:
-            logger.info("Running RFM segmentation only")
-            success = etl_rfm.refresh_rfm_analytics() and success
+    with profiled_run('etl_aggregate', args.profile):
+        success = run_selected(args)
     
     sys.exit(0 if success else 1)
 
@@ -1,28 +1,62 @@
 #!/usr/bin/env python3
 """ETL script for churn risk analysis."""
 
+import asyncio
+import argparse
 import logging
 import sys
-from datetime import datetime
-from db_utils import call_rpc_function, execute_query, vacuum_analyze
-from config import LOGS_DIR, LOG_FORMAT, LOG_LEVEL
-
-# Setup logging
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.FileHandler(LOGS_DIR / 'churn.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from datetime import datetime, timezone
+from typing import Optional
+import db_async
+from db_utils import call_rpc_function, execute_query, run_maintenance
+from run_manifest import record_output
+from sharding import new_run_key, run_sharded
+from profiling import profile_step, profiled_run
+from config import configure_logging, ETL_SHARDS
+
 logger = logging.getLogger(__name__)
 
 
-def refresh_churn_risk() -> bool:
+def refresh_churn_risk_shard(
+    shard: int,
+    shard_count: int,
+    run_key: str,
+    from_stats: bool = False,
+    run_started_at: Optional[str] = None
+) -> int:
+    """
+    Score one shard of customers into user_churn_risk.
+    
+    Args:
+        shard: Shard number (0-based)
+        shard_count: Number of shards the customers are split into
+        run_key: Key of the sharded run (unused; rows are keyed by date)
+        from_stats: Score from analytics_customer_stats
+        run_started_at: Timestamp stored as calculated_at, so every shard
+            of a run lands on the same date
+    
+    Returns:
+        Number of customers scored
+    """
+    params = {'from_stats': from_stats, 'shard': shard, 'shard_count': shard_count}
+    if run_started_at:
+        params['run_started_at'] = run_started_at
+    result = call_rpc_function('refresh_churn_risk', params)
+    return (result[0]['refresh_churn_risk'] if result else 0) or 0
+
+
+def refresh_churn_risk(from_stats: bool = False) -> bool:
     """
     Refresh churn risk data by calling the database function.
     
+    With ETL_SHARDS > 1 the customers are scored in shards (see
+    sharding.run_sharded()), which other shard workers can help with.
+    
+    Args:
+        from_stats: Score customers from analytics_customer_stats (kept
+            current incrementally by etl_customer_stats) instead of
+            aggregating every order
+    
     Returns:
         True if successful, False otherwise
     """
@@ -31,7 +65,13 @@ def refresh_churn_risk() -> bool:
     
     try:
         # Call the RPC function that refreshes churn risk data
-        result = call_rpc_function('refresh_churn_risk')
+        if ETL_SHARDS > 1:
+            run_sharded('churn', {
+                'from_stats': from_stats,
+                'run_started_at': datetime.now(timezone.utc).isoformat(),
+            }, new_run_key('churn'))
+        else:
+            call_rpc_function('refresh_churn_risk', {'from_stats': from_stats})
         
         # Get statistics
         query = """
@@ -58,12 +98,13 @@ def refresh_churn_risk() -> bool:
             logger.info(f"  - Low risk: {s['low_count']}")
             logger.info(f"  - Average risk score: {s['avg_risk_score']}")
             logger.info(f"  - Last calculated: {s['last_calculated']}")
+            record_output('user_churn_risk', s['total_users'])
         
         duration = (datetime.now() - start_time).total_seconds()
         logger.info(f"Churn risk refresh completed in {duration:.2f} seconds")
         
-        # Run VACUUM ANALYZE to optimize table
-        vacuum_analyze('user_churn_risk')
+        # VACUUM/ANALYZE the table if its statistics show it needs it
+        run_maintenance(['user_churn_risk'])
         
         return True
         
@@ -151,17 +192,52 @@ def get_churn_trends() -> dict:
         return {}
 
 
+async def get_churn_reports_async(limit: int = 20) -> dict:
+    """
+    Run the independent churn reports concurrently.
+    
+    Args:
+        limit: Number of high-risk users to return
+        
+    Returns:
+        Dict with 'high_risk_users' and 'trends'
+    """
+    high_risk_users, trends = await asyncio.gather(
+        db_async.run_sync(get_high_risk_users, limit=limit),
+        db_async.run_sync(get_churn_trends),
+    )
+    return {'high_risk_users': high_risk_users, 'trends': trends}
+
+
+async def main_async() -> bool:
+    """Async ETL process for churn risk analysis."""
+    success = await db_async.run_sync(refresh_churn_risk)
+    if success:
+        await get_churn_reports_async(limit=20)
+    return success
+
+
 def main():
     """Main ETL process for churn risk analysis."""
+    parser = argparse.ArgumentParser(
+        description='Run the churn risk analysis ETL'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write a CPU/memory/DB-wait profile report to logs/'
+    )
+    args = parser.parse_args()
+    configure_logging('churn.log')
+    
     logger.info("=" * 80)
     logger.info("Starting Churn Risk Analysis ETL")
     logger.info("=" * 80)
     
-    success = refresh_churn_risk()
+    with profiled_run('churn', args.profile), profile_step('churn'):
+        success = asyncio.run(main_async())
     
     if success:
-        get_high_risk_users(limit=20)
-        get_churn_trends()
         logger.info("Churn ETL completed successfully")
         sys.exit(0)
     else:
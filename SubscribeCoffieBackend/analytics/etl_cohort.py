@@ -1,21 +1,15 @@
 #!/usr/bin/env python3
 """ETL script for cohort analysis."""
 
+import argparse
 import logging
 import sys
 from datetime import datetime
-from db_utils import call_rpc_function, execute_query, vacuum_analyze
-from config import LOGS_DIR, LOG_FORMAT, LOG_LEVEL, COHORT_MONTHS_BACK
+from db_utils import call_rpc_function, execute_query, run_maintenance
+from run_manifest import record_output
+from profiling import profile_step, profiled_run
+from config import configure_logging, COHORT_MONTHS_BACK
 
-# Setup logging
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.FileHandler(LOGS_DIR / 'cohort.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger(__name__)
 
 
@@ -51,12 +45,13 @@ def refresh_cohort_analytics(months_back: int = COHORT_MONTHS_BACK) -> bool:
             logger.info(f"  - Total cohorts: {stats[0]['total_cohorts']}")
             logger.info(f"  - Unique months: {stats[0]['unique_months']}")
             logger.info(f"  - Last updated: {stats[0]['last_updated']}")
+            record_output('cohort_analytics', stats[0]['total_cohorts'])
         
         duration = (datetime.now() - start_time).total_seconds()
         logger.info(f"Cohort analytics completed in {duration:.2f} seconds")
         
-        # Run VACUUM ANALYZE to optimize table
-        vacuum_analyze('cohort_analytics')
+        # VACUUM/ANALYZE the table if its statistics show it needs it
+        run_maintenance(['cohort_analytics'])
         
         return True
         
@@ -106,14 +101,27 @@ def get_cohort_summary() -> dict:
 
 def main():
     """Main ETL process for cohort analysis."""
+    parser = argparse.ArgumentParser(
+        description='Run the cohort analysis ETL'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write a CPU/memory/DB-wait profile report to logs/'
+    )
+    args = parser.parse_args()
+    configure_logging('cohort.log')
+    
     logger.info("=" * 80)
     logger.info("Starting Cohort Analysis ETL")
     logger.info("=" * 80)
     
-    success = refresh_cohort_analytics()
+    with profiled_run('cohort', args.profile), profile_step('cohort'):
+        success = refresh_cohort_analytics()
+        if success:
+            get_cohort_summary()
     
     if success:
-        get_cohort_summary()
         logger.info("Cohort ETL completed successfully")
         sys.exit(0)
     else:
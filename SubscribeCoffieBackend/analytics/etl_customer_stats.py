@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""ETL script for incremental per-customer order statistics."""
+
+import argparse
+import logging
+import sys
+from datetime import datetime, timedelta
+from db_utils import call_rpc_function, run_maintenance
+from etl_state import get_watermark, save_watermark
+from run_manifest import record_output
+from profiling import profile_step, profiled_run
+from config import configure_logging, WATERMARK_OVERLAP
+
+logger = logging.getLogger(__name__)
+
+STEP_NAME = 'customer_stats'
+
+
+def refresh_customer_stats(full_refresh: bool = False) -> bool:
+    """
+    Bring analytics_customer_stats up to date.
+    
+    Incremental runs only re-aggregate customers whose orders changed
+    (by orders.updated_at) since the stored watermark, minus
+    WATERMARK_OVERLAP to catch transactions that committed late. The first
+    run, or full_refresh=True, rebuilds the table from every order.
+    
+    Args:
+        full_refresh: Ignore the watermark and rebuild from scratch
+    
+    Returns:
+        True if successful, False otherwise
+    """
+    start_time = datetime.now()
+    
+    try:
+        watermark = None if full_refresh else get_watermark(STEP_NAME)
+        if watermark is None:
+            changed_since = None
+            mode = 'full'
+            logger.info("Starting full customer stats refresh")
+        else:
+            changed_since = watermark - timedelta(seconds=WATERMARK_OVERLAP)
+            mode = 'incremental'
+            logger.info(f"Starting incremental customer stats refresh (changed since {changed_since})")
+        
+        result = call_rpc_function('refresh_customer_stats', {'changed_since': changed_since})
+        row = result[0] if result else {}
+        customers = row.get('customers_refreshed') or 0
+        
+        save_watermark(STEP_NAME, row.get('high_watermark') or watermark, mode, customers)
+        record_output('analytics_customer_stats', customers)
+        
+        duration = (datetime.now() - start_time).total_seconds()
+        logger.info(
+            f"Customer stats refreshed ({mode}): {customers} customers "
+            f"in {duration:.2f} seconds"
+        )
+        
+        run_maintenance(['analytics_customer_stats'])
+        
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error refreshing customer stats: {e}", exc_info=True)
+        return False
+
+
+def main():
+    """Main ETL process for customer stats."""
+    parser = argparse.ArgumentParser(
+        description='Refresh per-customer order statistics'
+    )
+    parser.add_argument(
+        '--full-refresh',
+        action='store_true',
+        help='Ignore the stored watermark and rebuild from all orders'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write a CPU/memory/DB-wait profile report to logs/'
+    )
+    args = parser.parse_args()
+    configure_logging('customer_stats.log')
+    
+    logger.info("=" * 80)
+    logger.info("Starting Customer Stats ETL")
+    logger.info("=" * 80)
+    
+    with profiled_run('customer_stats', args.profile), profile_step('customer_stats'):
+        success = refresh_customer_stats(full_refresh=args.full_refresh)
+    
+    if success:
+        logger.info("Customer stats ETL completed successfully")
+        sys.exit(0)
+    else:
+        logger.error("Customer stats ETL failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
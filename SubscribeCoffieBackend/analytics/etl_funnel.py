@@ -1,37 +1,68 @@
 #!/usr/bin/env python3
 """ETL script for conversion funnel analysis."""
 
+import argparse
 import logging
 import sys
-from datetime import datetime
+from datetime import date, datetime
+from typing import Optional
 from db_utils import call_rpc_function, execute_query
-from config import LOGS_DIR, LOG_FORMAT, LOG_LEVEL
-
-# Setup logging
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.FileHandler(LOGS_DIR / 'funnel.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from run_manifest import record_output
+from profiling import profile_step, profiled_run
+from config import configure_logging, FUNNEL_WINDOW_DAYS
+
 logger = logging.getLogger(__name__)
 
 
-def refresh_funnel_analytics() -> bool:
+FUNNEL_RESULTS_QUERY = """
+    SELECT
+        run_date,
+        cafe_id,
+        window_days,
+        from_date,
+        to_date,
+        step_number,
+        step_name,
+        user_count,
+        conversion_from_previous,
+        conversion_from_start,
+        avg_time_to_next_step
+    FROM funnel_results
+    WHERE cafe_id IS NOT DISTINCT FROM %(cafe_id)s
+      AND window_days = %(window_days)s
+      AND run_date = COALESCE(%(run_date)s, (
+          SELECT MAX(run_date) FROM funnel_results
+          WHERE cafe_id IS NOT DISTINCT FROM %(cafe_id)s
+            AND window_days = %(window_days)s
+      ))
+    ORDER BY step_number;
+"""
+
+
+def refresh_funnel_analytics(
+    window_days: int = FUNNEL_WINDOW_DAYS,
+    cafe_id: Optional[str] = None
+) -> bool:
     """
-    Refresh funnel analytics by calling the database function.
+    Compute the conversion funnel once and store it in funnel_results.
+    
+    Args:
+        window_days: Length of the funnel window ending now
+        cafe_id: Restrict to one cafe (None for all cafes)
     
     Returns:
         True if successful, False otherwise
     """
-    logger.info("Starting funnel analytics refresh")
+    logger.info(f"Starting funnel analytics refresh (window_days={window_days})")
     start_time = datetime.now()
     
     try:
-        # Call the RPC function that calculates funnel metrics
-        result = call_rpc_function('calculate_conversion_funnel')
+        # Calculate the funnel on the server and persist it for today's run
+        call_rpc_function('refresh_funnel_results', {
+            'cafe_id_param': cafe_id,
+            'window_days': window_days,
+        })
+        result = get_funnel_results(cafe_id=cafe_id, window_days=window_days)
         
         if result:
             logger.info(f"Funnel analytics calculated successfully:")
@@ -42,6 +73,7 @@ def refresh_funnel_analytics() -> bool:
                     f"({step['conversion_from_previous']:.1f}% from previous, "
                     f"{step['conversion_from_start']:.1f}% from start)"
                 )
+            record_output('funnel_results', len(result))
         
         duration = (datetime.now() - start_time).total_seconds()
         logger.info(f"Funnel analytics completed in {duration:.2f} seconds")
@@ -53,12 +85,90 @@ def refresh_funnel_analytics() -> bool:
         return False
 
 
-def get_funnel_bottlenecks(threshold: float = 50.0) -> list:
+def get_funnel_results(
+    run_date: Optional[date] = None,
+    cafe_id: Optional[str] = None,
+    window_days: int = FUNNEL_WINDOW_DAYS,
+    result_format: str = 'dicts'
+):
+    """
+    Read a stored funnel from funnel_results.
+    
+    Args:
+        run_date: Run to read (defaults to the latest stored run)
+        cafe_id: Cafe the funnel was computed for (None for all cafes)
+        window_days: Window the funnel was computed over
+        result_format: Result format, see db_utils.execute_query()
+    
+    Returns:
+        Funnel steps ordered by step number
+    """
+    params = {'run_date': run_date, 'cafe_id': cafe_id, 'window_days': window_days}
+    return execute_query(FUNNEL_RESULTS_QUERY, params, result_format=result_format)
+
+
+def get_funnel_history(
+    days_back: int = 30,
+    cafe_id: Optional[str] = None,
+    window_days: int = FUNNEL_WINDOW_DAYS
+) -> list:
+    """
+    Get the overall conversion of each stored funnel run.
+    
+    Args:
+        days_back: Number of past run dates to include
+        cafe_id: Cafe the funnels were computed for (None for all cafes)
+        window_days: Window the funnels were computed over
+    
+    Returns:
+        One row per run date with starting, completing users and conversion
+    """
+    logger.info(f"Getting funnel history (last {days_back} days)")
+    
+    query = """
+        SELECT
+            run_date,
+            (ARRAY_AGG(user_count ORDER BY step_number))[1] as starting_users,
+            (ARRAY_AGG(user_count ORDER BY step_number DESC))[1] as completing_users,
+            (ARRAY_AGG(conversion_from_start ORDER BY step_number DESC))[1] as overall_conversion
+        FROM funnel_results
+        WHERE cafe_id IS NOT DISTINCT FROM %s
+          AND window_days = %s
+          AND run_date >= CURRENT_DATE - %s::int
+        GROUP BY run_date
+        ORDER BY run_date DESC;
+    """
+    
+    try:
+        result = execute_query(query, (cafe_id, window_days, days_back))
+        
+        if result:
+            logger.info("Funnel conversion by run date:")
+            for row in result:
+                logger.info(
+                    f"  {row['run_date']}: {row['overall_conversion']:.1f}% "
+                    f"({row['completing_users']}/{row['starting_users']} users)"
+                )
+        
+        return result if result else []
+        
+    except Exception as e:
+        logger.error(f"Error getting funnel history: {e}")
+        return []
+
+
+def get_funnel_bottlenecks(
+    threshold: float = 50.0,
+    cafe_id: Optional[str] = None,
+    window_days: int = FUNNEL_WINDOW_DAYS
+) -> list:
     """
     Identify funnel steps with low conversion rates.
     
     Args:
         threshold: Minimum acceptable conversion rate (%)
+        cafe_id: Cafe the funnel was computed for (None for all cafes)
+        window_days: Window the funnel was computed over
         
     Returns:
         List of bottleneck steps
@@ -66,7 +176,7 @@ def get_funnel_bottlenecks(threshold: float = 50.0) -> list:
     logger.info(f"Identifying funnel bottlenecks (threshold: {threshold}%)")
     
     try:
-        result = call_rpc_function('calculate_conversion_funnel')
+        result = get_funnel_results(cafe_id=cafe_id, window_days=window_days)
         
         if not result:
             logger.warning("No funnel data available")
@@ -94,17 +204,24 @@ def get_funnel_bottlenecks(threshold: float = 50.0) -> list:
         return []
 
 
-def get_funnel_summary() -> dict:
+def get_funnel_summary(
+    cafe_id: Optional[str] = None,
+    window_days: int = FUNNEL_WINDOW_DAYS
+) -> dict:
     """
     Get overall funnel performance summary.
     
+    Args:
+        cafe_id: Cafe the funnel was computed for (None for all cafes)
+        window_days: Window the funnel was computed over
+    
     Returns:
         Dict with funnel summary statistics
     """
     logger.info("Generating funnel summary")
     
     try:
-        result = call_rpc_function('calculate_conversion_funnel')
+        result = get_funnel_results(cafe_id=cafe_id, window_days=window_days)
         
         if not result:
             return {}
@@ -182,16 +299,29 @@ def get_time_based_funnel_stats() -> dict:
 
 def main():
     """Main ETL process for funnel analysis."""
+    parser = argparse.ArgumentParser(
+        description='Run the funnel analysis ETL'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write a CPU/memory/DB-wait profile report to logs/'
+    )
+    args = parser.parse_args()
+    configure_logging('funnel.log')
+    
     logger.info("=" * 80)
     logger.info("Starting Funnel Analysis ETL")
     logger.info("=" * 80)
     
-    success = refresh_funnel_analytics()
+    with profiled_run('funnel', args.profile), profile_step('funnel'):
+        success = refresh_funnel_analytics()
+        if success:
+            get_funnel_summary()
+            get_funnel_bottlenecks(threshold=50.0)
+            get_time_based_funnel_stats()
     
     if success:
-        get_funnel_summary()
-        get_funnel_bottlenecks(threshold=50.0)
-        get_time_based_funnel_stats()
         logger.info("Funnel ETL completed successfully")
         sys.exit(0)
     else:
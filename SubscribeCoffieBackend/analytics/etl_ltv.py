@@ -1,30 +1,100 @@
 #!/usr/bin/env python3
 """ETL script for customer lifetime value (LTV) analysis."""
 
+import argparse
 import logging
 import sys
 from datetime import datetime
-from db_utils import call_rpc_function, execute_query
-from config import LOGS_DIR, LOG_FORMAT, LOG_LEVEL, COHORT_MONTHS_BACK
+from typing import Optional
+import numpy as np
+import pandas as pd
+from db_utils import call_rpc_function
+from etl_state import get_data_version
+from run_manifest import record_output
+from profiling import profile_step, profiled_run
+from config import configure_logging, COHORT_MONTHS_BACK
 
-# Setup logging
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.FileHandler(LOGS_DIR / 'ltv.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger(__name__)
 
 
-def refresh_ltv_analytics(months_back: int = COHORT_MONTHS_BACK) -> bool:
+# Column types of the LTV snapshot (the columns of calculate_customer_ltv()
+# the reports read); segments are low-cardinality labels
+LTV_DTYPES = {
+    'customer_phone': 'string',
+    'customer_age_days': 'int64',
+    'total_orders': 'int64',
+    'total_spent': 'int64',
+    'avg_order_value': 'float64',
+    'order_frequency': 'float64',
+    'predicted_ltv': 'float64',
+    'customer_segment': 'category',
+}
+
+# Result of the last calculate_customer_ltv() call and its window; every
+# report below is derived from it so one run aggregates orders once
+_snapshot: Optional[pd.DataFrame] = None
+_snapshot_months_back: Optional[int] = None
+# Data version it was computed from, when loaded with reuse
+_snapshot_version: Optional[tuple] = None
+
+
+def load_ltv_snapshot(months_back: int = COHORT_MONTHS_BACK, reuse: bool = False) -> pd.DataFrame:
+    """
+    Evaluate calculate_customer_ltv() and keep the result for this run.
+    
+    With ``reuse`` a long-running process (the ETL daemon) keeps the
+    previous snapshot while no order has changed since it was computed
+    (see etl_state.get_data_version()).
+    
+    Args:
+        months_back: Number of months to analyze
+        reuse: Return the kept snapshot if its data has not changed
+        
+    Returns:
+        Typed DataFrame with one row per customer
+    
+    Raises:
+        ValueError: If the function does not return a column of LTV_DTYPES
+    """
+    global _snapshot, _snapshot_months_back, _snapshot_version
+    version = get_data_version() if reuse else None
+    if version is not None and version == _snapshot_version and months_back == _snapshot_months_back:
+        logger.info(f"Orders unchanged since {version[0]}; reusing the kept LTV snapshot")
+        return _snapshot
+    
+    _snapshot_version = None
+    df = call_rpc_function(
+        'calculate_customer_ltv', {'months_back': months_back}, result_format='dataframe'
+    )
+    # Calls only planned under plan_mode() return a frame without columns
+    if len(df.columns):
+        missing = [column for column in LTV_DTYPES if column not in df.columns]
+        if missing:
+            raise ValueError(
+                f"calculate_customer_ltv() returned no {', '.join(missing)} column(s)"
+            )
+        df = df.astype(LTV_DTYPES)
+    _snapshot = df
+    _snapshot_months_back = months_back
+    _snapshot_version = version
+    return _snapshot
+
+
+def get_ltv_snapshot(months_back: int = COHORT_MONTHS_BACK) -> pd.DataFrame:
+    """Return the LTV snapshot for a window, loading it if not already loaded."""
+    if _snapshot is None or _snapshot_months_back != months_back:
+        return load_ltv_snapshot(months_back)
+    return _snapshot
+
+
+def refresh_ltv_analytics(months_back: int = COHORT_MONTHS_BACK, reuse: bool = False) -> bool:
     """
     Refresh LTV analytics by calling the database function.
     
     Args:
         months_back: Number of months to analyze
+        reuse: Keep the previous snapshot if no order has changed (see
+            load_ltv_snapshot())
         
     Returns:
         True if successful, False otherwise
@@ -33,14 +103,15 @@ def refresh_ltv_analytics(months_back: int = COHORT_MONTHS_BACK) -> bool:
     start_time = datetime.now()
     
     try:
-        # Call the RPC function that calculates LTV
-        result = call_rpc_function('calculate_customer_ltv', {'months_back': months_back})
+        # Materialize the customer table once; the reports reuse this snapshot
+        snapshot = load_ltv_snapshot(months_back, reuse)
         
-        if not result:
+        if snapshot.empty:
             logger.warning("No LTV data returned")
             return False
         
-        logger.info(f"LTV calculated for {len(result)} customers")
+        logger.info(f"LTV calculated for {len(snapshot)} customers")
+        record_output('memory:ltv_snapshot', len(snapshot))
         
         duration = (datetime.now() - start_time).total_seconds()
         logger.info(f"LTV analytics completed in {duration:.2f} seconds")
@@ -52,43 +123,46 @@ def refresh_ltv_analytics(months_back: int = COHORT_MONTHS_BACK) -> bool:
         return False
 
 
-def get_ltv_summary() -> dict:
+def get_ltv_summary(months_back: int = COHORT_MONTHS_BACK) -> dict:
     """
     Get summary statistics for LTV analysis.
     
+    Args:
+        months_back: Window of the snapshot to summarize
+    
     Returns:
         Dict with LTV summary statistics
     """
     logger.info("Generating LTV summary")
     
-    query = """
-        WITH ltv_data AS (
-            SELECT * FROM calculate_customer_ltv(12)
-        )
-        SELECT 
-            COUNT(*) as total_customers,
-            ROUND(AVG(total_spent), 2) as avg_total_spent,
-            ROUND(AVG(avg_order_value), 2) as avg_order_value,
-            ROUND(AVG(predicted_annual_revenue), 2) as avg_predicted_annual,
-            COUNT(*) FILTER (WHERE customer_segment = 'vip') as vip_count,
-            COUNT(*) FILTER (WHERE customer_segment = 'high_value') as high_value_count,
-            COUNT(*) FILTER (WHERE customer_segment = 'medium_value') as medium_value_count,
-            COUNT(*) FILTER (WHERE order_frequency_segment = 'frequent') as frequent_count,
-            COUNT(*) FILTER (WHERE order_frequency_segment = 'regular') as regular_count,
-            COUNT(*) FILTER (WHERE order_frequency_segment = 'new') as new_count
-        FROM ltv_data;
-    """
-    
     try:
-        result = execute_query(query)
+        df = get_ltv_snapshot(months_back)
         
-        if result:
-            summary = result[0]
+        if not df.empty:
+            # Below medium_value, customer_segment grades order count instead
+            # (frequent, regular, new)
+            segment = df['customer_segment']
+            summary = {
+                'total_customers': len(df),
+                'avg_total_spent': round(float(df['total_spent'].mean()), 2),
+                'avg_order_value': round(float(df['avg_order_value'].mean()), 2),
+                'avg_predicted_ltv': round(float(df['predicted_ltv'].mean()), 2),
+                'avg_monthly_orders': round(float(df['order_frequency'].mean()), 2),
+                'avg_customer_age_days': round(float(df['customer_age_days'].mean()), 1),
+                'vip_count': int((segment == 'vip').sum()),
+                'high_value_count': int((segment == 'high_value').sum()),
+                'medium_value_count': int((segment == 'medium_value').sum()),
+                'frequent_count': int((segment == 'frequent').sum()),
+                'regular_count': int((segment == 'regular').sum()),
+                'new_count': int((segment == 'new').sum()),
+            }
             logger.info(f"LTV Summary:")
             logger.info(f"  - Total customers: {summary['total_customers']}")
             logger.info(f"  - Avg total spent: ₽{summary['avg_total_spent']}")
             logger.info(f"  - Avg order value: ₽{summary['avg_order_value']}")
-            logger.info(f"  - Avg predicted annual: ₽{summary['avg_predicted_annual']}")
+            logger.info(f"  - Avg predicted LTV (annual): ₽{summary['avg_predicted_ltv']}")
+            logger.info(f"  - Avg orders per month: {summary['avg_monthly_orders']}")
+            logger.info(f"  - Avg customer age: {summary['avg_customer_age_days']} days")
             logger.info(f"  - VIP customers: {summary['vip_count']}")
             logger.info(f"  - High value: {summary['high_value_count']}")
             logger.info(f"  - Medium value: {summary['medium_value_count']}")
@@ -103,40 +177,37 @@ def get_ltv_summary() -> dict:
         return {}
 
 
-def get_top_customers(limit: int = 20, segment: str = 'vip') -> list:
+def get_top_customers(
+    limit: int = 20,
+    segment: str = 'vip',
+    months_back: int = COHORT_MONTHS_BACK
+) -> list:
     """
     Get top customers by LTV.
     
     Args:
         limit: Number of customers to return
         segment: Customer segment filter
+        months_back: Window of the snapshot to read
         
     Returns:
         List of top customers
     """
     logger.info(f"Getting top {limit} customers (segment: {segment})")
     
-    query = """
-        WITH ltv_data AS (
-            SELECT * FROM calculate_customer_ltv(12)
-        )
-        SELECT 
-            customer_phone,
-            total_spent,
-            total_orders,
-            avg_order_value,
-            predicted_annual_revenue,
-            customer_segment,
-            order_frequency_segment,
-            days_since_first_order
-        FROM ltv_data
-        WHERE customer_segment = %s
-        ORDER BY total_spent DESC
-        LIMIT %s;
-    """
+    columns = [
+        'customer_phone', 'total_spent', 'total_orders', 'avg_order_value',
+        'order_frequency', 'predicted_ltv', 'customer_segment', 'customer_age_days',
+    ]
     
     try:
-        result = execute_query(query, (segment, limit))
+        df = get_ltv_snapshot(months_back)
+        result = []
+        if not df.empty:
+            customers = df.loc[df['customer_segment'] == segment, columns]
+            customers = customers.nlargest(limit, 'total_spent')
+            customers['customer_segment'] = customers['customer_segment'].astype(str)
+            result = customers.to_dict('records')
         
         if result:
             logger.info(f"Found {len(result)} {segment} customers:")
@@ -145,42 +216,41 @@ def get_top_customers(limit: int = 20, segment: str = 'vip') -> list:
                     f"  {i}. Phone: {customer['customer_phone'][:8]}***, "
                     f"Spent: ₽{customer['total_spent']}, "
                     f"Orders: {customer['total_orders']}, "
-                    f"Predicted Annual: ₽{customer['predicted_annual_revenue']:.0f}"
+                    f"Predicted LTV: ₽{customer['predicted_ltv']:.0f}"
                 )
         
-        return result if result else []
+        return result
         
     except Exception as e:
         logger.error(f"Error getting top customers: {e}")
         return []
 
 
-def get_ltv_distribution() -> dict:
+def get_ltv_distribution(months_back: int = COHORT_MONTHS_BACK) -> dict:
     """
     Get distribution of customers across LTV segments.
     
+    Args:
+        months_back: Window of the snapshot to read
+    
     Returns:
         Dict with distribution statistics
     """
     logger.info("Analyzing LTV distribution")
     
-    query = """
-        WITH ltv_data AS (
-            SELECT * FROM calculate_customer_ltv(12)
-        )
-        SELECT 
-            customer_segment,
-            COUNT(*) as count,
-            ROUND(AVG(total_spent), 2) as avg_spent,
-            ROUND(SUM(total_spent), 2) as total_revenue,
-            ROUND(AVG(predicted_annual_revenue), 2) as avg_predicted_annual
-        FROM ltv_data
-        GROUP BY customer_segment
-        ORDER BY avg_spent DESC;
-    """
-    
     try:
-        result = execute_query(query)
+        df = get_ltv_snapshot(months_back)
+        result = []
+        if not df.empty:
+            distribution = df.groupby('customer_segment', observed=True).agg(
+                count=('customer_phone', 'size'),
+                avg_spent=('total_spent', 'mean'),
+                total_revenue=('total_spent', 'sum'),
+                avg_predicted_ltv=('predicted_ltv', 'mean'),
+            ).round({'avg_spent': 2, 'avg_predicted_ltv': 2})
+            distribution = distribution.sort_values('avg_spent', ascending=False).reset_index()
+            distribution['customer_segment'] = distribution['customer_segment'].astype(str)
+            result = distribution.to_dict('records')
         
         if result:
             logger.info("LTV Distribution by Segment:")
@@ -198,38 +268,33 @@ def get_ltv_distribution() -> dict:
         return {}
 
 
-def identify_upgrading_customers() -> list:
+def identify_upgrading_customers(months_back: int = COHORT_MONTHS_BACK) -> list:
     """
     Identify customers who could be upgraded to higher segments.
     
+    Args:
+        months_back: Window of the snapshot to read
+    
     Returns:
         List of potential upgrade candidates
     """
     logger.info("Identifying upgrade candidates")
     
-    query = """
-        WITH ltv_data AS (
-            SELECT * FROM calculate_customer_ltv(12)
-        )
-        SELECT 
-            customer_phone,
-            total_spent,
-            total_orders,
-            customer_segment,
-            CASE 
-                WHEN customer_segment = 'medium_value' AND total_orders >= 8 THEN 'high_value'
-                WHEN customer_segment = 'high_value' AND total_orders >= 12 THEN 'vip'
-                ELSE NULL
-            END as potential_upgrade
-        FROM ltv_data
-        WHERE (customer_segment = 'medium_value' AND total_orders >= 8)
-           OR (customer_segment = 'high_value' AND total_orders >= 12)
-        ORDER BY total_spent DESC
-        LIMIT 50;
-    """
-    
     try:
-        result = execute_query(query)
+        df = get_ltv_snapshot(months_back)
+        result = []
+        if not df.empty:
+            to_high_value = (df['customer_segment'] == 'medium_value') & (df['total_orders'] >= 8)
+            to_vip = (df['customer_segment'] == 'high_value') & (df['total_orders'] >= 12)
+            candidates = df.loc[
+                to_high_value | to_vip,
+                ['customer_phone', 'total_spent', 'total_orders', 'customer_segment']
+            ].copy()
+            candidates['potential_upgrade'] = np.where(
+                to_high_value[candidates.index], 'high_value', 'vip'
+            )
+            candidates['customer_segment'] = candidates['customer_segment'].astype(str)
+            result = candidates.nlargest(50, 'total_spent').to_dict('records')
         
         if result:
             logger.info(f"Found {len(result)} upgrade candidates:")
@@ -240,7 +305,7 @@ def identify_upgrading_customers() -> list:
                     f"(₽{customer['total_spent']}, {customer['total_orders']} orders)"
                 )
         
-        return result if result else []
+        return result
         
     except Exception as e:
         logger.error(f"Error identifying upgrade candidates: {e}")
@@ -249,17 +314,30 @@ def identify_upgrading_customers() -> list:
 
 def main():
     """Main ETL process for LTV analysis."""
+    parser = argparse.ArgumentParser(
+        description='Run the LTV analysis ETL'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write a CPU/memory/DB-wait profile report to logs/'
+    )
+    args = parser.parse_args()
+    configure_logging('ltv.log')
+    
     logger.info("=" * 80)
     logger.info("Starting LTV Analysis ETL")
     logger.info("=" * 80)
     
-    success = refresh_ltv_analytics()
+    with profiled_run('ltv', args.profile), profile_step('ltv'):
+        success = refresh_ltv_analytics()
+        if success:
+            get_ltv_summary()
+            get_top_customers(limit=20, segment='vip')
+            get_ltv_distribution()
+            identify_upgrading_customers()
     
     if success:
-        get_ltv_summary()
-        get_top_customers(limit=20, segment='vip')
-        get_ltv_distribution()
-        identify_upgrading_customers()
         logger.info("LTV ETL completed successfully")
         sys.exit(0)
     else:
@@ -1,43 +1,174 @@
 #!/usr/bin/env python3
 """ETL script for RFM (Recency, Frequency, Monetary) segmentation analysis."""
 
+import argparse
 import logging
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional
+import pandas as pd
 from db_utils import call_rpc_function, execute_query
-from config import LOGS_DIR, LOG_FORMAT, LOG_LEVEL
+from etl_state import get_data_version
+from etl_customer_stats import STEP_NAME as CUSTOMER_STATS_STEP
+from run_manifest import record_output
+from sharding import new_run_key, run_sharded
+from profiling import profile_step, profiled_run
+from config import configure_logging, ETL_SHARDS, RFM_ENGINE, RFM_SCORING
 
-# Setup logging
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.FileHandler(LOGS_DIR / 'rfm.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Result of the last calculate_rfm_segments() call; every report below is
+# derived from it so one run evaluates the function (and scans orders) once
+_snapshot: Optional[pd.DataFrame] = None
+# Data version and options it was computed from, when loaded with reuse
+_snapshot_key: Optional[tuple] = None
+
+
+def refresh_rfm_shard(shard: int, shard_count: int, run_key: str, from_stats: bool = False) -> int:
+    """
+    Write one shard of customers' RFM segments to customer_rfm_segments.
+    
+    Args:
+        shard: Shard number (0-based)
+        shard_count: Number of shards the customers are split into
+        run_key: Key of the sharded run the rows are stored under
+        from_stats: Score from analytics_customer_stats
+    
+    Returns:
+        Number of customers scored
+    """
+    result = call_rpc_function('refresh_rfm_segments', {
+        'run_key_param': run_key,
+        'from_stats': from_stats,
+        'shard': shard,
+        'shard_count': shard_count,
+    })
+    return (result[0]['refresh_rfm_segments'] if result else 0) or 0
+
+
+def _load_sharded_snapshot(from_stats: bool) -> pd.DataFrame:
+    """Score customers in shards and read the merged segments back."""
+    started_at = datetime.now(timezone.utc)
+    run_key = new_run_key('rfm')
+    run_sharded('rfm', {'from_stats': from_stats}, run_key)
+    
+    # The tie-break on customer_phone makes the merged order independent
+    # of which worker wrote which shard
+    snapshot = execute_query("""
+        SELECT customer_phone, recency_days, frequency, monetary,
+               r_score, f_score, m_score, rfm_segment, segment_description
+        FROM customer_rfm_segments
+        WHERE run_key = %s
+        ORDER BY r_score DESC, f_score DESC, m_score DESC, customer_phone;
+    """, (run_key,), result_format='dataframe', read_only=False)
+    record_output('customer_rfm_segments', len(snapshot))
+    
+    # Keep only this run's segments (older runs that finished before it started)
+    execute_query(
+        "DELETE FROM customer_rfm_segments WHERE run_key <> %s AND calculated_at < %s;",
+        (run_key, started_at), fetch=False
+    )
+    return snapshot
+
+
+def load_rfm_snapshot(
+    from_stats: bool = False,
+    engine: str = RFM_ENGINE,
+    scoring: str = RFM_SCORING,
+    reuse: bool = False
+) -> pd.DataFrame:
+    """
+    Evaluate calculate_rfm_segments() and keep the result for this run.
+    
+    With ETL_SHARDS > 1 the segments are computed in shards by
+    refresh_rfm_segments() (see sharding.run_sharded()) and read back
+    from customer_rfm_segments. The 'numpy' engine instead streams the
+    customers and scores them in this process (see rfm_engine.py).
+    
+    With ``reuse`` a long-running process (the ETL daemon) keeps the
+    previous snapshot while its data version is unchanged: the
+    customer_stats watermark when scoring from stats, the newest
+    orders.updated_at otherwise (see etl_state.get_data_version()).
+    
+    Args:
+        from_stats: Score customers from analytics_customer_stats instead
+            of aggregating every order
+        engine: 'sql' (database function) or 'numpy'
+        scoring: 'fixed' thresholds, or 'quantile' with the numpy engine
+        reuse: Return the kept snapshot if its data has not changed
+        
+    Returns:
+        DataFrame with one row per customer
+    """
+    global _snapshot, _snapshot_key
+    key = None
+    if reuse:
+        version = get_data_version(CUSTOMER_STATS_STEP if from_stats else None)
+        key = (version, from_stats, engine, scoring) if version else None
+        if key is not None and key == _snapshot_key:
+            logger.info(f"RFM data unchanged since {version[0]}; reusing the kept snapshot")
+            return _snapshot
+    
+    _snapshot_key = None
+    if engine == 'numpy':
+        import rfm_engine
+        
+        _snapshot = rfm_engine.calculate_rfm_segments(from_stats, scoring)
+    elif engine != 'sql':
+        raise ValueError(f"Unsupported RFM engine: {engine}")
+    elif scoring != 'fixed':
+        raise ValueError(f"RFM scoring '{scoring}' needs the numpy engine")
+    elif ETL_SHARDS > 1:
+        _snapshot = _load_sharded_snapshot(from_stats)
+    else:
+        _snapshot = call_rpc_function(
+            'calculate_rfm_segments', {'from_stats': from_stats}, result_format='dataframe'
+        )
+    _snapshot_key = key
+    return _snapshot
+
 
-def refresh_rfm_analytics() -> bool:
+def get_rfm_snapshot() -> pd.DataFrame:
+    """Return the current RFM snapshot, loading it on first use."""
+    if _snapshot is None:
+        return load_rfm_snapshot()
+    return _snapshot
+
+
+def refresh_rfm_analytics(
+    from_stats: bool = False,
+    engine: str = RFM_ENGINE,
+    scoring: str = RFM_SCORING,
+    reuse: bool = False
+) -> bool:
     """
     Refresh RFM analytics by calling the database function.
     
+    Args:
+        from_stats: Score customers from analytics_customer_stats (kept
+            current incrementally by etl_customer_stats) instead of
+            aggregating every order
+        engine: 'sql' (database function) or 'numpy' (rfm_engine.py)
+        scoring: 'fixed' thresholds, or 'quantile' with the numpy engine
+        reuse: Keep the previous snapshot if its data has not changed
+            (see load_rfm_snapshot())
+    
     Returns:
         True if successful, False otherwise
     """
-    logger.info("Starting RFM segmentation refresh")
+    logger.info(f"Starting RFM segmentation refresh ({engine} engine, {scoring} scoring)")
     start_time = datetime.now()
     
     try:
-        # Call the RPC function that calculates RFM segments
-        result = call_rpc_function('calculate_rfm_segments')
+        # Materialize the segments once; the reports reuse this snapshot
+        snapshot = load_rfm_snapshot(from_stats, engine, scoring, reuse)
         
-        if not result:
+        if snapshot.empty:
             logger.warning("No RFM data returned")
             return False
         
-        logger.info(f"RFM segmentation calculated for {len(result)} customers")
+        logger.info(f"RFM segmentation calculated for {len(snapshot)} customers")
+        record_output('memory:rfm_snapshot', len(snapshot))
         
         duration = (datetime.now() - start_time).total_seconds()
         logger.info(f"RFM analytics completed in {duration:.2f} seconds")
@@ -49,36 +180,36 @@ def refresh_rfm_analytics() -> bool:
         return False
 
 
-def get_rfm_summary() -> dict:
+def get_rfm_summary(snapshot: Optional[pd.DataFrame] = None) -> dict:
     """
     Get summary statistics for RFM analysis.
     
+    Args:
+        snapshot: RFM snapshot to summarize (defaults to the current one)
+    
     Returns:
         Dict with RFM summary statistics
     """
     logger.info("Generating RFM summary")
     
-    query = """
-        WITH rfm_data AS (
-            SELECT * FROM calculate_rfm_segments()
-        )
-        SELECT 
-            rfm_segment,
-            COUNT(*) as customer_count,
-            ROUND(AVG(recency_days), 1) as avg_recency,
-            ROUND(AVG(frequency), 1) as avg_frequency,
-            ROUND(AVG(monetary), 2) as avg_monetary,
-            ROUND(SUM(monetary), 2) as total_revenue,
-            ROUND(AVG(r_score), 1) as avg_r_score,
-            ROUND(AVG(f_score), 1) as avg_f_score,
-            ROUND(AVG(m_score), 1) as avg_m_score
-        FROM rfm_data
-        GROUP BY rfm_segment
-        ORDER BY total_revenue DESC;
-    """
-    
     try:
-        result = execute_query(query)
+        df = get_rfm_snapshot() if snapshot is None else snapshot
+        result = []
+        if not df.empty:
+            summary = df.groupby('rfm_segment').agg(
+                customer_count=('customer_phone', 'size'),
+                avg_recency=('recency_days', 'mean'),
+                avg_frequency=('frequency', 'mean'),
+                avg_monetary=('monetary', 'mean'),
+                total_revenue=('monetary', 'sum'),
+                avg_r_score=('r_score', 'mean'),
+                avg_f_score=('f_score', 'mean'),
+                avg_m_score=('m_score', 'mean'),
+            ).round({
+                'avg_recency': 1, 'avg_frequency': 1, 'avg_monetary': 2,
+                'avg_r_score': 1, 'avg_f_score': 1, 'avg_m_score': 1,
+            })
+            result = summary.sort_values('total_revenue', ascending=False).reset_index().to_dict('records')
         
         if result:
             logger.info(f"RFM Segment Distribution:")
@@ -107,40 +238,35 @@ def get_rfm_summary() -> dict:
         return {}
 
 
-def get_segment_customers(segment: str, limit: int = 10) -> list:
+def get_segment_customers(
+    segment: str,
+    limit: int = 10,
+    snapshot: Optional[pd.DataFrame] = None
+) -> list:
     """
     Get customers in a specific RFM segment.
     
     Args:
         segment: RFM segment name
         limit: Number of customers to return
+        snapshot: RFM snapshot to read (defaults to the current one)
         
     Returns:
         List of customers in segment
     """
     logger.info(f"Getting {limit} customers from '{segment}' segment")
     
-    query = """
-        WITH rfm_data AS (
-            SELECT * FROM calculate_rfm_segments()
-        )
-        SELECT 
-            customer_phone,
-            recency_days,
-            frequency,
-            monetary,
-            r_score,
-            f_score,
-            m_score,
-            segment_description
-        FROM rfm_data
-        WHERE rfm_segment = %s
-        ORDER BY monetary DESC
-        LIMIT %s;
-    """
+    columns = [
+        'customer_phone', 'recency_days', 'frequency', 'monetary',
+        'r_score', 'f_score', 'm_score', 'segment_description',
+    ]
     
     try:
-        result = execute_query(query, (segment, limit))
+        df = get_rfm_snapshot() if snapshot is None else snapshot
+        result = []
+        if not df.empty:
+            customers = df.loc[df['rfm_segment'] == segment, columns]
+            result = customers.nlargest(limit, 'monetary').to_dict('records')
         
         if result:
             logger.info(f"Found {len(result)} customers in '{segment}' segment:")
@@ -159,10 +285,13 @@ def get_segment_customers(segment: str, limit: int = 10) -> list:
         return []
 
 
-def identify_high_priority_segments() -> dict:
+def identify_high_priority_segments(snapshot: Optional[pd.DataFrame] = None) -> dict:
     """
     Identify segments that need immediate attention.
     
+    Args:
+        snapshot: RFM snapshot to read (defaults to the current one)
+    
     Returns:
         Dict with high-priority segments and actions
     """
@@ -196,21 +325,15 @@ def identify_high_priority_segments() -> dict:
         }
     }
     
-    query = """
-        WITH rfm_data AS (
-            SELECT * FROM calculate_rfm_segments()
-        )
-        SELECT 
-            rfm_segment,
-            COUNT(*) as count,
-            ROUND(SUM(monetary), 2) as total_value
-        FROM rfm_data
-        WHERE rfm_segment IN ('champions', 'at_risk', 'cant_lose_them', 'promising', 'need_attention')
-        GROUP BY rfm_segment;
-    """
-    
     try:
-        result = execute_query(query)
+        df = get_rfm_snapshot() if snapshot is None else snapshot
+        result = []
+        if not df.empty:
+            priority = df[df['rfm_segment'].isin(list(priority_segments))]
+            result = priority.groupby('rfm_segment').agg(
+                count=('customer_phone', 'size'),
+                total_value=('monetary', 'sum'),
+            ).reset_index().to_dict('records')
         
         if result:
             logger.info("High-Priority Segments:")
@@ -232,10 +355,13 @@ def identify_high_priority_segments() -> dict:
         return {}
 
 
-def get_segment_transitions() -> dict:
+def get_segment_transitions(snapshot: Optional[pd.DataFrame] = None) -> dict:
     """
     Analyze how customers move between segments over time.
     
+    Args:
+        snapshot: RFM snapshot to read (defaults to the current one)
+    
     Returns:
         Dict with transition statistics
     """
@@ -244,24 +370,20 @@ def get_segment_transitions() -> dict:
     # This would require historical RFM data, which we don't have yet
     # For now, we'll identify customers close to transitioning
     
-    query = """
-        WITH rfm_data AS (
-            SELECT * FROM calculate_rfm_segments()
-        )
-        SELECT 
-            rfm_segment,
-            COUNT(*) FILTER (WHERE r_score >= 4) as high_recency_count,
-            COUNT(*) FILTER (WHERE f_score >= 4) as high_frequency_count,
-            COUNT(*) FILTER (WHERE m_score >= 4) as high_monetary_count,
-            COUNT(*) FILTER (WHERE r_score <= 2) as low_recency_count,
-            COUNT(*) FILTER (WHERE f_score <= 2) as low_frequency_count,
-            COUNT(*) FILTER (WHERE m_score <= 2) as low_monetary_count
-        FROM rfm_data
-        GROUP BY rfm_segment;
-    """
-    
     try:
-        result = execute_query(query)
+        df = get_rfm_snapshot() if snapshot is None else snapshot
+        result = []
+        if not df.empty:
+            indicators = pd.DataFrame({
+                'rfm_segment': df['rfm_segment'],
+                'high_recency_count': df['r_score'] >= 4,
+                'high_frequency_count': df['f_score'] >= 4,
+                'high_monetary_count': df['m_score'] >= 4,
+                'low_recency_count': df['r_score'] <= 2,
+                'low_frequency_count': df['f_score'] <= 2,
+                'low_monetary_count': df['m_score'] <= 2,
+            })
+            result = indicators.groupby('rfm_segment').sum().reset_index().to_dict('records')
         
         if result:
             logger.info("Segment Health Indicators:")
@@ -285,10 +407,13 @@ def get_segment_transitions() -> dict:
         return {}
 
 
-def generate_marketing_recommendations() -> dict:
+def generate_marketing_recommendations(snapshot: Optional[pd.DataFrame] = None) -> dict:
     """
     Generate marketing campaign recommendations based on RFM segments.
     
+    Args:
+        snapshot: RFM snapshot to read (defaults to the current one)
+    
     Returns:
         Dict with recommendations per segment
     """
@@ -307,21 +432,15 @@ def generate_marketing_recommendations() -> dict:
         'lost': 'Dormant customer reactivation, deep discounts, \"What went wrong\" survey'
     }
     
-    query = """
-        WITH rfm_data AS (
-            SELECT * FROM calculate_rfm_segments()
-        )
-        SELECT 
-            rfm_segment,
-            COUNT(*) as customer_count
-        FROM rfm_data
-        GROUP BY rfm_segment
-        HAVING COUNT(*) > 0
-        ORDER BY customer_count DESC;
-    """
-    
     try:
-        result = execute_query(query)
+        df = get_rfm_snapshot() if snapshot is None else snapshot
+        result = []
+        if not df.empty:
+            counts = df['rfm_segment'].value_counts()
+            result = [
+                {'rfm_segment': segment, 'customer_count': int(count)}
+                for segment, count in counts.items()
+            ]
         
         if result:
             logger.info("Marketing Campaign Recommendations:")
@@ -342,18 +461,45 @@ def generate_marketing_recommendations() -> dict:
 
 def main():
     """Main ETL process for RFM analysis."""
+    parser = argparse.ArgumentParser(
+        description='Run the RFM segmentation ETL'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write a CPU/memory/DB-wait profile report to logs/'
+    )
+    parser.add_argument(
+        '--engine',
+        choices=['sql', 'numpy'],
+        default=RFM_ENGINE,
+        help='Score in the database function or in this process with NumPy (default: RFM_ENGINE)'
+    )
+    parser.add_argument(
+        '--scoring',
+        choices=['fixed', 'quantile'],
+        default=RFM_SCORING,
+        help='Fixed score thresholds or quintiles of the customers (default: RFM_SCORING)'
+    )
+    args = parser.parse_args()
+    if args.engine == 'sql' and args.scoring != 'fixed':
+        parser.error('--scoring quantile needs --engine numpy')
+    configure_logging('rfm.log')
+    
     logger.info("=" * 80)
     logger.info("Starting RFM Segmentation ETL")
     logger.info("=" * 80)
     
-    success = refresh_rfm_analytics()
+    with profiled_run('rfm', args.profile), profile_step('rfm'):
+        success = refresh_rfm_analytics(engine=args.engine, scoring=args.scoring)
+        if success:
+            get_rfm_summary()
+            identify_high_priority_segments()
+            get_segment_customers('champions', limit=10)
+            get_segment_transitions()
+            generate_marketing_recommendations()
     
     if success:
-        get_rfm_summary()
-        identify_high_priority_segments()
-        get_segment_customers('champions', limit=10)
-        get_segment_transitions()
-        generate_marketing_recommendations()
         logger.info("RFM ETL completed successfully")
         sys.exit(0)
     else:
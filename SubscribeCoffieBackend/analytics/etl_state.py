@@ -0,0 +1,109 @@
+"""Persisted per-step watermarks for incremental analytics ETL."""
+
+import logging
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Tuple
+from db_utils import execute_query
+
+logger = logging.getLogger(__name__)
+
+STATE_TABLE = 'analytics_etl_state'
+
+
+def get_step_state(step: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the stored state of an ETL step.
+    
+    Args:
+        step: ETL step name
+    
+    Returns:
+        Dict with watermark, mode, rows_processed and last_run_at, or None
+        if the step has never completed
+    """
+    query = f"""
+        SELECT step, watermark, mode, rows_processed, last_run_at
+        FROM {STATE_TABLE}
+        WHERE step = %s;
+    """
+    # Always read from the primary: a lagging replica would hand back an
+    # older watermark and make the next run redo work
+    result = execute_query(query, (step,), read_only=False)
+    return result[0] if result else None
+
+
+def get_watermark(step: str) -> Optional[datetime]:
+    """Return the last processed orders.updated_at for a step, or None."""
+    state = get_step_state(step)
+    return state['watermark'] if state else None
+
+
+def get_watermarks() -> Dict[str, datetime]:
+    """Return the watermark of every step that has stored one."""
+    result = execute_query(
+        f"SELECT step, watermark FROM {STATE_TABLE} WHERE watermark IS NOT NULL;", read_only=False
+    )
+    return {row['step']: row['watermark'] for row in result or []}
+
+
+def get_data_version(step: Optional[str] = None) -> Optional[Tuple[datetime, date]]:
+    """
+    Identify the data a snapshot computed now would be derived from.
+    
+    A long-running process keeps a snapshot while its version is unchanged.
+    The version includes the server's current date, since recency and
+    customer age are counted from today.
+    
+    Args:
+        step: Step whose stored watermark to use, for snapshots read from
+            the table that step maintains; None for the newest
+            orders.updated_at (served by orders_updated_at_idx)
+    
+    Returns:
+        (watermark, current date), or None if there is no watermark
+    """
+    if step:
+        query = f"SELECT watermark, CURRENT_DATE AS today FROM {STATE_TABLE} WHERE step = %s;"
+        params = (step,)
+    else:
+        query = "SELECT max(updated_at) AS watermark, CURRENT_DATE AS today FROM orders;"
+        params = None
+    result = execute_query(query, params, read_only=False)
+    if not result or result[0]['watermark'] is None:
+        return None
+    return result[0]['watermark'], result[0]['today']
+
+
+def save_watermark(
+    step: str,
+    watermark: Optional[datetime],
+    mode: str,
+    rows_processed: Optional[int] = None
+):
+    """
+    Record a completed run of an ETL step.
+    
+    Args:
+        step: ETL step name
+        watermark: Highest orders.updated_at covered by the run
+        mode: 'full' or 'incremental'
+        rows_processed: Number of rows (customers) the run reprocessed
+    """
+    query = f"""
+        INSERT INTO {STATE_TABLE} (step, watermark, mode, rows_processed, last_run_at)
+        VALUES (%s, %s, %s, %s, now())
+        ON CONFLICT (step) DO UPDATE SET
+            watermark = EXCLUDED.watermark,
+            mode = EXCLUDED.mode,
+            rows_processed = EXCLUDED.rows_processed,
+            last_run_at = EXCLUDED.last_run_at,
+            updated_at = now();
+    """
+    execute_query(query, (step, watermark, mode, rows_processed), fetch=False)
+    logger.info(f"Saved {step} watermark: {watermark} ({mode}, {rows_processed} rows)")
+
+
+def reset_watermark(step: str):
+    """Forget a step's watermark so its next run is a full refresh."""
+    logger.warning(f"Resetting {step} watermark")
+    execute_query(f"DELETE FROM {STATE_TABLE} WHERE step = %s;", (step,), fetch=False)
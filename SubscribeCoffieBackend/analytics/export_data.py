@@ -1,24 +1,27 @@
 #!/usr/bin/env python3
 """Export analytics data to various formats for external BI tools."""
 
+import asyncio
 import logging
 import sys
 import argparse
+import tempfile
 from datetime import datetime
 from pathlib import Path
-import pandas as pd
-from db_utils import execute_query, call_rpc_function
-from config import LOGS_DIR, EXPORTS_DIR, LOG_FORMAT, LOG_LEVEL
-
-# Setup logging
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.FileHandler(LOGS_DIR / 'export.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
+import db_async
+from db_utils import execute_query, execute_query_iter, call_rpc_function, call_rpc_iter, etl_step, plan_mode
+from query_plan import StepPlan, log_plan_report
+from profiling import profile_section, profile_step, profiled_run
+from config import (
+    configure_logging, EXPORTS_DIR, COHORT_MONTHS_BACK, FUNNEL_WINDOW_DAYS, PLAN_OVER_BUDGET, RFM_ENGINE
 )
+
+if TYPE_CHECKING:
+    # pandas and pyarrow are imported where they are used, to keep startup fast
+    import pandas as pd
+    import pyarrow as pa
+
 logger = logging.getLogger(__name__)
 
 
@@ -27,13 +30,12 @@ def export_cohort_data(output_format: str = 'csv', output_dir: Path = EXPORTS_DI
     logger.info(f"Exporting cohort data to {output_format}")
     
     query = "SELECT * FROM cohort_analytics ORDER BY cohort_month DESC, period_number;"
-    data = execute_query(query)
+    df = execute_query(query, result_format='dataframe')
     
-    if not data:
+    if df.empty:
         logger.warning("No cohort data to export")
         return None
     
-    df = pd.DataFrame(data)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"cohort_analytics_{timestamp}"
     
@@ -51,17 +53,15 @@ def export_churn_data(output_format: str = 'csv', output_dir: Path = EXPORTS_DIR
         WHERE calculated_at::date = CURRENT_DATE
         ORDER BY risk_score DESC;
     """
-    data = execute_query(query)
+    batches = execute_query_iter(query, result_format='arrow')
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"churn_risk_{timestamp}"
     
-    if not data:
+    output_file = export_batches(batches, filename, output_format, output_dir)
+    if output_file is None:
         logger.warning("No churn data to export")
         return None
     
-    df = pd.DataFrame(data)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"churn_risk_{timestamp}"
-    
-    output_file = export_dataframe(df, filename, output_format, output_dir)
     logger.info(f"Churn data exported: {output_file}")
     return output_file
 
@@ -70,17 +70,17 @@ def export_ltv_data(output_format: str = 'csv', output_dir: Path = EXPORTS_DIR):
     """Export LTV analysis data."""
     logger.info(f"Exporting LTV data to {output_format}")
     
-    data = call_rpc_function('calculate_customer_ltv', {'months_back': 12})
+    batches = call_rpc_iter(
+        'calculate_customer_ltv', {'months_back': COHORT_MONTHS_BACK}, result_format='arrow'
+    )
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"customer_ltv_{timestamp}"
     
-    if not data:
+    output_file = export_batches(batches, filename, output_format, output_dir)
+    if output_file is None:
         logger.warning("No LTV data to export")
         return None
     
-    df = pd.DataFrame(data)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"customer_ltv_{timestamp}"
-    
-    output_file = export_dataframe(df, filename, output_format, output_dir)
     logger.info(f"LTV data exported: {output_file}")
     return output_file
 
@@ -89,13 +89,17 @@ def export_rfm_data(output_format: str = 'csv', output_dir: Path = EXPORTS_DIR):
     """Export RFM segmentation data."""
     logger.info(f"Exporting RFM data to {output_format}")
     
-    data = call_rpc_function('calculate_rfm_segments')
+    if RFM_ENGINE == 'numpy':
+        import rfm_engine
+        
+        df = rfm_engine.calculate_rfm_segments()
+    else:
+        df = call_rpc_function('calculate_rfm_segments', result_format='dataframe')
     
-    if not data:
+    if df.empty:
         logger.warning("No RFM data to export")
         return None
     
-    df = pd.DataFrame(data)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"rfm_segments_{timestamp}"
     
@@ -108,13 +112,23 @@ def export_funnel_data(output_format: str = 'csv', output_dir: Path = EXPORTS_DI
     """Export conversion funnel data."""
     logger.info(f"Exporting funnel data to {output_format}")
     
-    data = call_rpc_function('calculate_conversion_funnel')
+    # Export the funnel stored by the latest etl_funnel run
+    query = """
+        SELECT * FROM funnel_results
+        WHERE cafe_id IS NULL
+          AND window_days = %(window_days)s
+          AND run_date = (
+              SELECT MAX(run_date) FROM funnel_results
+              WHERE cafe_id IS NULL AND window_days = %(window_days)s
+          )
+        ORDER BY step_number;
+    """
+    df = execute_query(query, {'window_days': FUNNEL_WINDOW_DAYS}, result_format='dataframe')
     
-    if not data:
-        logger.warning("No funnel data to export")
+    if df.empty:
+        logger.warning("No funnel data to export (run etl_funnel.py first)")
         return None
     
-    df = pd.DataFrame(data)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"conversion_funnel_{timestamp}"
     
@@ -139,6 +153,8 @@ def export_revenue_data(output_format: str = 'csv', output_dir: Path = EXPORTS_D
     
     # Flatten JSON structure for CSV export
     if isinstance(data, list) and len(data) > 0:
+        import pandas as pd
+        
         revenue_data = data[0]
         
         # Extract overview data
@@ -172,7 +188,7 @@ def export_revenue_data(output_format: str = 'csv', output_dir: Path = EXPORTS_D
 
 
 def export_dataframe(
-    df: pd.DataFrame, 
+    df: 'pd.DataFrame', 
     filename: str, 
     output_format: str, 
     output_dir: Path
@@ -185,53 +201,187 @@ def export_dataframe(
         filename: Base filename (without extension)
         output_format: Format (csv, json, parquet)
         output_dir: Output directory
-        
+    
     Returns:
         Path to exported file
     """
     output_dir.mkdir(exist_ok=True)
     
-    if output_format == 'csv':
-        output_file = output_dir / f"{filename}.csv"
-        df.to_csv(output_file, index=False)
-    elif output_format == 'json':
-        output_file = output_dir / f"{filename}.json"
-        df.to_json(output_file, orient='records', indent=2)
-    elif output_format == 'parquet':
-        output_file = output_dir / f"{filename}.parquet"
-        df.to_parquet(output_file, index=False)
-    else:
+    if output_format not in ('csv', 'json', 'parquet'):
         raise ValueError(f"Unsupported format: {output_format}")
     
+    output_file = output_dir / f"{filename}.{output_format}"
+    with profile_section('serialization'):
+        if output_format == 'csv':
+            df.to_csv(output_file, index=False)
+        elif output_format == 'json':
+            df.to_json(output_file, orient='records', indent=2)
+        else:
+            df.to_parquet(output_file, index=False)
+    
     return output_file
 
 
-def export_all(output_format: str = 'csv', output_dir: Path = EXPORTS_DIR):
-    """Export all analytics data."""
+def export_batches(
+    batches: Iterable['pa.Table'],
+    filename: str,
+    output_format: str,
+    output_dir: Path
+) -> Optional[Path]:
+    """
+    Export a stream of row batches without materializing the full result.
+    
+    Each batch is appended to the output file as it arrives, so memory use
+    is bounded by the batch size rather than the row count. Batches are
+    Arrow tables typed from the cursor description (result_format='arrow'),
+    so the parquet schema never depends on the values in the first batch:
+    a column that starts out all NULL keeps its declared type.
+    
+    Args:
+        batches: Iterable of Arrow tables
+        filename: Base filename (without extension)
+        output_format: Format (csv, json, parquet)
+        output_dir: Output directory
+    
+    Returns:
+        Path to exported file, or None if there were no rows
+    """
+    if output_format not in ('csv', 'json', 'parquet'):
+        raise ValueError(f"Unsupported format: {output_format}")
+    
+    output_dir.mkdir(exist_ok=True)
+    output_file = output_dir / f"{filename}.{output_format}"
+    rows_written = 0
+    parquet_writer = None
+    f = None if output_format == 'parquet' else open(output_file, 'w', newline='')
+    
+    try:
+        for table in batches:
+            with profile_section('serialization'):
+                if output_format == 'csv':
+                    table.to_pandas().to_csv(f, index=False, header=rows_written == 0)
+                elif output_format == 'json':
+                    # Splice each batch's records into a single JSON array
+                    records = table.to_pandas().to_json(orient='records', indent=2)
+                    f.write('[\n' if rows_written == 0 else ',\n')
+                    f.write(records.strip()[1:-1].strip('\n'))
+                else:
+                    import pyarrow.parquet as pq
+                    
+                    if parquet_writer is None:
+                        parquet_writer = pq.ParquetWriter(output_file, table.schema)
+                    parquet_writer.write_table(table)
+            
+            rows_written += table.num_rows
+        
+        if output_format == 'json' and rows_written:
+            f.write('\n]')
+    finally:
+        if f is not None:
+            f.close()
+        if parquet_writer is not None:
+            parquet_writer.close()
+    
+    if rows_written == 0:
+        output_file.unlink(missing_ok=True)
+        return None
+    
+    logger.info(f"Streamed {rows_written} rows to {output_file}")
+    return output_file
+
+
+EXPORTS = {
+    'cohort': export_cohort_data,
+    'churn': export_churn_data,
+    'ltv': export_ltv_data,
+    'rfm': export_rfm_data,
+    'funnel': export_funnel_data,
+    'revenue': export_revenue_data,
+}
+
+
+def run_export(name: str, output_format: str = 'csv', output_dir: Path = EXPORTS_DIR):
+    """Run one export under its ``export_<name>`` time budget."""
+    with etl_step(f'export_{name}'), profile_step(f'export_{name}'):
+        return EXPORTS[name](output_format, output_dir)
+
+
+def plan_exports(names: Iterable[str], output_format: str = 'csv') -> Dict[str, StepPlan]:
+    """
+    Estimate the cost of exports with EXPLAIN instead of running them.
+    
+    Args:
+        names: Exports to estimate
+        output_format: Output format the exports would use
+    
+    Returns:
+        "export_<name>" -> StepPlan, so PLAN_COST_BUDGETS can address exports
+    """
+    plans: Dict[str, StepPlan] = {}
+    # Nothing is written in plan mode, but keep stray files out of EXPORTS_DIR
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in names:
+            plan = plans[f'export_{name}'] = StepPlan(f'export_{name}')
+            try:
+                with plan_mode() as estimates:
+                    plan.estimates = estimates
+                    EXPORTS[name](output_format, Path(tmpdir))
+            except Exception as e:
+                plan.error = str(e)
+                logger.error(f"Planning {name} export failed: {e}")
+    return plans
+
+
+def export_all(
+    output_format: str = 'csv',
+    output_dir: Path = EXPORTS_DIR,
+    names: Optional[Iterable[str]] = None
+):
+    """Export all analytics data (or only ``names``)."""
     logger.info("=" * 80)
     logger.info(f"Exporting all analytics data to {output_format}")
     logger.info("=" * 80)
     
-    exports = {
-        'cohort': export_cohort_data,
-        'churn': export_churn_data,
-        'ltv': export_ltv_data,
-        'rfm': export_rfm_data,
-        'funnel': export_funnel_data,
-        'revenue': export_revenue_data,
-    }
-    
     results = {}
-    for name, export_func in exports.items():
+    for name in names or EXPORTS:
         try:
             logger.info(f"\nExporting {name} data...")
-            output_file = export_func(output_format, output_dir)
+            output_file = run_export(name, output_format, output_dir)
             results[name] = output_file is not None
         except Exception as e:
             logger.error(f"Failed to export {name} data: {e}", exc_info=True)
             results[name] = False
     
-    # Summary
+    return log_export_summary(results)
+
+
+async def export_all_async(
+    output_format: str = 'csv',
+    output_dir: Path = EXPORTS_DIR,
+    names: Optional[Iterable[str]] = None
+):
+    """Export all analytics data (or only ``names``) with the queries in flight concurrently."""
+    logger.info("=" * 80)
+    logger.info(f"Exporting all analytics data to {output_format} (concurrent)")
+    logger.info("=" * 80)
+    
+    async def run_one(name):
+        try:
+            output_file = await db_async.run_sync(run_export, name, output_format, output_dir)
+            return name, output_file is not None
+        except Exception as e:
+            logger.error(f"Failed to export {name} data: {e}", exc_info=True)
+            return name, False
+    
+    results = dict(await asyncio.gather(
+        *(run_one(name) for name in names or EXPORTS)
+    ))
+    
+    return log_export_summary(results)
+
+
+def log_export_summary(results: dict) -> bool:
+    """Log the per-export status and return True if every export succeeded."""
     logger.info("\n" + "=" * 80)
     logger.info("Export Summary")
     logger.info("=" * 80)
@@ -294,30 +444,65 @@ def main():
         action='store_true',
         help='Export all data (default)'
     )
+    parser.add_argument(
+        '--concurrent',
+        action='store_true',
+        help='Run the exports concurrently instead of one after another'
+    )
+    parser.add_argument(
+        '--plan',
+        action='store_true',
+        help='Estimate the cost of the selected exports with EXPLAIN instead of running them'
+    )
+    parser.add_argument(
+        '--over-budget',
+        choices=['refuse', 'defer'],
+        default=PLAN_OVER_BUDGET,
+        help='Estimate costs first and refuse the run, or skip exports, over PLAN_COST_BUDGET'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write a CPU/memory/DB-wait profile report of each export to logs/'
+    )
     
     args = parser.parse_args()
+    configure_logging('export.log')
     
     # Default to --all if no specific flag is provided
     if not (args.cohort or args.churn or args.ltv or args.rfm or args.revenue or args.funnel):
         args.all = True
     
+    names = [name for name in EXPORTS if args.all or getattr(args, name)]
+    
+    if args.plan or args.over_budget:
+        plans = plan_exports(names, args.format)
+        log_plan_report(plans, verbose=args.plan)
+        over = [name for name in names if plans[f'export_{name}'].over_budget]
+        if args.plan:
+            sys.exit(1 if over else 0)
+        if over and args.over_budget == 'refuse':
+            logger.error(f"Refusing to export: {', '.join(over)} over cost budget")
+            sys.exit(1)
+        if over:
+            logger.warning(f"Skipping exports over cost budget: {', '.join(over)}")
+            names = [name for name in names if name not in over]
+    
+    if args.profile and args.concurrent:
+        # Memory peaks are process-wide, so profiled exports run one at a time
+        logger.warning("--profile runs the exports sequentially; ignoring --concurrent")
+        args.concurrent = False
+    
     success = True
     
-    if args.all:
-        success = export_all(args.format, args.output)
-    else:
-        if args.cohort:
-            export_cohort_data(args.format, args.output)
-        if args.churn:
-            export_churn_data(args.format, args.output)
-        if args.ltv:
-            export_ltv_data(args.format, args.output)
-        if args.rfm:
-            export_rfm_data(args.format, args.output)
-        if args.funnel:
-            export_funnel_data(args.format, args.output)
-        if args.revenue:
-            export_revenue_data(args.format, args.output)
+    with profiled_run('export', args.profile):
+        if args.all and args.concurrent:
+            success = asyncio.run(export_all_async(args.format, args.output, names))
+        elif args.all:
+            success = export_all(args.format, args.output, names)
+        else:
+            for name in names:
+                run_export(name, args.format, args.output)
     
     sys.exit(0 if success else 1)
 
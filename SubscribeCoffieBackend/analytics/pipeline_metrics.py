@@ -0,0 +1,250 @@
+"""Prometheus metrics of ETL pipeline runs, for node_exporter's textfile collector."""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from db_utils import execute_query
+from config import METRICS_TEXTFILE, METRICS_DURATION_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'analytics_etl'
+
+# Metric (without PREFIX) -> (type, help), in the order they are written
+METRICS = {
+    'runs_total': ('counter', 'Pipeline runs by outcome'),
+    'last_run_success': ('gauge', '1 if the latest pipeline run succeeded, else 0'),
+    'last_run_timestamp_seconds': ('gauge', 'Unix time the latest pipeline run finished'),
+    'last_success_timestamp_seconds': ('gauge', 'Unix time a pipeline run last succeeded'),
+    'run_duration_seconds': ('gauge', 'Wall time of the latest pipeline run'),
+    'step_duration_seconds': ('histogram', 'Wall time of ETL step runs'),
+    'step_last_duration_seconds': ('gauge', 'Wall time of the latest run of an ETL step'),
+    'step_runs_total': ('counter', 'ETL step runs by outcome (success, failed, skipped, deferred)'),
+    'step_failures_total': ('counter', 'Failed ETL step runs'),
+    'step_last_success_timestamp_seconds': ('gauge', 'Unix time an ETL step last succeeded'),
+    'step_rows_read_total': ('counter', 'Rows returned to ETL steps by their queries'),
+    'step_rows_processed_total': ('counter', 'Rows ETL steps produced, including in-memory snapshots'),
+    'step_rows_written_total': ('counter', 'Rows ETL steps wrote to analytics tables'),
+    'newest_order_timestamp_seconds': (
+        'gauge', 'Newest orders.created_at when the latest successful run started'
+    ),
+    'watermark_timestamp_seconds': ('gauge', 'Newest orders.updated_at processed by an incremental step'),
+}
+
+_lock = threading.Lock()
+
+
+def metrics_enabled() -> bool:
+    return bool(METRICS_TEXTFILE)
+
+
+def _series_key(labels: Dict[str, str]) -> str:
+    return json.dumps(sorted(labels.items()))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class MetricsStore:
+    """
+    Metric values carried from run to run.
+    
+    Cron starts a new process for every run, so counters and histograms
+    are kept in a JSON state file next to the textfile and added to on
+    each run; gauges keep their last value until a run overwrites them.
+    """
+    
+    def __init__(self, path: Path, buckets: List[float] = METRICS_DURATION_BUCKETS):
+        self.path = path
+        self.buckets = sorted(buckets)
+        # Metric -> series key (labels) -> value, or histogram dict
+        self.values: Dict[str, Dict[str, Any]] = {}
+    
+    @classmethod
+    def load(cls, path: Path) -> 'MetricsStore':
+        """Load the state file; a missing or unreadable file starts from zero."""
+        store = cls(path)
+        try:
+            with open(path) as f:
+                store.values = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read metrics state {path}, counters restart from zero: {e}")
+        return store
+    
+    def inc(self, name: str, labels: Dict[str, str], amount: float = 1):
+        series = self.values.setdefault(name, {})
+        key = _series_key(labels)
+        series[key] = series.get(key, 0) + amount
+    
+    def set(self, name: str, labels: Dict[str, str], value: float):
+        self.values.setdefault(name, {})[_series_key(labels)] = value
+    
+    def observe(self, name: str, labels: Dict[str, str], value: float):
+        """Add an observation to a histogram (reset if the buckets changed)."""
+        series = self.values.setdefault(name, {})
+        key = _series_key(labels)
+        histogram = series.get(key)
+        if histogram is None or histogram['le'] != self.buckets:
+            histogram = series[key] = {
+                'le': self.buckets, 'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0
+            }
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram['counts'][index] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+    
+    def render(self) -> str:
+        """Render every series in the Prometheus text exposition format."""
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            series = self.values.get(name)
+            if not series:
+                continue
+            metric = f"{PREFIX}_{name}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for key, value in sorted(series.items()):
+                labels = dict(json.loads(key))
+                if kind != 'histogram':
+                    lines.append(f"{metric}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                for bound, count in zip(value['le'], value['counts']):
+                    bucket_labels = {**labels, 'le': _format_value(bound)}
+                    lines.append(f"{metric}_bucket{_format_labels(bucket_labels)} {count}")
+                lines.append(f"{metric}_bucket{_format_labels({**labels, 'le': '+Inf'})} {value['count']}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+    
+    def save(self, textfile: Path):
+        """Write the state file and the textfile, each replaced atomically."""
+        _write_atomic(self.path, json.dumps(self.values))
+        _write_atomic(textfile, self.render())
+
+
+def _write_atomic(path: Path, content: str):
+    # The collector reads *.prom files at any time; a temporary name it
+    # ignores plus rename means it never sees a half-written file
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def newest_order_time() -> Optional[datetime]:
+    """Return the newest orders.created_at; None if unknown or metrics are off."""
+    if not metrics_enabled():
+        return None
+    try:
+        result = execute_query("SELECT max(created_at) AS newest FROM orders;")
+    except Exception as e:
+        logger.warning(f"Could not read the newest order time for metrics: {e}")
+        return None
+    return result[0]['newest'] if result else None
+
+
+def _step_status(result: Any) -> Optional[str]:
+    if result.resumed:
+        return None  # finished by an earlier attempt, already counted then
+    if result.deferred:
+        return 'deferred'
+    if result.skipped:
+        return 'skipped'
+    return 'success' if result.success else 'failed'
+
+
+def record_pipeline_run(
+    results: Dict[str, Any],
+    duration: float,
+    success: bool,
+    rows_read: Optional[Dict[str, int]] = None,
+    newest_order: Optional[datetime] = None
+) -> Optional[Path]:
+    """
+    Add a finished pipeline run to the metrics and rewrite METRICS_TEXTFILE.
+    
+    Does nothing when METRICS_TEXTFILE is not set. Failures are logged,
+    never raised: metrics must not fail a run that otherwise succeeded.
+    
+    Args:
+        results: Step name -> StepResult of the run
+        duration: Wall time of the run in seconds
+        success: Whether every required step completed
+        rows_read: Step name -> rows returned by the step's queries
+        newest_order: Newest orders.created_at when the run started
+    
+    Returns:
+        Path of the textfile, or None if metrics are off or writing failed
+    """
+    if not metrics_enabled():
+        return None
+    
+    textfile = Path(METRICS_TEXTFILE)
+    now = time.time()
+    try:
+        with _lock:
+            store = MetricsStore.load(textfile.with_suffix('.json'))
+            outcome = 'success' if success else 'failed'
+            store.inc('runs_total', {'status': outcome})
+            store.set('last_run_success', {}, 1 if success else 0)
+            store.set('last_run_timestamp_seconds', {}, now)
+            store.set('run_duration_seconds', {}, duration)
+            if success:
+                store.set('last_success_timestamp_seconds', {}, now)
+                if newest_order is not None:
+                    store.set('newest_order_timestamp_seconds', {}, newest_order.timestamp())
+            
+            for name, result in results.items():
+                status = _step_status(result)
+                if status is None:
+                    continue
+                step = {'step': name}
+                store.inc('step_runs_total', {'step': name, 'status': status})
+                if status == 'failed':
+                    store.inc('step_failures_total', step)
+                if status in ('success', 'failed'):
+                    store.observe('step_duration_seconds', step, result.duration)
+                    store.set('step_last_duration_seconds', step, result.duration)
+                    store.inc('step_rows_read_total', step, (rows_read or {}).get(name, 0))
+                if status == 'success':
+                    store.set('step_last_success_timestamp_seconds', step, now)
+                # In-memory snapshots ('memory:...') count as processed, not written
+                rows = [output for output in result.outputs if output['rows'] is not None]
+                store.inc('step_rows_processed_total', step, sum(output['rows'] for output in rows))
+                store.inc('step_rows_written_total', step, sum(
+                    output['rows'] for output in rows if not output['artifact'].startswith('memory:')
+                ))
+            
+            try:
+                from etl_state import get_watermarks
+                
+                for name, watermark in get_watermarks().items():
+                    store.set('watermark_timestamp_seconds', {'step': name}, watermark.timestamp())
+            except Exception as e:
+                logger.warning(f"Could not read ETL watermarks for metrics: {e}")
+            
+            textfile.parent.mkdir(parents=True, exist_ok=True)
+            store.save(textfile)
+    except Exception as e:
+        logger.error(f"Could not write pipeline metrics to {textfile}: {e}")
+        return None
+    return textfile
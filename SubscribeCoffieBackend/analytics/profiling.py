@@ -0,0 +1,261 @@
+"""Opt-in profiling of ETL steps and exports (--profile): DB wait, CPU and memory."""
+
+import contextvars
+import io
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from query_metrics import QueryCollector, QueryRecord, add_collector, remove_collector, query_step
+from config import LOGS_DIR
+
+logger = logging.getLogger(__name__)
+
+# Time categories measured inside a step; whatever is left is Python time
+SECTIONS = ('db', 'dataframe', 'serialization')
+
+# Lines of the cProfile listing and tracemalloc growth kept per step
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 10
+
+
+@dataclass
+class StepProfile:
+    """Where one step or export spent its time and memory."""
+    name: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    sections: Dict[str, float] = field(default_factory=lambda: dict.fromkeys(SECTIONS, 0.0))
+    queries: int = 0
+    memory_peak: int = 0
+    memory_growth: int = 0
+    top_allocations: List[str] = field(default_factory=list)
+    top_functions: str = ''
+    
+    def __post_init__(self):
+        self._lock = threading.Lock()
+    
+    def add(self, section: str, seconds: float):
+        with self._lock:
+            self.sections[section] += seconds
+    
+    @property
+    def python_time(self) -> float:
+        """Wall time outside the measured sections (Python code, pandas reports, ...)."""
+        return max(self.wall_time - sum(self.sections.values()), 0.0)
+
+
+_profiler: Optional['Profiler'] = None
+_step_profile: contextvars.ContextVar[Optional[StepProfile]] = contextvars.ContextVar(
+    'step_profile', default=None
+)
+# Open sections of the current thread, to keep nested sections exclusive
+_sections = threading.local()
+
+
+@contextmanager
+def profile_section(section: str):
+    """
+    Attribute the wall time of the block to a section of the current step.
+    
+    Sections nest exclusively: DataFrame conversion inside a database
+    round-trip counts as 'dataframe', not 'db'. Outside a profiled step
+    this does nothing.
+    """
+    profile = _step_profile.get()
+    if profile is None:
+        yield
+        return
+    
+    stack = getattr(_sections, 'stack', None)
+    if stack is None:
+        stack = _sections.stack = []
+    nested = [0.0]
+    stack.append(nested)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        profile.add(section, elapsed - nested[0])
+        if stack:
+            stack[-1][0] += elapsed
+
+
+def _format_bytes(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class Profiler(QueryCollector):
+    """
+    Collect a StepProfile for every step run under ``step()``.
+    
+    CPU time and the cProfile listing cover the thread that runs the step;
+    tracemalloc peaks are process-wide, so steps are best profiled one at a
+    time (etl_aggregate.py --profile runs them sequentially).
+    """
+    
+    def __init__(self, label: str):
+        self.label = label
+        self.started_at = datetime.now()
+        self.steps: Dict[str, StepProfile] = {}
+        self._lock = threading.Lock()
+    
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        add_collector(self)
+    
+    def stop(self):
+        remove_collector(self)
+        tracemalloc.stop()
+    
+    def collect(self, record: QueryRecord):
+        with self._lock:
+            profile = self.steps.get(record.step)
+        if profile is not None:
+            with profile._lock:
+                profile.queries += 1
+    
+    @contextmanager
+    def step(self, name: str):
+        """Profile the block as step ``name``; yields its StepProfile."""
+        profile = StepProfile(name)
+        with self._lock:
+            self.steps[name] = profile
+        
+        import cProfile
+        
+        profiler = cProfile.Profile()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        token = _step_profile.set(profile)
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active on this interpreter (Python 3.12+)
+            profiler = None
+        try:
+            with query_step(name):
+                yield profile
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            profile.wall_time = time.perf_counter() - start
+            profile.cpu_time = time.thread_time() - cpu_start
+            _step_profile.reset(token)
+            
+            memory_after, profile.memory_peak = tracemalloc.get_traced_memory()
+            profile.memory_growth = memory_after - memory_before
+            stats = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+            profile.top_allocations = [
+                f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}: "
+                f"{_format_bytes(stat.size_diff)} ({stat.count_diff:+d} blocks)"
+                for stat in stats[:TOP_ALLOCATIONS] if stat.size_diff > 0
+            ]
+            if profiler is not None:
+                import pstats
+                
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+                profile.top_functions = out.getvalue()
+    
+    def format_report(self) -> str:
+        lines = [
+            f"Profile: {self.label}",
+            f"Started: {self.started_at:%Y-%m-%d %H:%M:%S}, Python {sys.version.split()[0]}",
+            "",
+            "Times in seconds. 'db' is time waiting on database round-trips, 'dataframe'",
+            "converting results to columns/DataFrames, 'serialization' writing files",
+            "and COPY payloads, 'python' the rest of the wall time; 'cpu' is CPU time",
+            "of the step's thread. Memory is the tracemalloc peak during the step.",
+            "",
+            f"{'step':<20} {'wall':>8} {'db':>8} {'dataframe':>10} {'serialize':>10} "
+            f"{'python':>8} {'cpu':>8} {'queries':>8} {'peak mem':>10}",
+        ]
+        for profile in self.steps.values():
+            sections = profile.sections
+            lines.append(
+                f"{profile.name:<20} {profile.wall_time:>8.2f} {sections['db']:>8.2f} "
+                f"{sections['dataframe']:>10.2f} {sections['serialization']:>10.2f} "
+                f"{profile.python_time:>8.2f} {profile.cpu_time:>8.2f} {profile.queries:>8} "
+                f"{_format_bytes(profile.memory_peak):>10}"
+            )
+        
+        for profile in self.steps.values():
+            lines += [
+                "",
+                "=" * 80,
+                f"{profile.name}: memory growth {_format_bytes(profile.memory_growth)}, "
+                f"peak {_format_bytes(profile.memory_peak)}",
+                "=" * 80,
+                "Top allocations still held at the end of the step:",
+            ]
+            lines += [f"  {line}" for line in profile.top_allocations] or ["  (none)"]
+            lines += ["", "Top functions by cumulative time (cProfile):"]
+            lines.append(profile.top_functions.rstrip() or "  (not available)")
+        return "\n".join(lines) + "\n"
+    
+    def write_report(self, path: Optional[Path] = None) -> Path:
+        """Write the report to ``path`` (default: logs/profile-<label>-<time>.txt)."""
+        if path is None:
+            path = LOGS_DIR / f"profile-{self.label}-{self.started_at:%Y%m%dT%H%M%S}.txt"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(self.format_report())
+        return path
+
+
+def start_profiling(label: str) -> Profiler:
+    """Start profiling the steps of this process; see profile_step()."""
+    global _profiler
+    _profiler = Profiler(label)
+    _profiler.start()
+    return _profiler
+
+
+def stop_profiling() -> Optional[Path]:
+    """Stop profiling and write the report; returns its path."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    profiler.stop()
+    return profiler.write_report()
+
+
+@contextmanager
+def profile_step(name: str):
+    """Profile the block as one step while profiling is on; no-op otherwise."""
+    if _profiler is None:
+        yield None
+        return
+    with _profiler.step(name) as profile:
+        yield profile
+
+
+@contextmanager
+def profiled_run(label: str, enabled: bool = True):
+    """Profile the block when ``enabled`` and write the report to logs/ afterwards."""
+    if not enabled:
+        yield None
+        return
+    profiler = start_profiling(label)
+    try:
+        yield profiler
+    finally:
+        path = stop_profiling()
+        logger.info(f"Profile report written to {path}")
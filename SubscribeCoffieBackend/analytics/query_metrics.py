@@ -0,0 +1,267 @@
+"""Per-query instrumentation for analytics ETL database calls."""
+
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from config import LOGS_DIR, SLOW_QUERY_THRESHOLD, QUERY_LOG_FILE
+
+logger = logging.getLogger(__name__)
+
+_current_step = contextvars.ContextVar('query_step', default=None)
+
+
+@dataclass
+class QueryRecord:
+    """Timing and size statistics for one database call."""
+    sql: str
+    step: Optional[str]
+    started_at: float
+    wall_time: float
+    time_to_first_row: Optional[float]
+    rows: int
+    payload_bytes: int
+    retries: int
+    error: Optional[str] = None
+
+
+class QueryCollector:
+    """Base class for query record sinks."""
+    
+    def collect(self, record: QueryRecord):
+        raise NotImplementedError
+
+
+class JsonLinesSink(QueryCollector):
+    """
+    Append every query record as one JSON object per line.
+    
+    The parent directory is created on the first record, not in the
+    constructor, so building a sink has no filesystem side effects.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._dir_ready = False
+    
+    def collect(self, record: QueryRecord):
+        line = json.dumps(asdict(record), default=str)
+        with self._lock:
+            if not self._dir_ready:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._dir_ready = True
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+class StepAggregator(QueryCollector):
+    """Aggregate query records in memory per ETL step."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.steps: Dict[str, Dict[str, Any]] = {}
+    
+    def collect(self, record: QueryRecord):
+        step = record.step or 'unassigned'
+        with self._lock:
+            stats = self.steps.setdefault(step, {
+                'queries': 0,
+                'wall_time': 0.0,
+                'rows': 0,
+                'payload_bytes': 0,
+                'retries': 0,
+                'errors': 0,
+                'slowest_time': 0.0,
+                'slowest_sql': None,
+            })
+            stats['queries'] += 1
+            stats['wall_time'] += record.wall_time
+            stats['rows'] += record.rows
+            stats['payload_bytes'] += record.payload_bytes
+            stats['retries'] += record.retries
+            stats['errors'] += 1 if record.error else 0
+            if record.wall_time > stats['slowest_time']:
+                stats['slowest_time'] = record.wall_time
+                stats['slowest_sql'] = record.sql
+    
+    def report(self):
+        """Log a per-step breakdown, slowest steps first."""
+        with self._lock:
+            steps = sorted(self.steps.items(), key=lambda item: item[1]['wall_time'], reverse=True)
+        
+        logger.info("Query breakdown by step:")
+        for step, stats in steps:
+            logger.info(
+                f"  - {step}: {stats['queries']} queries, {stats['wall_time']:.2f}s, "
+                f"{stats['rows']} rows, ~{stats['payload_bytes'] / 1024:.0f} KiB, "
+                f"{stats['retries']} retries, {stats['errors']} errors"
+            )
+            if stats['slowest_sql']:
+                logger.info(
+                    f"    Slowest ({stats['slowest_time']:.2f}s): {_shorten(stats['slowest_sql'])}"
+                )
+        return dict(steps)
+
+
+_collectors: List[QueryCollector] = []
+_collectors_lock = threading.Lock()
+
+
+def add_collector(collector: QueryCollector) -> QueryCollector:
+    """Register a collector to receive every query record."""
+    with _collectors_lock:
+        _collectors.append(collector)
+    return collector
+
+
+def remove_collector(collector: QueryCollector):
+    """Unregister a previously added collector."""
+    with _collectors_lock:
+        if collector in _collectors:
+            _collectors.remove(collector)
+
+
+_query_log_registered = False
+
+
+def _register_query_log():
+    """Add the QUERY_LOG_FILE sink the first time a query is recorded."""
+    global _query_log_registered
+    with _collectors_lock:
+        if _query_log_registered:
+            return
+        _query_log_registered = True
+        if QUERY_LOG_FILE:
+            _collectors.append(JsonLinesSink(LOGS_DIR / QUERY_LOG_FILE))
+
+
+@contextmanager
+def query_step(name: str):
+    """Attribute every query issued inside the block to an ETL step."""
+    token = _current_step.set(name)
+    try:
+        yield
+    finally:
+        _current_step.reset(token)
+
+
+def current_step() -> Optional[str]:
+    """Return the ETL step queries are currently attributed to."""
+    return _current_step.get()
+
+
+def _shorten(sql: str, limit: int = 500) -> str:
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return sql if len(sql) <= limit else sql[:limit] + '...'
+
+
+def result_size(result: Any) -> Tuple[int, int]:
+    """
+    Return (rows, approximate payload bytes) for a query result.
+    
+    Columnar results report their buffer sizes; lists of rows are estimated
+    from a sample of up to 100 rows so large results stay cheap to measure.
+    """
+    if result is None:
+        return 0, 0
+    if hasattr(result, 'num_rows') and hasattr(result, 'nbytes'):  # Arrow table
+        return result.num_rows, result.nbytes
+    if hasattr(result, 'memory_usage'):  # DataFrame
+        return len(result), int(result.memory_usage(index=False).sum())
+    if isinstance(result, dict):  # Dict of NumPy arrays
+        arrays = list(result.values())
+        rows = len(arrays[0]) if arrays else 0
+        return rows, sum(getattr(a, 'nbytes', 0) for a in arrays)
+    if isinstance(result, list):
+        if not result:
+            return 0, 0
+        sample = result[:100]
+        sample_bytes = sum(_row_bytes(row) for row in sample)
+        return len(result), int(sample_bytes * len(result) / len(sample))
+    return 1, 0
+
+
+def _row_bytes(row: Any) -> int:
+    values = row.values() if isinstance(row, dict) else row
+    total = 0
+    for value in values:
+        if isinstance(value, (str, bytes)):
+            total += len(value)
+        else:
+            total += 8
+    return total
+
+
+class QueryTimer:
+    """
+    Measure one database call and emit a QueryRecord when it finishes.
+    
+    Usage: create before the first attempt, call first_row() when the
+    first result is available, add_result() for every result or batch, and
+    finish() exactly once (with the error on failure).
+    """
+    
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.step = current_step()
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._first_row: Optional[float] = None
+        self.rows = 0
+        self.payload_bytes = 0
+        self.retries = 0
+        self._finished = False
+    
+    def first_row(self):
+        if self._first_row is None:
+            self._first_row = time.perf_counter() - self._start
+    
+    def add_result(self, result: Any):
+        rows, payload_bytes = result_size(result)
+        self.rows += rows
+        self.payload_bytes += payload_bytes
+    
+    def finish(self, error: Optional[BaseException] = None) -> Optional[QueryRecord]:
+        if self._finished:
+            return None
+        self._finished = True
+        
+        record = QueryRecord(
+            sql=self.sql,
+            step=self.step,
+            started_at=self.started_at,
+            wall_time=time.perf_counter() - self._start,
+            time_to_first_row=self._first_row,
+            rows=self.rows,
+            payload_bytes=self.payload_bytes,
+            retries=self.retries,
+            error=str(error) if error is not None else None,
+        )
+        record_query(record)
+        return record
+
+
+def record_query(record: QueryRecord):
+    """Send a record to every collector and log it if it was slow."""
+    if SLOW_QUERY_THRESHOLD and record.wall_time >= SLOW_QUERY_THRESHOLD:
+        logger.warning(
+            f"Slow query ({record.wall_time:.2f}s, step={record.step or 'unassigned'}, "
+            f"rows={record.rows}): {_shorten(record.sql)}"
+        )
+    
+    if not _query_log_registered:
+        _register_query_log()
+    with _collectors_lock:
+        collectors = list(_collectors)
+    for collector in collectors:
+        try:
+            collector.collect(record)
+        except Exception as e:
+            logger.warning(f"Query collector {type(collector).__name__} failed: {e}")
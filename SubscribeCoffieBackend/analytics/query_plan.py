@@ -0,0 +1,204 @@
+"""Pre-flight cost estimates from EXPLAIN (FORMAT JSON) for ETL steps and exports."""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from config import PLAN_COST_BUDGET, PLAN_COST_BUDGETS, PLAN_SEQ_SCAN_COST
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PlanEstimate:
+    """Planner estimate for one statement a step would issue."""
+    description: str
+    total_cost: float = 0.0
+    rows: float = 0.0
+    # (relation, estimated cost) of sequential scans above PLAN_SEQ_SCAN_COST
+    seq_scans: List[Tuple[str, float]] = field(default_factory=list)
+    note: Optional[str] = None
+
+
+@dataclass
+class RpcProbe:
+    """
+    A query shaped like the dominant scan of a PL/pgSQL function.
+    
+    EXPLAIN cannot see inside PL/pgSQL bodies (a call is planned as a
+    Function Scan with the function's declared cost), so RPCs listed in
+    RPC_COST_PROBES are estimated from an equivalent query instead. The
+    SQL takes the RPC's parameters as %(name)s placeholders; ``defaults``
+    fill in those the caller leaves out.
+    """
+    sql: str
+    defaults: Dict[str, Any] = field(default_factory=dict)
+
+
+# Per-customer aggregation over orders, or over analytics_customer_stats
+# when from_stats is set (the unused branch is pruned at plan time)
+_CUSTOMER_AGGREGATE_PROBE = RpcProbe("""
+    SELECT o.customer_phone, count(*), max(o.created_at), sum(o.paid_credits)
+    FROM orders o
+    WHERE NOT %(from_stats)s AND o.status NOT IN ('cancelled', 'refunded')
+    GROUP BY o.customer_phone
+    UNION ALL
+    SELECT s.customer_phone, NULL, NULL, NULL
+    FROM analytics_customer_stats s
+    WHERE %(from_stats)s
+""", {'from_stats': False})
+
+_COHORT_PROBE = RpcProbe("""
+    SELECT fo.cohort_month, o.customer_phone, date_trunc('month', o.created_at),
+           count(*), sum(o.paid_credits)
+    FROM (
+        SELECT customer_phone, date_trunc('month', min(created_at))::date AS cohort_month
+        FROM orders
+        WHERE status NOT IN ('cancelled', 'refunded')
+        GROUP BY customer_phone
+    ) fo
+    JOIN orders o ON o.customer_phone = fo.customer_phone
+    WHERE o.status NOT IN ('cancelled', 'refunded')
+      AND fo.cohort_month >= date_trunc('month', now() - interval '1 month' * %(months_back)s)::date
+    GROUP BY 1, 2, 3
+""", {'months_back': 12})
+
+_FUNNEL_PROBE = RpcProbe("""
+    SELECT event_type, count(DISTINCT customer_phone), min(created_at)
+    FROM funnel_events
+    WHERE created_at >= now() - interval '1 day' * %(window_days)s
+      AND (%(cafe_id_param)s::uuid IS NULL OR cafe_id = %(cafe_id_param)s::uuid)
+    GROUP BY event_type
+""", {'window_days': 30, 'cafe_id_param': None})
+
+RPC_COST_PROBES: Dict[str, RpcProbe] = {
+    'refresh_customer_stats': RpcProbe("""
+        SELECT o.customer_phone, count(*), min(o.created_at), max(o.created_at), sum(o.paid_credits)
+        FROM orders o
+        WHERE o.status NOT IN ('cancelled', 'refunded')
+          AND (%(changed_since)s::timestamptz IS NULL OR o.customer_phone IN (
+              SELECT t.customer_phone FROM orders t
+              WHERE t.updated_at > %(changed_since)s::timestamptz
+          ))
+        GROUP BY o.customer_phone
+    """, {'changed_since': None}),
+    'refresh_cohort_analytics': _COHORT_PROBE,
+    'calculate_cohort_retention': _COHORT_PROBE,
+    'refresh_churn_risk': _CUSTOMER_AGGREGATE_PROBE,
+    'calculate_churn_risk': _CUSTOMER_AGGREGATE_PROBE,
+    'calculate_rfm_segments': _CUSTOMER_AGGREGATE_PROBE,
+    'refresh_rfm_segments': _CUSTOMER_AGGREGATE_PROBE,
+    'calculate_customer_ltv': RpcProbe("""
+        SELECT o.customer_phone, min(o.created_at), max(o.created_at), count(*),
+               sum(o.paid_credits), avg(o.paid_credits)
+        FROM orders o
+        WHERE o.status NOT IN ('cancelled', 'refunded')
+          AND o.created_at >= now() - interval '1 month' * %(months_back)s
+        GROUP BY o.customer_phone
+    """, {'months_back': 12}),
+    'refresh_funnel_results': _FUNNEL_PROBE,
+    'calculate_conversion_funnel': _FUNNEL_PROBE,
+    'get_revenue_breakdown': RpcProbe("""
+        SELECT o.cafe_id, extract(hour from o.created_at), count(*), sum(o.paid_credits)
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.status NOT IN ('cancelled', 'refunded')
+          AND o.created_at >= now() - interval '30 days'
+        GROUP BY 1, 2
+    """),
+}
+
+
+def _walk(node: Dict[str, Any]):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from _walk(child)
+
+
+def parse_explain(plan: Any, description: str) -> PlanEstimate:
+    """
+    Build a PlanEstimate from the output of EXPLAIN (FORMAT JSON).
+    
+    Args:
+        plan: The decoded JSON document (a one-element list)
+        description: What was explained, for the report
+    """
+    root = plan[0]['Plan']
+    seq_scans = [
+        (node.get('Relation Name', '?'), node['Total Cost'])
+        for node in _walk(root)
+        if node['Node Type'] == 'Seq Scan' and node['Total Cost'] >= PLAN_SEQ_SCAN_COST
+    ]
+    return PlanEstimate(description, root['Total Cost'], root['Plan Rows'], seq_scans)
+
+
+@dataclass
+class StepPlan:
+    """Estimates for every statement one ETL step or export would issue."""
+    name: str
+    estimates: List[PlanEstimate] = field(default_factory=list)
+    error: Optional[str] = None
+    
+    @property
+    def total_cost(self) -> float:
+        return sum(estimate.total_cost for estimate in self.estimates)
+    
+    @property
+    def rows(self) -> float:
+        return sum(estimate.rows for estimate in self.estimates)
+    
+    @property
+    def seq_scans(self) -> List[Tuple[str, float]]:
+        return [scan for estimate in self.estimates for scan in estimate.seq_scans]
+    
+    @property
+    def budget(self) -> float:
+        return cost_budget(self.name)
+    
+    @property
+    def over_budget(self) -> bool:
+        return 0 < self.budget < self.total_cost
+
+
+def cost_budget(name: str) -> float:
+    """Return the cost budget of a step or export ("export_<name>"); 0 means none."""
+    return PLAN_COST_BUDGETS.get(name, PLAN_COST_BUDGET)
+
+
+def log_plan_report(plans: Dict[str, StepPlan], verbose: bool = True):
+    """
+    Log estimated cost, rows and sequential-scan risk per step and in total.
+    
+    Args:
+        plans: Step name -> StepPlan, in run order
+        verbose: Also list every statement with its estimate
+    """
+    logger.info("=" * 80)
+    logger.info("Estimated Cost (EXPLAIN, planner units)")
+    logger.info("=" * 80)
+    for plan in plans.values():
+        budget = f"budget {plan.budget:,.0f}" if plan.budget else "no budget"
+        status = "OVER BUDGET" if plan.over_budget else "ok"
+        logger.info(
+            f"{plan.name}: cost {plan.total_cost:,.0f}, ~{plan.rows:,.0f} rows, "
+            f"{len(plan.estimates)} statements ({budget}: {status})"
+        )
+        if plan.error:
+            logger.warning(f"  Planning stopped early: {plan.error}")
+        for relation, cost in plan.seq_scans:
+            logger.warning(f"  Sequential scan on {relation} (cost {cost:,.0f})")
+        if verbose:
+            for estimate in plan.estimates:
+                detail = estimate.note or f"cost {estimate.total_cost:,.0f}, ~{estimate.rows:,.0f} rows"
+                logger.info(f"    - {estimate.description}: {detail}")
+    
+    total_cost = sum(plan.total_cost for plan in plans.values())
+    total_rows = sum(plan.rows for plan in plans.values())
+    seq_scans = sum(len(plan.seq_scans) for plan in plans.values())
+    over = [plan.name for plan in plans.values() if plan.over_budget]
+    logger.info("-" * 80)
+    logger.info(
+        f"Total: cost {total_cost:,.0f}, ~{total_rows:,.0f} rows, "
+        f"{seq_scans} risky sequential scans"
+    )
+    if over:
+        logger.warning(f"Over budget: {', '.join(over)}")
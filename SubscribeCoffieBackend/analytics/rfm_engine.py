@@ -0,0 +1,318 @@
+"""Vectorized RFM scoring in NumPy, an alternative to calculate_rfm_segments() on the database."""
+
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
+import numpy as np
+from db_utils import execute_query_iter
+from config import RFM_BATCH_SIZE, RFM_SCORING
+
+if TYPE_CHECKING:
+    # pandas is imported where it is used, to keep startup fast
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SCORING_METHODS = ('fixed', 'quantile')
+
+# Thresholds of calculate_rfm_segments(): recency scores 5 up to 7 days, 4 up
+# to 14, ...; frequency and monetary score 2 from the first bound, 3 from the
+# second, ...
+RECENCY_DAYS = (7, 14, 30, 60)
+FREQUENCY_ORDERS = (2, 5, 10, 20)
+MONETARY_CREDITS = (1000, 2000, 5000, 10000)
+
+# Quantile scoring splits each metric into quintiles of the scored customers
+QUANTILES = (0.2, 0.4, 0.6, 0.8)
+
+COLUMNS = (
+    'customer_phone', 'recency_days', 'frequency', 'monetary',
+    'r_score', 'f_score', 'm_score', 'rfm_segment', 'segment_description',
+)
+
+
+@dataclass(frozen=True)
+class Segment:
+    """An RFM segment and the (inclusive) score ranges of its customers."""
+    name: str
+    description: str
+    r: Tuple[int, int] = (1, 5)
+    f: Tuple[int, int] = (1, 5)
+    m: Tuple[int, int] = (1, 5)
+    
+    def matches(self, r: int, f: int, m: int) -> bool:
+        return (
+            self.r[0] <= r <= self.r[1]
+            and self.f[0] <= f <= self.f[1]
+            and self.m[0] <= m <= self.m[1]
+        )
+
+
+# A customer belongs to the first matching segment, as in the CASE of
+# calculate_rfm_segments(). cant_lose_them, which the SQL function folds into
+# at_risk, takes the valuable customers with the lowest recency score.
+SEGMENTS = (
+    Segment('champions', 'Лучшие клиенты: покупают часто, недавно и много', r=(4, 5), f=(4, 5), m=(4, 5)),
+    Segment('loyal_customers', 'Лояльные клиенты: регулярные покупатели', r=(3, 5), f=(4, 5), m=(4, 5)),
+    Segment('big_spenders', 'Крупные покупатели: тратят много, но редко', r=(4, 5), f=(1, 2), m=(4, 5)),
+    Segment('promising', 'Перспективные: недавно и часто покупают', r=(4, 5), f=(3, 5)),
+    Segment('potential_loyalists', 'Потенциально лояльные: могут стать постоянными', r=(3, 5), f=(3, 5)),
+    Segment('new_customers', 'Новые клиенты: недавно сделали первый заказ', r=(4, 5), f=(1, 2), m=(1, 2)),
+    Segment(
+        'cant_lose_them', 'Нельзя потерять: ценные клиенты, которые очень давно не покупали',
+        r=(1, 1), f=(4, 5), m=(4, 5)
+    ),
+    Segment(
+        'at_risk', 'В группе риска: ценные клиенты, которые давно не покупали',
+        r=(1, 2), f=(4, 5), m=(4, 5)
+    ),
+    Segment('need_attention', 'Требуют внимания: нужно вернуть', r=(1, 2), f=(2, 5), m=(2, 5)),
+    Segment('lost', 'Потерянные: очень давно не покупали', r=(1, 2), f=(1, 2)),
+    Segment('others', 'Прочие'),
+)
+
+
+def _segment_table() -> np.ndarray:
+    """Index into SEGMENTS for each of the 125 (r, f, m) score combinations."""
+    table = np.empty(125, dtype=np.int8)
+    for code in range(125):
+        r, f, m = code // 25 + 1, code // 5 % 5 + 1, code % 5 + 1
+        table[code] = next(i for i, segment in enumerate(SEGMENTS) if segment.matches(r, f, m))
+    return table
+
+
+_SEGMENT_TABLE = _segment_table()
+_SEGMENT_NAMES = np.array([segment.name for segment in SEGMENTS], dtype=object)
+_SEGMENT_DESCRIPTIONS = np.array([segment.description for segment in SEGMENTS], dtype=object)
+
+
+def fixed_scores(
+    recency_days: np.ndarray,
+    frequency: np.ndarray,
+    monetary: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Score R, F and M with the thresholds of calculate_rfm_segments()."""
+    r = 5 - np.searchsorted(RECENCY_DAYS, recency_days, side='left')
+    f = 1 + np.searchsorted(FREQUENCY_ORDERS, frequency, side='right')
+    m = 1 + np.searchsorted(MONETARY_CREDITS, monetary, side='right')
+    return r.astype(np.int8), f.astype(np.int8), m.astype(np.int8)
+
+
+def quantile_scores(
+    recency_days: np.ndarray,
+    frequency: np.ndarray,
+    monetary: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Score R, F and M by quintile of the customers scored.
+    
+    Scores follow values, so customers with equal values share a score: a
+    metric with many ties (most customers order once or twice) leaves some
+    scores empty rather than splitting equal customers arbitrarily.
+    """
+    if len(recency_days) == 0:
+        return fixed_scores(recency_days, frequency, monetary)
+    
+    def _bounds(values: np.ndarray) -> np.ndarray:
+        return np.quantile(values, QUANTILES)
+    
+    # A value on a quintile bound scores with the lower quintile
+    r = 5 - np.searchsorted(_bounds(recency_days), recency_days, side='left')
+    f = 1 + np.searchsorted(_bounds(frequency), frequency, side='left')
+    m = 1 + np.searchsorted(_bounds(monetary), monetary, side='left')
+    return r.astype(np.int8), f.astype(np.int8), m.astype(np.int8)
+
+
+def assign_segments(r: np.ndarray, f: np.ndarray, m: np.ndarray) -> np.ndarray:
+    """Return the index into SEGMENTS of every customer's segment."""
+    codes = (r.astype(np.intp) - 1) * 25 + (f.astype(np.intp) - 1) * 5 + (m.astype(np.intp) - 1)
+    return _SEGMENT_TABLE[codes]
+
+
+def score_customers(customers: Dict[str, np.ndarray], scoring: str = 'fixed') -> Dict[str, np.ndarray]:
+    """
+    Score customers and assign their RFM segments.
+    
+    Args:
+        customers: 'customer_phone', 'recency_days', 'frequency' and
+            'monetary' arrays, one element per customer
+        scoring: 'fixed' thresholds or 'quantile' (quintiles)
+    
+    Returns:
+        Dict of COLUMNS arrays ordered like calculate_rfm_segments(): best
+        scores first, input order among equal scores
+    """
+    if scoring not in SCORING_METHODS:
+        raise ValueError(f"Unsupported RFM scoring: {scoring}")
+    
+    recency = np.asarray(customers['recency_days'], dtype=np.int64)
+    frequency = np.asarray(customers['frequency'], dtype=np.int64)
+    monetary = np.asarray(customers['monetary'], dtype=np.int64)
+    score = fixed_scores if scoring == 'fixed' else quantile_scores
+    r, f, m = score(recency, frequency, monetary)
+    segments = assign_segments(r, f, m)
+    
+    # Stable sort on the combined score keeps the input (phone) order for ties
+    order = np.argsort(-(r.astype(np.int16) * 100 + f * 10 + m), kind='stable')
+    return {
+        'customer_phone': np.asarray(customers['customer_phone'], dtype=object)[order],
+        'recency_days': recency[order],
+        'frequency': frequency[order],
+        'monetary': monetary[order],
+        'r_score': r[order],
+        'f_score': f[order],
+        'm_score': m[order],
+        'rfm_segment': _SEGMENT_NAMES[segments[order]],
+        'segment_description': _SEGMENT_DESCRIPTIONS[segments[order]],
+    }
+
+
+def days_since(timestamps: np.ndarray, as_of: datetime) -> np.ndarray:
+    """Whole days from each UTC timestamp to ``as_of``, like extract(day from now() - ts)."""
+    now = np.datetime64(as_of.astimezone(timezone.utc).replace(tzinfo=None), 'us')
+    return (now - timestamps.astype('datetime64[us]')) // np.timedelta64(1, 'D')
+
+
+def _empty_aggregates() -> Dict[str, np.ndarray]:
+    return {
+        'customer_phone': np.empty(0, dtype=object),
+        'last_order_at': np.empty(0, dtype='datetime64[us]'),
+        'frequency': np.empty(0, dtype=np.int64),
+        'monetary': np.empty(0, dtype=np.int64),
+    }
+
+
+def aggregate_sorted_orders(batches: Iterable[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    Reduce order batches sorted by customer_phone to one row per customer.
+    
+    Each batch is reduced with ufunc.reduceat over its runs of equal phones.
+    The last customer of a batch may continue in the next one, so its
+    partial aggregate is carried over instead of emitted; memory therefore
+    stays at one batch of orders plus the per-customer result.
+    
+    Args:
+        batches: 'customer_phone', 'created_at' and 'paid_credits' arrays
+    
+    Returns:
+        'customer_phone', 'last_order_at', 'frequency' and 'monetary' arrays
+    """
+    parts = []
+    carry = None
+    for batch in batches:
+        phones = np.asarray(batch['customer_phone'], dtype=object)
+        if len(phones) == 0:
+            continue
+        created = batch['created_at'].astype('datetime64[us]')
+        counts = np.ones(len(phones), dtype=np.int64)
+        paid = batch['paid_credits'].astype(np.int64)
+        if carry is not None:
+            phones = np.concatenate([carry['customer_phone'], phones])
+            created = np.concatenate([carry['last_order_at'], created])
+            counts = np.concatenate([carry['frequency'], counts])
+            paid = np.concatenate([carry['monetary'], paid])
+        
+        starts = np.flatnonzero(np.concatenate([[True], phones[1:] != phones[:-1]]))
+        reduced = {
+            'customer_phone': phones[starts],
+            'last_order_at': np.maximum.reduceat(created, starts),
+            'frequency': np.add.reduceat(counts, starts),
+            'monetary': np.add.reduceat(paid, starts),
+        }
+        parts.append({name: values[:-1] for name, values in reduced.items()})
+        carry = {name: values[-1:] for name, values in reduced.items()}
+    
+    if carry is not None:
+        parts.append(carry)
+    if not parts:
+        return _empty_aggregates()
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def load_customer_aggregates(from_stats: bool = False, batch_size: int = RFM_BATCH_SIZE) -> Dict[str, np.ndarray]:
+    """
+    Stream per-customer last order time, order count and spend.
+    
+    The rows are read through a server-side cursor on a read replica when
+    one is configured, so the primary only serves an ordered scan and none
+    of the scoring.
+    
+    Args:
+        from_stats: Read analytics_customer_stats instead of aggregating
+            every order
+        batch_size: Rows fetched per round-trip
+    
+    Returns:
+        'customer_phone', 'last_order_at', 'frequency' and 'monetary'
+        arrays, ordered by customer_phone
+    """
+    if from_stats:
+        batches = execute_query_iter("""
+            SELECT customer_phone, last_order_at, total_orders AS frequency, total_spent AS monetary
+            FROM analytics_customer_stats
+            ORDER BY customer_phone;
+        """, batch_size=batch_size, result_format='numpy', read_only=True)
+        parts = [
+            {
+                'customer_phone': batch['customer_phone'],
+                'last_order_at': batch['last_order_at'].astype('datetime64[us]'),
+                'frequency': batch['frequency'].astype(np.int64),
+                'monetary': batch['monetary'].astype(np.int64),
+            }
+            for batch in batches
+        ]
+        if not parts:
+            return _empty_aggregates()
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    
+    # Sorted by phone (orders_phone_created_idx) so each customer's orders
+    # arrive together and can be reduced batch by batch
+    return aggregate_sorted_orders(execute_query_iter("""
+        SELECT customer_phone, created_at, paid_credits
+        FROM orders
+        WHERE status NOT IN ('cancelled', 'refunded')
+        ORDER BY customer_phone;
+    """, batch_size=batch_size, result_format='numpy', read_only=True))
+
+
+def calculate_rfm_segments(
+    from_stats: bool = False,
+    scoring: str = RFM_SCORING,
+    as_of: Optional[datetime] = None,
+    batch_size: int = RFM_BATCH_SIZE
+) -> 'pd.DataFrame':
+    """
+    Score every customer's RFM segment in this process.
+    
+    Returns the same columns and order as the calculate_rfm_segments()
+    database function, except that the lowest recency score of at_risk
+    becomes cant_lose_them (see SEGMENTS).
+    
+    Args:
+        from_stats: Score from analytics_customer_stats instead of
+            aggregating every order
+        scoring: 'fixed' thresholds or 'quantile' (quintiles)
+        as_of: Time recency is measured to (defaults to now)
+        batch_size: Rows fetched per round-trip
+    
+    Returns:
+        DataFrame with one row per customer
+    """
+    import pandas as pd
+    
+    if scoring not in SCORING_METHODS:
+        raise ValueError(f"Unsupported RFM scoring: {scoring}")
+    as_of = as_of or datetime.now(timezone.utc)
+    
+    start = time.perf_counter()
+    customers = load_customer_aggregates(from_stats, batch_size)
+    loaded = time.perf_counter()
+    customers['recency_days'] = days_since(customers['last_order_at'], as_of)
+    result = score_customers(customers, scoring)
+    logger.info(
+        f"Scored {len(result['customer_phone'])} customers ({scoring} scoring) in "
+        f"{time.perf_counter() - loaded:.2f}s after loading them in {loaded - start:.2f}s"
+    )
+    return pd.DataFrame(result, columns=list(COLUMNS))
@@ -0,0 +1,229 @@
+"""Run manifests for the analytics ETL pipeline, used to resume failed runs."""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from config import RUN_MANIFEST_DIR, RUN_MANIFEST_KEEP
+
+logger = logging.getLogger(__name__)
+
+# Step statuses; anything but 'success' is re-executed by a resume
+STEP_SUCCESS = 'success'
+STEP_FAILED = 'failed'
+STEP_SKIPPED = 'skipped'
+STEP_DEFERRED = 'deferred'  # held back by the cost budget
+STEP_RUNNING = 'running'
+
+# Outputs reported by the ETL step running in the current thread
+_step_outputs: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    'step_outputs', default=None
+)
+
+
+# Id of the pipeline run the current step belongs to
+_current_run_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    'current_run_id', default=None
+)
+
+
+def current_run_id() -> Optional[str]:
+    """Return the id of the pipeline run executing the current step, if any."""
+    return _current_run_id.get()
+
+
+def record_output(artifact: str, rows: Optional[int] = None):
+    """
+    Note a table, file or in-memory snapshot produced by the running ETL step.
+    
+    Outside a pipeline run this does nothing, so ETL modules can call it
+    whether they are run by etl_aggregate or on their own.
+    
+    Args:
+        artifact: Where the output lives (table name, file path, ...)
+        rows: Number of rows written, if known
+    """
+    outputs = _step_outputs.get()
+    if outputs is not None:
+        outputs.append({'artifact': str(artifact), 'rows': rows})
+
+
+@contextmanager
+def collect_outputs(run_id: Optional[str] = None):
+    """
+    Collect the record_output() calls made inside the block; yields the list.
+    
+    Args:
+        run_id: Pipeline run the block belongs to, see current_run_id()
+    """
+    outputs: List[Dict[str, Any]] = []
+    token = _step_outputs.set(outputs)
+    run_token = _current_run_id.set(run_id)
+    try:
+        yield outputs
+    finally:
+        _current_run_id.reset(run_token)
+        _step_outputs.reset(token)
+
+
+def manifest_path(run_id: str) -> Path:
+    """Return the manifest file of a run."""
+    return RUN_MANIFEST_DIR / f"{run_id}.json"
+
+
+def list_run_ids() -> List[str]:
+    """Return the ids of stored runs, oldest first."""
+    if not RUN_MANIFEST_DIR.exists():
+        return []
+    return sorted(path.stem for path in RUN_MANIFEST_DIR.glob('*.json'))
+
+
+def _prune_manifests():
+    """Delete all but the newest RUN_MANIFEST_KEEP manifests."""
+    if RUN_MANIFEST_KEEP <= 0:
+        return
+    for run_id in list_run_ids()[:-RUN_MANIFEST_KEEP]:
+        try:
+            manifest_path(run_id).unlink()
+        except OSError as e:
+            logger.warning(f"Could not delete old run manifest {run_id}: {e}")
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class RunManifest:
+    """
+    JSON record of one pipeline run: options, per-step status, timings, row
+    counts and outputs.
+    
+    The file is rewritten atomically whenever a step starts or finishes, so
+    it is a usable checkpoint even if the process is killed mid-run. A
+    resumed run keeps its run id and appends to the same manifest.
+    """
+    
+    def __init__(self, data: Dict[str, Any], path: Path):
+        self.data = data
+        self.path = path
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def create(cls, step_names: Iterable[str], full_refresh: bool = False) -> 'RunManifest':
+        """Start the manifest of a new run."""
+        run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+        manifest = cls({
+            'run_id': run_id,
+            'status': STEP_RUNNING,
+            'started_at': _now(),
+            'finished_at': None,
+            'attempts': 1,
+            'options': {'steps': list(step_names), 'full_refresh': full_refresh},
+            'steps': {},
+        }, manifest_path(run_id))
+        RUN_MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+        manifest.save()
+        _prune_manifests()
+        return manifest
+    
+    @classmethod
+    def load(cls, run_id: str) -> 'RunManifest':
+        """
+        Load the manifest of an earlier run.
+        
+        Raises:
+            FileNotFoundError: If no manifest exists for the run id
+        """
+        path = manifest_path(run_id)
+        if not path.exists():
+            raise FileNotFoundError(f"No manifest for run {run_id} in {RUN_MANIFEST_DIR}")
+        with open(path) as f:
+            return cls(json.load(f), path)
+    
+    @property
+    def run_id(self) -> str:
+        return self.data['run_id']
+    
+    @property
+    def options(self) -> Dict[str, Any]:
+        return self.data['options']
+    
+    def completed_steps(self) -> List[str]:
+        """Steps that succeeded in an earlier attempt and need not run again."""
+        return [
+            name for name, step in self.data['steps'].items()
+            if step.get('status') == STEP_SUCCESS
+        ]
+    
+    def start_attempt(self):
+        """Mark the run as running again for a resume."""
+        with self._lock:
+            self.data['attempts'] += 1
+            self.data['status'] = STEP_RUNNING
+            self.data['finished_at'] = None
+            self._save()
+    
+    def step_started(self, name: str):
+        with self._lock:
+            self.data['steps'][name] = {
+                'status': STEP_RUNNING,
+                'attempt': self.data['attempts'],
+                'started_at': _now(),
+            }
+            self._save()
+    
+    def step_finished(
+        self,
+        name: str,
+        status: str,
+        duration: float = 0.0,
+        outputs: Optional[List[Dict[str, Any]]] = None,
+        error: Optional[str] = None
+    ):
+        """
+        Record the outcome of a step.
+        
+        Args:
+            name: Step name
+            status: 'success', 'failed', 'skipped' or 'deferred'
+            duration: Step wall time in seconds
+            outputs: Artifacts reported through record_output()
+            error: Error message of a failed step
+        """
+        outputs = outputs or []
+        counted = [output['rows'] for output in outputs if output['rows'] is not None]
+        with self._lock:
+            entry = self.data['steps'].setdefault(name, {'attempt': self.data['attempts']})
+            entry.update({
+                'status': status,
+                'finished_at': _now(),
+                'duration': round(duration, 3),
+                'rows': sum(counted) if counted else None,
+                'outputs': outputs,
+                'error': error,
+            })
+            self._save()
+    
+    def finish(self, success: bool):
+        with self._lock:
+            self.data['status'] = STEP_SUCCESS if success else STEP_FAILED
+            self.data['finished_at'] = _now()
+            self._save()
+    
+    def save(self):
+        with self._lock:
+            self._save()
+    
+    def _save(self):
+        # Write a temporary file and rename it over the manifest, so readers
+        # (and a resume after a crash) never see a half-written file
+        tmp_path = self.path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=2, default=str)
+        os.replace(tmp_path, self.path)
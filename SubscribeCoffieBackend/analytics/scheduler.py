@@ -0,0 +1,201 @@
+"""In-process cron-like scheduler for the long-running analytics ETL daemon."""
+
+import logging
+import random
+import signal
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Set
+
+logger = logging.getLogger(__name__)
+
+# (low, high) bounds of the five cron fields; weekday 7 is also Sunday
+_FIELD_BOUNDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),
+)
+
+# Upper bound on how long the scheduler sleeps between clock checks, so
+# wall-clock jumps (NTP, DST) are noticed
+MAX_SLEEP = 60.0
+
+
+def _parse_field(field: str, name: str, low: int, high: int) -> Set[int]:
+    """Parse one cron field ('*', '5', '1-5', '*/15', '0,30') into its values."""
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"Invalid step in cron {name} field: {field}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Cron {name} field out of range: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    A standard five-field cron expression: minute hour day month weekday.
+    
+    Supports '*', single values, ranges, lists and steps. As in cron, when
+    both day and weekday are restricted a time matches if either does.
+    """
+    
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression!r}")
+        
+        self.expression = expression
+        minutes, hours, days, months, weekdays = (
+            _parse_field(field, name, low, high)
+            for field, (name, low, high) in zip(fields, _FIELD_BOUNDS)
+        )
+        self.minutes = minutes
+        self.hours = hours
+        self.days = days
+        self.months = months
+        self.weekdays = {day % 7 for day in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+    
+    def __repr__(self) -> str:
+        return f"CronSchedule({self.expression!r})"
+    
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = moment.isoweekday() % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+    
+    def matches(self, moment: datetime) -> bool:
+        """Return True if the schedule fires in the minute of ``moment``."""
+        return (
+            moment.minute in self.minutes
+            and moment.hour in self.hours
+            and moment.month in self.months
+            and self._day_matches(moment)
+        )
+    
+    def next_after(self, moment: datetime) -> datetime:
+        """
+        Return the first firing time strictly after ``moment``.
+        
+        Skips whole days and hours that cannot match, so even sparse
+        schedules resolve in a few thousand iterations.
+        """
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+
+class Scheduler:
+    """
+    Run jobs on cron-like schedules inside one long-lived process.
+    
+    Jobs due at the same time are handed to ``run`` together, so they can
+    share one pipeline run. Runs execute one at a time on the calling
+    thread: a job that comes due while a run is in progress is started
+    once when it finishes instead of overlapping it, and missed firings
+    are coalesced rather than replayed. Each start time is delayed by a
+    random jitter of up to ``jitter`` seconds to spread load.
+    """
+    
+    def __init__(
+        self,
+        schedules: Dict[str, str],
+        run: Callable[[List[str]], bool],
+        jitter: float = 0.0
+    ):
+        """
+        Args:
+            schedules: Cron expression per job name
+            run: Called with the names of the jobs that are due
+            jitter: Maximum random delay added to each start time, in seconds
+        """
+        self.schedules = {name: CronSchedule(expression) for name, expression in schedules.items()}
+        self.run = run
+        self.jitter = max(jitter, 0.0)
+        self._next_run: Dict[str, datetime] = {}
+        self._stop = threading.Event()
+    
+    def _plan(self, name: str, after: datetime) -> datetime:
+        next_run = self.schedules[name].next_after(after)
+        if self.jitter:
+            next_run += timedelta(seconds=random.uniform(0, self.jitter))
+        return next_run
+    
+    def _log_next_runs(self):
+        for name, next_run in sorted(self._next_run.items(), key=lambda item: item[1]):
+            logger.info(f"Next {name} run at {next_run:%Y-%m-%d %H:%M:%S}")
+    
+    @property
+    def stopping(self) -> bool:
+        return self._stop.is_set()
+    
+    def stop(self, signum=None, frame=None):
+        """Ask the scheduler to exit once the current run (if any) finishes."""
+        if not self._stop.is_set():
+            reason = f"signal {signal.Signals(signum).name}" if signum else "stop()"
+            logger.info(f"Shutdown requested ({reason}); finishing the current run")
+        self._stop.set()
+    
+    def install_signal_handlers(self):
+        """Stop gracefully on SIGTERM and SIGINT (main thread only)."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+    
+    def run_forever(self):
+        """Run due jobs until ``stop()`` is called or a stop signal arrives."""
+        now = datetime.now()
+        self._next_run = {name: self._plan(name, now) for name in self.schedules}
+        logger.info(f"Scheduler started with {len(self.schedules)} schedules")
+        self._log_next_runs()
+        
+        while not self._stop.is_set():
+            now = datetime.now()
+            due = [name for name, next_run in self._next_run.items() if next_run <= now]
+            if not due:
+                wait = (min(self._next_run.values()) - now).total_seconds()
+                self._stop.wait(min(max(wait, 0.0), MAX_SLEEP))
+                continue
+            
+            # Plan the following firing from now, so firings missed while
+            # a long run was in progress collapse into this one
+            for name in due:
+                self._next_run[name] = self._plan(name, now)
+            
+            logger.info(f"Scheduled run: {', '.join(due)}")
+            try:
+                if not self.run(due):
+                    logger.warning(f"Scheduled run of {', '.join(due)} did not fully succeed")
+            except Exception as e:
+                logger.error(f"Scheduled run of {', '.join(due)} failed: {e}", exc_info=True)
+            
+            if not self._stop.is_set():
+                self._log_next_runs()
+        
+        logger.info("Scheduler stopped")
@@ -0,0 +1,348 @@
+"""Sharded per-customer ETL work, claimed through a PostgreSQL lease table."""
+
+import contextvars
+import importlib
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from db_utils import call_rpc_function, etl_step, is_planning
+from run_manifest import current_run_id
+from config import (
+    ETL_SHARDS, ETL_SHARD_WORKERS, SHARD_LEASE_SECONDS, SHARD_MAX_ATTEMPTS, SHARD_POLL_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Customers are hashed into this many buckets (analytics_customer_bucket()
+# in the database); a shard is a contiguous range of buckets
+MAX_SHARDS = 1024
+
+# Step -> (module, function) that processes one shard. The function is
+# called as fn(shard, shard_count, run_key, **params), writes its customers'
+# results idempotently and returns the number of rows written
+SHARD_HANDLERS = {
+    'churn': ('etl_churn', 'refresh_churn_risk_shard'),
+    'rfm': ('etl_rfm', 'refresh_rfm_shard'),
+}
+
+
+@dataclass
+class ShardLease:
+    """A shard claimed by one worker until its lease expires."""
+    run_key: str
+    step: str
+    shard: int
+    shard_count: int
+    worker_id: str
+    attempt: int = 1
+    params: Dict[str, Any] = field(default_factory=dict)
+    
+    def __str__(self) -> str:
+        return f"{self.step} shard {self.shard + 1}/{self.shard_count}"
+
+
+def shard_handler(step: str) -> Callable[..., int]:
+    """Import and return the function that processes one shard of a step."""
+    if step not in SHARD_HANDLERS:
+        raise ValueError(f"ETL step cannot be sharded: {step}")
+    module, name = SHARD_HANDLERS[step]
+    return getattr(importlib.import_module(module), name)
+
+
+def new_run_key(step: str) -> str:
+    """
+    Return the key shards of a step are created under.
+    
+    Inside a pipeline run this is the run id, so a resumed run finds the
+    shards that already finished; standalone runs get a fresh key.
+    """
+    return current_run_id() or f"{step}-{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+def worker_name(slot: int = 0) -> str:
+    """Identify a worker thread across machines: host:pid:slot."""
+    return f"{socket.gethostname()}:{os.getpid()}:{slot}"
+
+
+def claim_shard(worker_id: str, run_key: Optional[str] = None, step: Optional[str] = None) -> Optional[ShardLease]:
+    """
+    Lease a pending shard, or one whose lease expired, for ``worker_id``.
+    
+    Args:
+        worker_id: Name of the claiming worker
+        run_key: Only claim shards of this run (any run when None)
+        step: Only claim shards of this step (any step when None)
+    
+    Returns:
+        The lease, or None if no shard is available
+    """
+    rows = call_rpc_function('claim_analytics_shard', {
+        'worker_param': worker_id,
+        'lease_seconds_param': SHARD_LEASE_SECONDS,
+        'max_attempts_param': SHARD_MAX_ATTEMPTS,
+        'run_key_param': run_key,
+        'step_param': step,
+    }, read_only=False)
+    if not rows:
+        return None
+    row = rows[0]
+    params = row['params'] or {}
+    if isinstance(params, str):
+        params = json.loads(params)
+    return ShardLease(
+        row['run_key'], row['step'], row['shard'], row['shard_count'], worker_id,
+        row['attempts'], params
+    )
+
+
+def _finish_shard(lease: ShardLease, rows: Optional[int] = None, error: Optional[str] = None) -> bool:
+    result = call_rpc_function('finish_analytics_shard', {
+        'run_key_param': lease.run_key,
+        'step_param': lease.step,
+        'shard_param': lease.shard,
+        'worker_param': lease.worker_id,
+        'rows_param': rows,
+        'error_param': error,
+    }, read_only=False)
+    return bool(result and result[0]['finish_analytics_shard'])
+
+
+class LeaseKeeper:
+    """
+    Renew the leases held by this process from a background thread.
+    
+    Leases are renewed every third of SHARD_LEASE_SECONDS, so they only
+    expire when the process dies or loses the database; another worker
+    then reclaims the shard.
+    """
+    
+    def __init__(self):
+        self._leases: Dict[tuple, ShardLease] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def __enter__(self) -> 'LeaseKeeper':
+        self._thread = threading.Thread(target=self._run, name='shard-leases', daemon=True)
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+    
+    def hold(self, lease: ShardLease):
+        with self._lock:
+            self._leases[(lease.run_key, lease.step, lease.shard)] = lease
+    
+    def release(self, lease: ShardLease):
+        with self._lock:
+            self._leases.pop((lease.run_key, lease.step, lease.shard), None)
+    
+    def _run(self):
+        while not self._stop.wait(SHARD_LEASE_SECONDS / 3):
+            with self._lock:
+                leases = list(self._leases.values())
+            for lease in leases:
+                try:
+                    result = call_rpc_function('renew_analytics_shard', {
+                        'run_key_param': lease.run_key,
+                        'step_param': lease.step,
+                        'shard_param': lease.shard,
+                        'worker_param': lease.worker_id,
+                        'lease_seconds_param': SHARD_LEASE_SECONDS,
+                    }, read_only=False)
+                    if not (result and result[0]['renew_analytics_shard']):
+                        logger.warning(f"Lease on {lease} was lost to another worker")
+                except Exception as e:
+                    logger.warning(f"Could not renew lease on {lease}: {e}")
+
+
+def process_shard(lease: ShardLease, keeper: LeaseKeeper) -> bool:
+    """
+    Run one leased shard and record the outcome in the lease table.
+    
+    A failed shard goes back to the queue until SHARD_MAX_ATTEMPTS is
+    reached. Never raises.
+    """
+    logger.info(f"Processing {lease} (attempt {lease.attempt}, {lease.worker_id})")
+    start = time.perf_counter()
+    keeper.hold(lease)
+    try:
+        rows = shard_handler(lease.step)(lease.shard, lease.shard_count, lease.run_key, **lease.params)
+    except Exception as e:
+        logger.error(f"{lease} failed: {e}", exc_info=True)
+        keeper.release(lease)
+        try:
+            _finish_shard(lease, error=str(e))
+        except Exception as finish_error:
+            # The lease expires and the shard is retried by whoever claims it
+            logger.error(f"Could not release {lease}: {finish_error}")
+        return False
+    keeper.release(lease)
+    
+    try:
+        if not _finish_shard(lease, rows):
+            # Shard writes are idempotent upserts, so the result stands even
+            # though another worker took over the shard and will write it again
+            logger.warning(f"{lease} finished after its lease was taken over")
+    except Exception as e:
+        logger.error(f"Could not mark {lease} done: {e}")
+        return False
+    logger.info(f"Finished {lease}: {rows} rows in {time.perf_counter() - start:.2f}s")
+    return True
+
+
+def _work(worker_id: str, keeper: LeaseKeeper, run_key: str, step: str) -> int:
+    """Claim and process shards of one run and step until none are free."""
+    processed = 0
+    while True:
+        lease = claim_shard(worker_id, run_key, step)
+        if lease is None:
+            return processed
+        process_shard(lease, keeper)
+        processed += 1
+
+
+def run_sharded(
+    step: str,
+    params: Dict[str, Any],
+    run_key: str,
+    shard_count: int = ETL_SHARDS,
+    workers: int = ETL_SHARD_WORKERS
+) -> int:
+    """
+    Split a step's customers into shards and wait until every shard is done.
+    
+    The shards are created in analytics_shard_leases under ``run_key`` and
+    this process works through them with ``workers`` threads; shard
+    workers on other machines (etl_aggregate.py --shard-worker) claim the
+    rest. Each shard writes a disjoint set of customers, so the merged
+    result does not depend on which worker ran which shard. Once no shard
+    is free, the call polls until shards leased elsewhere finish,
+    reclaiming any whose lease expired.
+    
+    Args:
+        step: Step name in SHARD_HANDLERS
+        params: Keyword arguments for the shard handler (JSON-serializable)
+        run_key: Key of the run; shards already done under it are skipped
+        shard_count: Number of shards (1..MAX_SHARDS)
+        workers: Shards processed at once by this process
+    
+    Returns:
+        Total rows written by all shards
+    
+    Raises:
+        RuntimeError: If a shard failed SHARD_MAX_ATTEMPTS times
+    """
+    if not 1 <= shard_count <= MAX_SHARDS:
+        raise ValueError(f"Shard count must be between 1 and {MAX_SHARDS}: {shard_count}")
+    handler = shard_handler(step)
+    if is_planning():
+        # One shard stands in for the step; its RPC is estimated, not run
+        handler(0, shard_count, run_key, **params)
+        return 0
+    
+    created = call_rpc_function('create_analytics_shards', {
+        'run_key_param': run_key,
+        'step_param': step,
+        'shard_count_param': shard_count,
+        'params_param': json.dumps(params, default=str),
+    }, read_only=False)
+    created = created[0]['create_analytics_shards'] if created else 0
+    logger.info(f"Running {step} as {shard_count} shards ({created} new) under {run_key}")
+    
+    with LeaseKeeper() as keeper:
+        while True:
+            # Worker threads inherit the step's time budget and query attribution
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='shard') as executor:
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run, _work, worker_name(slot), keeper, run_key, step
+                    )
+                    for slot in range(max(1, workers))
+                ]
+                processed = sum(future.result() for future in futures)
+            
+            progress = call_rpc_function('analytics_shard_progress', {
+                'run_key_param': run_key, 'step_param': step
+            }, read_only=False)[0]
+            if progress['failed']:
+                raise RuntimeError(
+                    f"{progress['failed']} of {progress['total']} {step} shards failed: "
+                    f"{progress['last_error']}"
+                )
+            if progress['done'] == progress['total']:
+                logger.info(f"All {progress['total']} {step} shards done: {progress['rows_processed']} rows")
+                return progress['rows_processed']
+            if not processed:
+                logger.info(
+                    f"Waiting for {step} shards: {progress['done']}/{progress['total']} done, "
+                    f"{progress['leased']} leased by other workers"
+                )
+                time.sleep(SHARD_POLL_INTERVAL)
+
+
+class ShardWorker:
+    """
+    Long-running worker that processes shards of any run, from any node.
+    
+    Mirrors the scheduler daemon: ``workers`` threads claim shards as they
+    appear and SIGTERM/SIGINT stop the worker once the shards in progress
+    finish.
+    """
+    
+    def __init__(self, workers: int = ETL_SHARD_WORKERS):
+        self.workers = max(1, workers)
+        self._stop = threading.Event()
+    
+    def stop(self, signum=None, frame=None):
+        """Ask the worker to exit once the shards in progress finish."""
+        if not self._stop.is_set():
+            reason = f"signal {signal.Signals(signum).name}" if signum else "stop()"
+            logger.info(f"Shutdown requested ({reason}); finishing shards in progress")
+        self._stop.set()
+    
+    def install_signal_handlers(self):
+        """Stop gracefully on SIGTERM and SIGINT (main thread only)."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+    
+    def _loop(self, slot: int, keeper: LeaseKeeper):
+        worker_id = worker_name(slot)
+        while not self._stop.is_set():
+            try:
+                lease = claim_shard(worker_id)
+            except Exception as e:
+                logger.error(f"Could not claim a shard: {e}")
+                lease = None
+            if lease is None:
+                self._stop.wait(SHARD_POLL_INTERVAL)
+                continue
+            with etl_step(lease.step):
+                process_shard(lease, keeper)
+    
+    def run_forever(self):
+        """Process shards until ``stop()`` is called or a stop signal arrives."""
+        logger.info(f"Shard worker started on {socket.gethostname()} with {self.workers} threads")
+        with LeaseKeeper() as keeper:
+            threads = [
+                threading.Thread(target=self._loop, args=(slot, keeper), name=f'shard-{slot}')
+                for slot in range(self.workers)
+            ]
+            for thread in threads:
+                thread.start()
+            # Join with a timeout so the main thread keeps handling signals
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1.0)
+        logger.info("Shard worker stopped")
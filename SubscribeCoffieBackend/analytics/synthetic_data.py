@@ -0,0 +1,369 @@
+"""Reproducible synthetic cafes, orders and funnel events for benchmark.py."""
+
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, List, Optional, Tuple
+from db_utils import bulk_load, execute_query, vacuum_analyze
+from config import BENCHMARK_SEED, FUNNEL_WINDOW_DAYS
+
+if TYPE_CHECKING:
+    # numpy and pandas are imported where they are used, to keep startup fast
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Dataset sizes, in orders
+SCALES = {
+    '10k': 10_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+
+# Synthetic rows are marked so they can be told apart from real data and
+# removed by clear_synthetic_data(); +7000 is not an assigned number range
+PHONE_PREFIX = '+7000'
+CAFE_ADDRESS = 'benchmark'
+CAFE_NAMESPACE = uuid.UUID('5b1c0ffe-0000-4000-8000-000000000000')
+
+# Orders span two years, so cohort (COHORT_MONTHS_BACK) and LTV windows are full
+HISTORY_DAYS = 730
+# Customers are generated (and loaded) in chunks, each from its own random
+# stream, so memory stays bounded and the data does not depend on chunk timing
+CUSTOMERS_PER_CHUNK = 100_000
+LOAD_BATCH_SIZE = 50_000
+
+# Orders per customer are 1 + negative binomial: about half the customers
+# never come back while a long tail orders every few days
+REPEAT_ORDERS_MEAN = 3.5
+REPEAT_ORDERS_SHAPE = 0.4
+# Mean days between a customer's orders ~ gamma(shape, scale)
+ORDER_GAP_SHAPE = 2.0
+ORDER_GAP_SCALE_DAYS = 9.0
+# Share of orders a customer places at their usual cafe
+HOME_CAFE_SHARE = 0.85
+CAFE_POPULARITY_EXPONENT = 0.8
+
+# Basket size in credits: lognormal per customer, with per-order noise
+BASKET_MEDIAN_CREDITS = 350
+BASKET_CUSTOMER_SIGMA = 0.5
+BASKET_ORDER_SIGMA = 0.25
+BONUS_USE_SHARE = 0.15
+BONUS_MAX_SHARE = 0.2
+
+ORDER_STATUSES = ('picked_up', 'canceled', 'refunded', 'no_show')
+ORDER_STATUS_WEIGHTS = (0.93, 0.04, 0.02, 0.01)
+
+# Share of orders per hour of day (UTC)
+HOUR_WEIGHTS = (
+    0, 0, 0, 0, 0, 0, 0, 6, 11, 12, 9, 7, 9, 9, 7, 5, 5, 5, 5, 4, 3, 2, 1, 0,
+)
+
+# Funnel events are generated for the last two funnel windows only: older
+# events are never read by the funnel analysis
+FUNNEL_STAGES = ('view_cafe', 'add_to_cart', 'checkout', 'payment', 'order_created', 'order_completed')
+# Minutes from the order, per stage, for sessions that end in an order
+FUNNEL_STAGE_OFFSETS = (-8.0, -6.0, -3.0, -1.0, 0.0, 15.0)
+ABANDONED_SESSIONS_PER_ORDER = 1.5
+# Last stage reached by abandoned sessions: view_cafe .. payment
+ABANDONED_STAGE_WEIGHTS = (0.45, 0.3, 0.15, 0.1)
+
+ORDER_COLUMNS = [
+    'cafe_id', 'customer_phone', 'status', 'subtotal_credits', 'bonus_used', 'paid_credits',
+    'created_at', 'updated_at',
+]
+FUNNEL_COLUMNS = ['customer_phone', 'event_type', 'cafe_id', 'session_id', 'created_at']
+
+
+@dataclass
+class SyntheticDataset:
+    """What seed_dataset() loaded, recorded with benchmark results."""
+    scale: str
+    seed: int
+    anchor: str
+    cafes: int = 0
+    customers: int = 0
+    orders: int = 0
+    funnel_events: int = 0
+    seconds: float = 0.0
+
+
+def cafe_count(orders: int) -> int:
+    """Number of cafes for a dataset: one per 10,000 orders, 10 to 1,000."""
+    return int(min(max(orders // 10_000, 10), 1_000))
+
+
+def cafe_ids(count: int) -> List[str]:
+    """Deterministic cafe ids, so repeated seeds produce identical rows."""
+    return [str(uuid.uuid5(CAFE_NAMESPACE, f'cafe-{index}')) for index in range(count)]
+
+
+def _cafe_weights(count: int):
+    import numpy as np
+    
+    weights = 1.0 / np.arange(1, count + 1) ** CAFE_POPULARITY_EXPONENT
+    return weights / weights.sum()
+
+
+def _timestamps(anchor, days_ago, hours=None):
+    """
+    Convert fractional days before the anchor to UTC timestamps.
+    
+    With ``hours`` (fractional hour of day per row), the time of day is
+    replaced and timestamps past the anchor move back one day.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    end = np.datetime64(anchor, 'us')
+    timestamps = end - (days_ago * 86_400_000_000).astype('timedelta64[us]')
+    if hours is not None:
+        timestamps = (
+            timestamps.astype('datetime64[D]').astype('datetime64[us]')
+            + (hours * 3_600_000_000).astype('timedelta64[us]')
+        )
+        timestamps = np.where(timestamps > end, timestamps - np.timedelta64(1, 'D'), timestamps)
+    return pd.DatetimeIndex(timestamps).tz_localize('UTC')
+
+
+def generate_orders_chunk(
+    chunk: int,
+    orders: int,
+    cafes: list,
+    anchor: datetime,
+    seed: int = BENCHMARK_SEED
+) -> Tuple['pd.DataFrame', int]:
+    """
+    Generate the orders of one chunk of customers.
+    
+    Args:
+        chunk: Chunk number; customers of chunk N are numbered from
+            N * CUSTOMERS_PER_CHUNK
+        orders: Maximum number of orders to generate (the last chunk is cut)
+        cafes: Cafe ids
+        anchor: "Now" of the dataset (naive UTC)
+        seed: Dataset random seed
+    
+    Returns:
+        (orders DataFrame, number of customers in the chunk)
+    """
+    import numpy as np
+    import pandas as pd
+    
+    rng = np.random.default_rng([seed, chunk])
+    p = REPEAT_ORDERS_SHAPE / (REPEAT_ORDERS_SHAPE + REPEAT_ORDERS_MEAN)
+    counts = 1 + rng.negative_binomial(REPEAT_ORDERS_SHAPE, p, CUSTOMERS_PER_CHUNK)
+    cumulative = np.cumsum(counts)
+    if cumulative[-1] > orders:
+        last = int(np.searchsorted(cumulative, orders))
+        counts = counts[:last + 1]
+        counts[-1] -= cumulative[last] - orders
+    customers = len(counts)
+    
+    # Customer attributes. First orders grow linearly towards the anchor, as
+    # a growing customer base would; a customer stays active for as long as
+    # their orders need at their own pace, so early customers churn
+    first_days_ago = HISTORY_DAYS * (1 - np.sqrt(rng.random(customers)))
+    mean_gap = rng.gamma(ORDER_GAP_SHAPE, ORDER_GAP_SCALE_DAYS, customers)
+    active_days = np.minimum((counts - 1) * mean_gap, first_days_ago)
+    weights = _cafe_weights(len(cafes))
+    home_cafe = rng.choice(len(cafes), customers, p=weights)
+    basket = BASKET_MEDIAN_CREDITS * rng.lognormal(0.0, BASKET_CUSTOMER_SIGMA, customers)
+    phone_numbers = chunk * CUSTOMERS_PER_CHUNK + np.arange(customers)
+    phones = PHONE_PREFIX + pd.Series(phone_numbers).astype(str).str.zfill(7)
+    
+    # Expand to one row per order; each customer's first order is at offset 0
+    customer = np.repeat(np.arange(customers), counts)
+    n = len(customer)
+    position = np.ones(n)
+    position[np.cumsum(counts)[:-1]] = 0.0
+    position[0] = 0.0
+    position *= rng.random(n)
+    days_ago = first_days_ago[customer] - position * active_days[customer]
+    hours = rng.choice(24, n, p=np.array(HOUR_WEIGHTS) / sum(HOUR_WEIGHTS)) + rng.random(n)
+    
+    away = rng.random(n) >= HOME_CAFE_SHARE
+    cafe = np.where(away, rng.choice(len(cafes), n, p=weights), home_cafe[customer])
+    subtotal = np.maximum(np.rint(basket[customer] * rng.lognormal(0.0, BASKET_ORDER_SIGMA, n)), 50)
+    bonus = np.where(
+        rng.random(n) < BONUS_USE_SHARE,
+        np.floor(subtotal * BONUS_MAX_SHARE * rng.random(n)),
+        0
+    )
+    status = rng.choice(len(ORDER_STATUSES), n, p=ORDER_STATUS_WEIGHTS)
+    created_at = _timestamps(anchor, days_ago, hours)
+    
+    df = pd.DataFrame({
+        'cafe_id': np.asarray(cafes, dtype=object)[cafe],
+        'customer_phone': phones.to_numpy()[customer],
+        'status': np.asarray(ORDER_STATUSES, dtype=object)[status],
+        'subtotal_credits': subtotal.astype(np.int64),
+        'bonus_used': bonus.astype(np.int64),
+        'paid_credits': (subtotal - bonus).astype(np.int64),
+        'created_at': created_at,
+        'updated_at': created_at + pd.to_timedelta(rng.integers(5, 40, n), unit='min'),
+    })
+    return df, customers
+
+
+def generate_funnel_chunk(orders: 'pd.DataFrame', chunk: int, anchor: datetime, seed: int = BENCHMARK_SEED):
+    """
+    Generate funnel events for the recent orders of one chunk.
+    
+    Every order gets a session running from view_cafe to order_created
+    (and order_completed once picked up); abandoned sessions of the same
+    customers stop at an earlier stage.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    rng = np.random.default_rng([seed, chunk, 1])
+    window_start = pd.Timestamp(anchor, tz='UTC') - pd.Timedelta(days=2 * FUNNEL_WINDOW_DAYS)
+    recent = orders[orders['created_at'] >= window_start]
+    if recent.empty:
+        return pd.DataFrame(columns=FUNNEL_COLUMNS)
+    
+    n = len(recent)
+    completed = (recent['status'] == 'picked_up').to_numpy()
+    order_stages = np.where(completed, len(FUNNEL_STAGES), len(FUNNEL_STAGES) - 1)
+    abandoned = rng.poisson(ABANDONED_SESSIONS_PER_ORDER * n)
+    source = rng.integers(0, n, abandoned)
+    abandoned_stages = 1 + rng.choice(
+        len(ABANDONED_STAGE_WEIGHTS), abandoned,
+        p=np.array(ABANDONED_STAGE_WEIGHTS) / sum(ABANDONED_STAGE_WEIGHTS)
+    )
+    
+    # Sessions: orders first, then abandoned sessions of the same customers
+    # spread over the window
+    session_row = np.concatenate([np.arange(n), source])
+    stages = np.concatenate([order_stages, abandoned_stages])
+    order_times = recent['created_at'].dt.tz_localize(None).to_numpy().astype('datetime64[us]')
+    abandoned_days = rng.uniform(0, 2 * FUNNEL_WINDOW_DAYS, abandoned)
+    session_start = np.concatenate([
+        order_times,
+        np.datetime64(anchor, 'us') - (abandoned_days * 86_400_000_000).astype('timedelta64[us]'),
+    ])
+    
+    session = np.repeat(np.arange(len(stages)), stages)
+    starts = np.repeat(np.cumsum(stages) - stages, stages)
+    stage = np.arange(len(session)) - starts
+    minutes = (
+        np.asarray(FUNNEL_STAGE_OFFSETS)[stage]
+        + rng.uniform(-0.5, 0.5, len(session))
+    )
+    created_at = session_start[session] + (minutes * 60_000_000).astype('timedelta64[us]')
+    created_at = np.minimum(created_at, np.datetime64(anchor, 'us'))
+    
+    return pd.DataFrame({
+        'customer_phone': recent['customer_phone'].to_numpy()[session_row][session],
+        'event_type': np.asarray(FUNNEL_STAGES, dtype=object)[stage],
+        'cafe_id': recent['cafe_id'].to_numpy()[session_row][session],
+        'session_id': f'bench-{chunk}-' + pd.Series(session).astype(str).to_numpy(dtype=object),
+        'created_at': pd.DatetimeIndex(created_at).tz_localize('UTC'),
+    })
+
+
+def clear_synthetic_data():
+    """Delete the rows loaded by seed_dataset() (order items cascade)."""
+    logger.info("Deleting synthetic benchmark data")
+    execute_query(
+        "DELETE FROM funnel_events WHERE customer_phone LIKE %s;", (f'{PHONE_PREFIX}%',), fetch=False
+    )
+    execute_query(
+        "DELETE FROM orders WHERE customer_phone LIKE %s;", (f'{PHONE_PREFIX}%',), fetch=False
+    )
+    execute_query("DELETE FROM cafes WHERE address = %s;", (CAFE_ADDRESS,), fetch=False)
+
+
+def count_other_orders() -> int:
+    """Orders that are not synthetic; they skew benchmark results."""
+    result = execute_query(
+        "SELECT count(*) AS count FROM orders WHERE customer_phone NOT LIKE %s;",
+        (f'{PHONE_PREFIX}%',)
+    )
+    return result[0]['count'] if result else 0
+
+
+def describe_dataset(scale: str, seed: int = BENCHMARK_SEED) -> SyntheticDataset:
+    """Describe synthetic data already in the database (benchmark.py --no-seed)."""
+    result = execute_query("""
+        SELECT
+            (SELECT count(*) FROM cafes WHERE address = %s) AS cafes,
+            (SELECT count(DISTINCT customer_phone) FROM orders WHERE customer_phone LIKE %s) AS customers,
+            (SELECT count(*) FROM orders WHERE customer_phone LIKE %s) AS orders,
+            (SELECT count(*) FROM funnel_events WHERE customer_phone LIKE %s) AS funnel_events,
+            (SELECT max(created_at) FROM orders WHERE customer_phone LIKE %s) AS anchor;
+    """, (CAFE_ADDRESS,) + (f'{PHONE_PREFIX}%',) * 4)
+    row = result[0]
+    anchor = row['anchor'].isoformat() if row['anchor'] else ''
+    return SyntheticDataset(
+        scale, seed, anchor, row['cafes'], row['customers'], row['orders'], row['funnel_events']
+    )
+
+
+def seed_dataset(
+    scale: str,
+    seed: int = BENCHMARK_SEED,
+    anchor: Optional[datetime] = None
+) -> SyntheticDataset:
+    """
+    Replace the synthetic data in the database with a dataset of ``scale``.
+    
+    The same scale and seed always produce the same customers, orders and
+    funnel events relative to ``anchor``, so results of different runs
+    (and branches) are comparable. Rows are loaded through bulk_load()
+    in chunks, then the database is analyzed so plans match production.
+    
+    Args:
+        scale: Key of SCALES ('10k', '1m', '10m')
+        seed: Random seed
+        anchor: "Now" of the dataset, in UTC (default: now)
+    
+    Returns:
+        Row counts and load time of the dataset
+    """
+    if scale not in SCALES:
+        raise ValueError(f"Unknown benchmark scale: {scale} (expected one of {', '.join(SCALES)})")
+    import pandas as pd
+    
+    target = SCALES[scale]
+    anchor = (anchor or datetime.now(timezone.utc)).astimezone(timezone.utc).replace(tzinfo=None)
+    dataset = SyntheticDataset(scale, seed, anchor.isoformat())
+    start = time.perf_counter()
+    
+    clear_synthetic_data()
+    cafes = cafe_ids(cafe_count(target))
+    dataset.cafes = bulk_load('cafes', pd.DataFrame({
+        'id': cafes,
+        'name': [f'Benchmark Cafe {index + 1}' for index in range(len(cafes))],
+        'address': CAFE_ADDRESS,
+        'mode': 'open',
+    }), mode='append')
+    
+    logger.info(f"Generating {target:,} orders ({scale}, seed {seed}) with {len(cafes)} cafes")
+    chunk = 0
+    while dataset.orders < target:
+        orders, customers = generate_orders_chunk(chunk, target - dataset.orders, cafes, anchor, seed)
+        funnel = generate_funnel_chunk(orders, chunk, anchor, seed)
+        dataset.orders += bulk_load(
+            'orders', orders, mode='append', columns=ORDER_COLUMNS, batch_size=LOAD_BATCH_SIZE
+        )
+        dataset.funnel_events += bulk_load(
+            'funnel_events', funnel, mode='append', columns=FUNNEL_COLUMNS, batch_size=LOAD_BATCH_SIZE
+        )
+        dataset.customers += customers
+        chunk += 1
+        logger.info(
+            f"Loaded {dataset.orders:,}/{target:,} orders, {dataset.funnel_events:,} funnel events "
+            f"({time.perf_counter() - start:.0f}s)"
+        )
+    
+    vacuum_analyze()
+    dataset.seconds = round(time.perf_counter() - start, 3)
+    logger.info(
+        f"Seeded {scale}: {dataset.cafes} cafes, {dataset.customers:,} customers, "
+        f"{dataset.orders:,} orders, {dataset.funnel_events:,} funnel events in {dataset.seconds:.0f}s"
+    )
+    return dataset
@@ -0,0 +1,126 @@
+#!/bin/bash
+
+# Analytics Startup Tests
+# Проверка, что импорт модулей analytics/ быстрый и без побочных эффектов
+
+set -e
+
+echo "========================================="
+echo "Analytics Startup Tests"
+echo "========================================="
+echo ""
+
+# Цвета для вывода
+GREEN='\033[0;32m'
+RED='\033[0;31m'
+NC='\033[0m' # No Color
+
+ANALYTICS_DIR="$(cd "$(dirname "$0")/../analytics" && pwd)"
+PYTHON="${PYTHON:-python3}"
+# Бюджет на импорт одного entry point (без pandas), мс
+STARTUP_BUDGET_MS="${STARTUP_BUDGET_MS:-300}"
+# Лучший из N запусков, чтобы не зависеть от холодного кэша
+RUNS=3
+
+cd "$ANALYTICS_DIR"
+
+# Импорт не должен требовать настроенной базы
+unset DATABASE_URL SUPABASE_URL SUPABASE_SERVICE_KEY
+
+failures=0
+
+pass() { echo -e "${GREEN}✅ PASS: $1${NC}"; }
+fail() { echo -e "${RED}❌ FAIL: $1${NC}"; failures=$((failures + 1)); }
+
+echo "Test 1: Modules import without environment, log files or pandas"
+echo ""
+
+logs_before=$(ls logs 2>/dev/null | sort)
+
+for module in etl_aggregate export_data etl_churn etl_cohort etl_funnel etl_customer_stats benchmark synthetic_data rfm_engine; do
+  if "$PYTHON" -c "
+import sys
+import $module
+sys.exit(1 if 'pandas' in sys.modules else 0)
+" 2>/dev/null; then
+    pass "import $module"
+  else
+    fail "import $module (import error or pandas imported eagerly)"
+  fi
+done
+
+logs_after=$(ls logs 2>/dev/null | sort)
+if [ "$logs_before" = "$logs_after" ]; then
+  pass "imports created no log files"
+else
+  fail "imports created log files"
+fi
+
+echo ""
+echo "Test 1b: Imports with QUERY_LOG_FILE set create no log files"
+echo ""
+
+logs_dir_existed=$([ -d logs ] && echo yes || echo no)
+if QUERY_LOG_FILE=startup_test_queries.jsonl "$PYTHON" -c "
+import etl_aggregate, export_data, db_utils, query_metrics
+" 2>/dev/null; then
+  pass "import with QUERY_LOG_FILE"
+else
+  fail "import with QUERY_LOG_FILE"
+fi
+
+if [ -e logs/startup_test_queries.jsonl ]; then
+  rm -f logs/startup_test_queries.jsonl
+  fail "imports created the query log"
+elif [ "$logs_dir_existed" = "no" ] && [ -d logs ]; then
+  fail "imports created the logs directory"
+else
+  pass "imports created no query log"
+fi
+
+echo ""
+echo "Test 2: Import time of entry points"
+echo "Expected: < ${STARTUP_BUDGET_MS}ms (best of $RUNS)"
+echo ""
+
+for module in etl_aggregate export_data; do
+  best=""
+  for i in $(seq 1 $RUNS); do
+    duration=$("$PYTHON" -c "
+import time
+start = time.perf_counter()
+import $module
+print(int((time.perf_counter() - start) * 1000))
+")
+    if [ -z "$best" ] || [ "$duration" -lt "$best" ]; then
+      best=$duration
+    fi
+  done
+  echo "  $module: ${best}ms"
+  if [ "$best" -lt "$STARTUP_BUDGET_MS" ]; then
+    pass "$module imports in < ${STARTUP_BUDGET_MS}ms"
+  else
+    fail "$module imports in ${best}ms (budget ${STARTUP_BUDGET_MS}ms)"
+  fi
+done
+
+echo ""
+echo "Test 3: --help works without a database"
+echo ""
+
+for script in etl_aggregate.py export_data.py benchmark.py; do
+  if "$PYTHON" "$script" --help > /dev/null; then
+    pass "$script --help"
+  else
+    fail "$script --help"
+  fi
+done
+
+echo ""
+echo "========================================="
+if [ $failures -eq 0 ]; then
+  echo -e "${GREEN}All analytics startup tests passed${NC}"
+else
+  echo -e "${RED}$failures analytics startup test(s) failed${NC}"
+  exit 1
+fi